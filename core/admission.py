@@ -0,0 +1,235 @@
+"""
+Admission control state shared by every worker process on a host.
+
+The state lives in a small memory-mapped file guarded by an exclusive `flock`
+(between processes) taken under a process lock (between the threads of a
+process, which share the file descriptor and so the `flock`):
+
+- per endpoint class counters: admitted, shed for concurrency, shed for rate
+- per process slots: pid + in-flight requests per endpoint class, so requests of a
+worker that died mid-flight can be discarded instead of leaking forever
+- a fixed table of token buckets addressed by a hash of (endpoint class, client):
+a client's bucket is one of `BUCKET_WAYS` neighbouring slots, and a new client
+takes over the one updated the longest ago
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+COUNTER = struct.Struct("q")
+BUCKET = struct.Struct("Qdd")
+
+STAT_ADMITTED = 0
+STAT_SHED_CONCURRENCY = 1
+STAT_SHED_RATE = 2
+STATS_PER_CLASS = 3
+# slots a bucket may be stored in
+BUCKET_WAYS = 4
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedAdmissionState:
+    def __init__(self, path, class_names, process_slots=128, bucket_slots=4096):
+        self.class_names = list(class_names)
+        self.process_slots = process_slots
+        self.bucket_slots = bucket_slots
+
+        self.processes_offset = len(self.class_names) * STATS_PER_CLASS * COUNTER.size
+        self.process_size = (1 + len(self.class_names)) * COUNTER.size
+        self.buckets_offset = self.processes_offset + process_slots * self.process_size
+        self.size = self.buckets_offset + bucket_slots * BUCKET.size
+
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._locked():
+            if os.fstat(self.fd).st_size != self.size:
+                # a different layout (or a new file): start from a clean state
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, self.size)
+        self.buffer = mmap.mmap(self.fd, self.size)
+        self.slot = None
+
+    @contextmanager
+    def _locked(self):
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _read(self, offset):
+        return COUNTER.unpack_from(self.buffer, offset)[0]
+
+    def _add(self, offset, value):
+        COUNTER.pack_into(self.buffer, offset, self._read(offset) + value)
+
+    def _stat_offset(self, class_index, stat):
+        return (class_index * STATS_PER_CLASS + stat) * COUNTER.size
+
+    def _in_flight_offset(self, slot, class_index):
+        return (
+            self.processes_offset
+            + slot * self.process_size
+            + (1 + class_index) * (COUNTER.size)
+        )
+
+    def _process_slot(self):
+        """returns the slot of this process, claiming a free (or dead) one if needed"""
+        if self.slot is not None:
+            return self.slot
+
+        free = None
+        for slot in range(self.process_slots):
+            offset = self.processes_offset + slot * self.process_size
+            pid = self._read(offset)
+            if pid == self.pid:
+                free = slot
+                break
+            if free is None and (pid == 0 or not pid_alive(pid)):
+                free = slot
+        if free is None:
+            raise RuntimeError("No free admission control process slot")
+
+        offset = self.processes_offset + free * self.process_size
+        self.buffer[offset : offset + self.process_size] = bytes(self.process_size)
+        COUNTER.pack_into(self.buffer, offset, self.pid)
+        self.slot = free
+        return free
+
+    def _in_flight(self, class_index, sweep=False):
+        total = 0
+        for slot in range(self.process_slots):
+            offset = self.processes_offset + slot * self.process_size
+            pid = self._read(offset)
+            if pid == 0:
+                continue
+            if sweep and pid != self.pid and not pid_alive(pid):
+                self.buffer[offset : offset + self.process_size] = bytes(
+                    self.process_size
+                )
+                continue
+            total += self._read(self._in_flight_offset(slot, class_index))
+        return total
+
+    def acquire(self, class_name, max_concurrency):
+        """returns True when a request of `class_name` may start"""
+        class_index = self.class_names.index(class_name)
+        with self._locked():
+            slot = self._process_slot()
+            if max_concurrency is not None and (
+                self._in_flight(class_index) >= max_concurrency
+                # only pay for the liveness checks when we are about to shed
+                and self._in_flight(class_index, sweep=True) >= max_concurrency
+            ):
+                self._add(self._stat_offset(class_index, STAT_SHED_CONCURRENCY), 1)
+                return False
+            self._add(self._in_flight_offset(slot, class_index), 1)
+            self._add(self._stat_offset(class_index, STAT_ADMITTED), 1)
+            return True
+
+    def release(self, class_name):
+        class_index = self.class_names.index(class_name)
+        with self._locked():
+            offset = self._in_flight_offset(self._process_slot(), class_index)
+            if self._read(offset) > 0:
+                self._add(offset, -1)
+
+    def _bucket_offset(self, key):
+        """the slot holding the bucket of `key`, otherwise the one to replace"""
+        first = key % self.bucket_slots
+        oldest, oldest_updated = None, None
+        for way in range(min(BUCKET_WAYS, self.bucket_slots)):
+            offset = (
+                self.buckets_offset + (first + way) % self.bucket_slots * BUCKET.size
+            )
+            stored_key, _, updated = BUCKET.unpack_from(self.buffer, offset)
+            if stored_key == key:
+                return offset
+            if oldest is None or updated < oldest_updated:
+                oldest, oldest_updated = offset, updated
+        return oldest
+
+    def consume(self, class_name, client, rate, burst):
+        """
+        - takes one token from the bucket of `client` for `class_name`
+
+        - returns 0 when the request is allowed, otherwise the seconds to wait
+        until a token becomes available
+        """
+        class_index = self.class_names.index(class_name)
+        digest = hashlib.blake2b(
+            f"{class_name}:{client}".encode(), digest_size=8
+        ).digest()
+        key = int.from_bytes(digest, "little") or 1
+        now = time.time()
+
+        with self._locked():
+            offset = self._bucket_offset(key)
+            stored_key, tokens, updated = BUCKET.unpack_from(self.buffer, offset)
+            if stored_key != key:
+                # a new bucket, in place of an empty or the least recently used one
+                tokens, updated = float(burst), now
+            tokens = min(float(burst), tokens + (now - updated) * rate)
+
+            if tokens >= 1:
+                BUCKET.pack_into(self.buffer, offset, key, tokens - 1, now)
+                return 0
+            BUCKET.pack_into(self.buffer, offset, key, tokens, now)
+            self._add(self._stat_offset(class_index, STAT_SHED_RATE), 1)
+            return (1 - tokens) / rate
+
+    def stats(self):
+        with self._locked():
+            return {
+                class_name: {
+                    "in_flight": self._in_flight(class_index),
+                    "admitted": self._read(
+                        self._stat_offset(class_index, STAT_ADMITTED)
+                    ),
+                    "shed_concurrency": self._read(
+                        self._stat_offset(class_index, STAT_SHED_CONCURRENCY)
+                    ),
+                    "shed_rate": self._read(
+                        self._stat_offset(class_index, STAT_SHED_RATE)
+                    ),
+                }
+                for class_index, class_name in enumerate(self.class_names)
+            }
+
+
+_state = None
+
+
+def get_state(config):
+    """
+    - returns the admission state of the current process
+
+    - the file is (re)opened after a fork, since an inherited `flock` would be
+    shared with the parent and would not exclude it
+    """
+    global _state
+    if _state is None or _state.pid != os.getpid():
+        _state = SharedAdmissionState(
+            config["STATE_FILE"],
+            config["CLASSES"].keys(),
+            process_slots=config.get("PROCESS_SLOTS", 128),
+            bucket_slots=config.get("BUCKET_SLOTS", 4096),
+        )
+    return _state
@@ -0,0 +1,46 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import authentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from core import identity
+
+
+class JWTAuthentication(authentication.JWTAuthentication):
+    """
+    - loads the user of the token through the request's identity map: a user
+    already looked up in the request (or authenticated again, e.g. by another
+    authentication pass) costs no query, and later lookups reuse this instance
+
+    - the checks are those of simplejwt's get_user
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as error:
+            raise InvalidToken(
+                _("Token contained no recognizable user identification")
+            ) from error
+
+        try:
+            user = identity.get(
+                self.user_model, **{api_settings.USER_ID_FIELD: user_id}
+            )
+        except self.user_model.DoesNotExist as error:
+            raise AuthenticationFailed(
+                _("User not found"), code="user_not_found"
+            ) from error
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+            api_settings.REVOKE_TOKEN_CLAIM
+        ) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(
+                _("The user's password has been changed."), code="password_changed"
+            )
+
+        return user
@@ -0,0 +1,358 @@
+"""
+Per-view database budgets, enforced by `core.middleware.QueryBudgetMiddleware`.
+
+Views declare what one request may cost, per action:
+
+    class ProductViewSet(ModelViewSet):
+        query_budgets = {"list": {"queries": 6, "db_time": 0.2}}
+
+- `queries`: statements executed, `db_time`: seconds spent in them (None: no
+limit), `statement_timeout`: seconds a single statement may run. What a view
+leaves out comes from `QUERY_BUDGETS["DEFAULT"]`
+
+- `QUERY_BUDGETS["MODE"]`: "log" warns about the requests over budget; "reject"
+also stops safe (GET / HEAD) requests at the statement that would exceed it,
+with a 503 (writes are only logged, stopping them midway would leave partial
+work); "raise" fails them with QueryBudgetError once they ran, for tests (the
+test client raises it, a server would answer 503); "off"
+
+- statement timeouts go through the backend: a MAX_EXECUTION_TIME hint on MySQL
+SELECTs, a progress handler interrupting SQLite statements (other backends have
+none). A statement over its limit fails the request with a 503
+
+- the sub-requests of a batch (store.views.BatchViewSet) are each held to the
+budget of their own view
+
+- each process keeps the cost of every view and writes it to
+`QUERY_BUDGETS["DIRECTORY"]` every `FLUSH_INTERVAL` seconds; `report()`
+(`manage.py query_budget_report`, /query-budgets/) ranks the views of the
+running processes by how close they came to their budgets
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.signals import got_request_exception
+from django.db import DatabaseError, connections
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core.admission import pid_alive
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ("GET", "HEAD")
+# ER_QUERY_TIMEOUT, raised when MAX_EXECUTION_TIME interrupts a statement
+MYSQL_QUERY_TIMEOUT = 3024
+# sqlite virtual machine instructions between two deadline checks
+SQLITE_PROGRESS_STEPS = 10000
+
+# view name -> counters of this process
+_stats = {}
+_lock = threading.Lock()
+_flushed_at = 0.0
+
+
+def config(name, default=None):
+    return getattr(settings, "QUERY_BUDGETS", {}).get(name, default)
+
+
+class QueryBudgetExceeded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The request exceeded its database budget."
+    default_code = "query_budget_exceeded"
+
+
+class StatementTimeout(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "A database query took too long."
+    default_code = "statement_timeout"
+
+
+class QueryBudgetError(Exception):
+    """a request over its budget, in the "raise" mode of tests"""
+
+
+def error_response(request):
+    """
+    - the response to a request failed by QueryBudgetError, called where it is
+    caught: a 503, as an uncaught error would answer 500
+
+    - got_request_exception is sent as for an uncaught error, so the test client
+    raises it again
+    """
+    got_request_exception.send(sender=None, request=request)
+    return JsonResponse(
+        {
+            "detail": QueryBudgetExceeded.default_detail,
+            "code": QueryBudgetExceeded.default_code,
+        },
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+
+def view_budget(view_func, method):
+    """(name, budget) of the view handling a request"""
+    cls = getattr(view_func, "cls", None)
+    if cls is None:
+        return f"{view_func.__module__}.{view_func.__qualname__}", config("DEFAULT", {})
+    # viewsets map methods to actions, api views are named after their method
+    action = (getattr(view_func, "actions", None) or {}).get(method.lower())
+    action = action or method.lower()
+    declared = getattr(cls, "query_budgets", {}).get(action, {})
+    return (
+        f"{cls.__module__}.{cls.__name__}.{action}",
+        {**config("DEFAULT", {}), **declared},
+    )
+
+
+@contextmanager
+def _sqlite_deadline(connection, deadline):
+    # a non-zero return interrupts the statement ("interrupted" OperationalError)
+    connection.connection.set_progress_handler(
+        lambda: time.perf_counter() > deadline, SQLITE_PROGRESS_STEPS
+    )
+    try:
+        yield
+    finally:
+        connection.connection.set_progress_handler(None, 0)
+
+
+@contextmanager
+def counting(request_budget):
+    """counts the statements of this thread, on every connection, in `request_budget`"""
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(request_budget))
+        yield
+
+
+class RequestBudget:
+    """
+    - the database work of one request, counted by an execute wrapper installed
+    on every connection
+
+    - `name` and `budget` are those of the default budget until the view is
+    resolved
+    """
+
+    def __init__(self, method, mode):
+        self.method = method
+        self.mode = mode
+        self.name = None
+        self.budget = config("DEFAULT", {})
+        self.queries = 0
+        self.db_time = 0.0
+        self.rejected = False
+        self.timeouts = 0
+
+    def exceeded(self, queries=None):
+        queries = self.queries if queries is None else queries
+        max_queries = self.budget.get("queries")
+        max_db_time = self.budget.get("db_time")
+        return (max_queries is not None and queries > max_queries) or (
+            max_db_time is not None and self.db_time > max_db_time
+        )
+
+    def limit(self, connection, sql, timeout):
+        if connection.vendor == "mysql" and sql.startswith("SELECT "):
+            milliseconds = max(1, int(timeout * 1000))
+            return f"SELECT /*+ MAX_EXECUTION_TIME({milliseconds}) */ {sql[7:]}"
+        return sql
+
+    def timed_out(self, connection, error, seconds, timeout):
+        if connection.vendor == "mysql":
+            return bool(error.args) and error.args[0] == MYSQL_QUERY_TIMEOUT
+        if connection.vendor == "sqlite":
+            return "interrupted" in str(error) and seconds >= timeout
+        return False
+
+    def __call__(self, execute, sql, params, many, context):
+        if (
+            self.mode == "reject"
+            and self.method in SAFE_METHODS
+            and self.exceeded(self.queries + 1)
+        ):
+            self.rejected = True
+            raise QueryBudgetExceeded()
+
+        connection = context["connection"]
+        timeout = self.budget.get("statement_timeout")
+        started = time.perf_counter()
+        try:
+            if not timeout:
+                return execute(sql, params, many, context)
+            if connection.vendor == "sqlite":
+                with _sqlite_deadline(connection, started + timeout):
+                    return execute(sql, params, many, context)
+            return execute(self.limit(connection, sql, timeout), params, many, context)
+        except DatabaseError as error:
+            seconds = time.perf_counter() - started
+            if timeout and self.timed_out(connection, error, seconds, timeout):
+                self.timeouts += 1
+                logger.warning(
+                    "%s: statement interrupted after %.3fs: %s",
+                    self.name,
+                    seconds,
+                    sql[:200],
+                )
+                raise StatementTimeout() from error
+            raise
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - started
+
+    def finish(self):
+        """records the request, then logs it (or raises) when over budget"""
+        if self.name is None:
+            # not routed to a view (404, rejected by a middleware...)
+            return
+        over = self.exceeded()
+        record(self)
+        if not over:
+            return
+        message = (
+            f"{self.name} ({self.method}) over its query budget: "
+            f"{self.queries} queries (budget {self.budget.get('queries')}), "
+            f"{self.db_time:.3f}s (budget {self.budget.get('db_time')})"
+        )
+        if self.mode == "raise":
+            logger.error(message)
+            raise QueryBudgetError(message)
+        logger.warning(message)
+
+
+def record(request_budget):
+    with _lock:
+        stats = _stats.setdefault(
+            request_budget.name,
+            {
+                "requests": 0,
+                "over_budget": 0,
+                "rejected": 0,
+                "timeouts": 0,
+                "total_queries": 0,
+                "max_queries": 0,
+                "total_db_time": 0.0,
+                "max_db_time": 0.0,
+            },
+        )
+        stats["budget"] = request_budget.budget
+        stats["requests"] += 1
+        stats["over_budget"] += request_budget.exceeded()
+        stats["rejected"] += request_budget.rejected
+        stats["timeouts"] += request_budget.timeouts
+        stats["total_queries"] += request_budget.queries
+        stats["max_queries"] = max(stats["max_queries"], request_budget.queries)
+        stats["total_db_time"] += request_budget.db_time
+        stats["max_db_time"] = max(stats["max_db_time"], request_budget.db_time)
+        due = time.monotonic() - _flushed_at >= config("FLUSH_INTERVAL", 30)
+    if due:
+        flush()
+
+
+def flush():
+    """writes the counters of this process to `DIRECTORY`/<pid>.json"""
+    global _flushed_at
+    directory = config("DIRECTORY")
+    if not directory:
+        return
+    with _lock:
+        _flushed_at = time.monotonic()
+        content = json.dumps(_stats)
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as file:
+        file.write(content)
+    os.replace(path, os.path.join(directory, f"{os.getpid()}.json"))
+
+
+def _utilization(stats):
+    budget = stats["budget"]
+    ratios = [
+        stats[spent] / budget[limit]
+        for spent, limit in (("max_queries", "queries"), ("max_db_time", "db_time"))
+        if budget.get(limit)
+    ]
+    return round(max(ratios), 3) if ratios else None
+
+
+def report():
+    """
+    - the views ranked by the largest fraction of a budget one of their requests
+    used (over 1 for a request over budget), merged across the running
+    processes that wrote to `DIRECTORY` since it was last reset: the files of
+    the processes that exited are deleted
+
+    - [{name, budget, requests, over_budget, rejected, timeouts, mean_queries,
+    max_queries, mean_db_time, max_db_time, utilization}]
+    """
+    flush()
+    directory = config("DIRECTORY")
+    merged = {}
+    for filename in sorted(os.listdir(directory)) if directory else []:
+        if not filename.endswith(".json"):
+            continue
+        pid = filename[: -len(".json")]
+        if pid.isdigit() and not pid_alive(int(pid)):
+            # a pid is reused by a new process once this one is gone
+            try:
+                os.remove(os.path.join(directory, filename))
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as file:
+                process_stats = json.load(file)
+        except (OSError, ValueError):
+            # being replaced
+            continue
+        for name, stats in process_stats.items():
+            if name not in merged:
+                merged[name] = stats
+                continue
+            total = merged[name]
+            for key in ("requests", "over_budget", "rejected", "timeouts"):
+                total[key] += stats[key]
+            for key in ("total_queries", "total_db_time"):
+                total[key] += stats[key]
+            for key in ("max_queries", "max_db_time"):
+                total[key] = max(total[key], stats[key])
+
+    rows = []
+    for name, stats in merged.items():
+        requests = stats["requests"] or 1
+        rows.append(
+            {
+                "name": name,
+                "budget": stats["budget"],
+                "requests": stats["requests"],
+                "over_budget": stats["over_budget"],
+                "rejected": stats["rejected"],
+                "timeouts": stats["timeouts"],
+                "mean_queries": round(stats["total_queries"] / requests, 1),
+                "max_queries": stats["max_queries"],
+                "mean_db_time": round(stats["total_db_time"] / requests, 4),
+                "max_db_time": round(stats["max_db_time"], 4),
+                "utilization": _utilization(stats),
+            }
+        )
+    return sorted(rows, key=lambda row: -(row["utilization"] or 0))
+
+
+def reset():
+    """forgets the counters of every process"""
+    with _lock:
+        _stats.clear()
+    directory = config("DIRECTORY")
+    if directory and os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            if filename.endswith(".json"):
+                os.remove(os.path.join(directory, filename))
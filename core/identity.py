@@ -0,0 +1,138 @@
+"""
+Request-scoped identity map, activated by `core.middleware.IdentityMapMiddleware`.
+
+`get(Model, field=value)` loads a row by its primary key or a unique field at
+most once per request: later lookups of the same row, by any of its unique
+fields, return the same instance without a query. Misses are remembered too, so
+existence checks repeated by validators and views cost one query.
+
+- invalidation is explicit: code that writes or deletes a row it may have
+looked up calls `forget(instance)` (or `forget(Model, pk)`)
+
+- instances are shared within the request: callers mutating one should save it
+or forget it
+
+- outside of a request (commands, signals run from the shell...) lookups go to
+the database every time
+
+- the lookup is passed to the database routers as a `lookup` hint, e.g. for
+carts routed by their id (store.sharding)
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_MISSING = object()
+_current = ContextVar("identity_map", default=None)
+
+
+class IdentityMap:
+    def __init__(self):
+        # (model label, field name, value) -> instance, or None for a miss
+        self.rows = {}
+
+    @staticmethod
+    def _key(model, field, value):
+        return (model._meta.label, field.name, field.to_python(value))
+
+    @staticmethod
+    def _field(model, name):
+        field = model._meta.pk if name == "pk" else model._meta.get_field(name)
+        if not (field.primary_key or field.unique):
+            raise ValueError(f"{model._meta.label}.{field.name} is not unique")
+        return field
+
+    def get(self, model, **lookup):
+        ((name, value),) = lookup.items()
+        field = self._field(model, name)
+        key = self._key(model, field, value)
+        instance = self.rows.get(key, _MISSING)
+        if instance is _MISSING:
+            instance = _queryset(model, field.attname, value).first()
+            if instance is None:
+                self.rows[key] = None
+            else:
+                self.add(instance)
+        if instance is None:
+            raise model.DoesNotExist(
+                f"{model._meta.object_name} matching query does not exist."
+            )
+        return instance
+
+    def add(self, instance):
+        """registers `instance` under its primary key and unique fields"""
+        for field in instance._meta.concrete_fields:
+            if field.primary_key or field.unique:
+                value = getattr(instance, field.attname)
+                if value is not None:
+                    self.rows[self._key(type(instance), field, value)] = instance
+
+    def forget(self, model, pk):
+        label = model._meta.label
+        instance = self.rows.get(self._key(model, model._meta.pk, pk))
+        self.rows = {
+            key: row
+            for key, row in self.rows.items()
+            # the misses of the model too: the write may have created the row
+            if key[0] != label or (row is not None and row is not instance)
+        }
+
+
+def _queryset(model, name, value):
+    lookup = {name: value}
+    return model._default_manager.db_manager(hints={"lookup": lookup}).filter(**lookup)
+
+
+@contextmanager
+def scope():
+    token = _current.set(IdentityMap())
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def get(model, **lookup):
+    """`model.objects.get(**lookup)` on one unique field, through the identity map"""
+    identity_map = _current.get()
+    if identity_map is None:
+        ((name, value),) = lookup.items()
+        if name == "pk":
+            name = model._meta.pk.attname
+        return _queryset(model, name, value).get()
+    return identity_map.get(model, **lookup)
+
+
+def add(instance):
+    identity_map = _current.get()
+    if identity_map is not None:
+        identity_map.add(instance)
+
+
+def exists(model, **lookup):
+    try:
+        get(model, **lookup)
+    except model.DoesNotExist:
+        return False
+    return True
+
+
+def forget(instance_or_model, pk=None):
+    identity_map = _current.get()
+    if identity_map is None:
+        return
+    if pk is None:
+        instance_or_model, pk = type(instance_or_model), instance_or_model.pk
+    identity_map.forget(instance_or_model, pk)
+
+
+class IdentityMapViewSetMixin:
+    """forgets the instance updated or deleted by a model viewset"""
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        forget(serializer.instance)
+
+    def perform_destroy(self, instance):
+        forget(instance)
+        super().perform_destroy(instance)
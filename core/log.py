@@ -0,0 +1,163 @@
+"""
+Non-blocking logging pipeline.
+
+Request threads only put records on an in-memory queue (`QueueFileHandler`); a
+background thread drains the queue in batches, formats the records as JSON lines
+and appends them to a size-rotated file.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    - keeps only a fraction of the records of high-volume loggers, e.g.
+    {"django.db.backends": 0.01} keeps one sql record out of a hundred
+
+    - the most specific logger prefix wins, and records at `always_level` or above
+    (warnings by default) are never dropped
+    """
+
+    def __init__(self, rates=None, always_level=logging.WARNING):
+        super().__init__()
+        self.rates = sorted((rates or {}).items(), key=lambda item: -len(item[0]))
+        self.always_level = always_level
+
+    def rate_for(self, name):
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + "."):
+                return rate
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno >= self.always_level:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1 or random.random() < rate
+
+
+class QueueFileHandler(logging.handlers.QueueHandler):
+    """
+    - enqueues records for a background writer thread instead of doing file i/o in
+    the calling (request) thread
+
+    - the writer drains up to `batch_size` records at a time and writes them with a
+    single write + flush to a `RotatingFileHandler` target
+    """
+
+    def __init__(
+        self, filename, max_bytes=10 * 1024 * 1024, backup_count=5, batch_size=256
+    ):
+        super().__init__(queue.SimpleQueue())
+        self.target = logging.handlers.RotatingFileHandler(
+            filename, maxBytes=max_bytes, backupCount=backup_count
+        )
+        self.target.setFormatter(JSONFormatter())
+        self.batch_size = batch_size
+        self._stopped = object()
+        self._writer = None
+        self._writer_pid = None
+        atexit.register(self.close)
+
+    def _start_writer(self):
+        # started lazily, and again after a fork (e.g. gunicorn --preload), since
+        # threads do not survive into the child process
+        self.queue = queue.SimpleQueue()
+        self._writer_pid = os.getpid()
+        self._writer = threading.Thread(
+            target=self._write_batches, name="log-writer", daemon=True
+        )
+        self._writer.start()
+
+    def enqueue(self, record):
+        if self._writer_pid != os.getpid():
+            with self.lock:
+                if self._writer_pid != os.getpid():
+                    self._start_writer()
+        self.queue.put_nowait(record)
+
+    def prepare(self, record):
+        # only merge the message arguments here (they may be mutated once we
+        # return); json formatting and tracebacks are left to the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def _write_batches(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopping = self._stopped in batch
+            records = [record for record in batch if record is not self._stopped]
+            if records:
+                self._write(records)
+            if stopping:
+                return
+
+    def _write(self, records):
+        target = self.target
+        lines = []
+        for record in records:
+            try:
+                lines.append(target.format(record))
+            except Exception:
+                target.handleError(record)
+        if not lines:
+            return
+
+        data = "\n".join(lines) + "\n"
+        target.acquire()
+        try:
+            if target.maxBytes and target.stream.tell() + len(data) >= target.maxBytes:
+                target.doRollover()
+            target.stream.write(data)
+            target.stream.flush()
+        except Exception:
+            target.handleError(records[-1])
+        finally:
+            target.release()
+
+    def close(self):
+        if (
+            self._writer is not None
+            and self._writer_pid == os.getpid()
+            and self._writer.is_alive()
+        ):
+            self.queue.put_nowait(self._stopped)
+            self._writer.join()
+            self.target.close()
+        super().close()
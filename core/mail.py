@@ -0,0 +1,181 @@
+import base64
+import logging
+import random
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(content):
+    if isinstance(content, bytes):
+        return {"base64": base64.b64encode(content).decode()}
+    return {"text": content}
+
+
+def _decode(content):
+    if "base64" in content:
+        return base64.b64decode(content["base64"])
+    return content["text"]
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """
+    - stores messages in the OutboxEmail table instead of talking to the mail
+    server, so sending an email costs one insert in the request transaction (and
+    is rolled back with it)
+
+    - the `send_outbox` command delivers them
+    """
+
+    def send_messages(self, email_messages):
+        emails = [
+            OutboxEmail(
+                subject=message.subject,
+                body=message.body,
+                from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+                envelope={
+                    "to": message.to,
+                    "cc": message.cc,
+                    "bcc": message.bcc,
+                    "reply_to": message.reply_to,
+                    "headers": message.extra_headers,
+                    "content_subtype": message.content_subtype,
+                    "alternatives": [
+                        [content, mimetype]
+                        for content, mimetype in getattr(message, "alternatives", [])
+                    ],
+                    # attachments given as MIMEBase instances are not supported
+                    "attachments": [
+                        [filename, _encode(content), mimetype]
+                        for filename, content, mimetype in message.attachments
+                    ],
+                },
+            )
+            for message in email_messages
+            if message.recipients()
+        ]
+        OutboxEmail.objects.bulk_create(emails)
+        return len(emails)
+
+
+def to_message(email: OutboxEmail):
+    envelope = email.envelope
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=envelope.get("to"),
+        cc=envelope.get("cc"),
+        bcc=envelope.get("bcc"),
+        reply_to=envelope.get("reply_to"),
+        headers=envelope.get("headers"),
+        alternatives=[tuple(alternative) for alternative in envelope["alternatives"]],
+    )
+    message.content_subtype = envelope.get("content_subtype", "plain")
+    for filename, content, mimetype in envelope.get("attachments", []):
+        message.attach(filename, _decode(content), mimetype)
+    return message
+
+
+def _config(name, default):
+    return getattr(settings, "OUTBOX", {}).get(name, default)
+
+
+def claim_batch(batch_size):
+    """
+    - marks up to `batch_size` due emails as being sent by this worker and returns
+    them; the claim is a lease, so emails of a crashed worker are picked up again
+
+    - rows are locked with SKIP LOCKED where supported, so several workers can
+    drain the outbox concurrently
+    """
+    now = timezone.now()
+    lease = timedelta(seconds=_config("LEASE_SECONDS", 300))
+    with transaction.atomic():
+        # emails still "sending" past their lease belong to a crashed worker
+        due = OutboxEmail.objects.filter(
+            status__in=[OutboxEmail.STATUS_PENDING, OutboxEmail.STATUS_SENDING],
+            next_attempt_at__lte=now,
+        ).order_by("next_attempt_at")
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        emails = list(due[:batch_size])
+        OutboxEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            status=OutboxEmail.STATUS_SENDING, next_attempt_at=now + lease
+        )
+    return emails
+
+
+def _failed(email, error):
+    email.attempts += 1
+    email.last_error = str(error)[:2000]
+    if email.attempts >= _config("MAX_ATTEMPTS", 5):
+        email.status = OutboxEmail.STATUS_FAILED
+    else:
+        # exponential backoff with jitter, so retries of a batch do not align
+        delay = min(
+            _config("BACKOFF_SECONDS", 30) * 2 ** (email.attempts - 1),
+            _config("MAX_BACKOFF_SECONDS", 3600),
+        )
+        email.status = OutboxEmail.STATUS_PENDING
+        email.next_attempt_at = timezone.now() + timedelta(
+            seconds=delay * random.uniform(0.8, 1.2)
+        )
+    email.save(update_fields=["attempts", "last_error", "status", "next_attempt_at"])
+
+
+def deliver(emails, mail_connection):
+    """sends `emails` over one connection, reopening it if the server drops it"""
+    try:
+        mail_connection.open()
+    except Exception as error:
+        logger.warning("Opening the outbox mail connection failed: %s", error)
+        for email in emails:
+            _failed(email, error)
+        return 0
+
+    try:
+        return _send(emails, mail_connection)
+    finally:
+        mail_connection.close()
+
+
+def _send(emails, mail_connection):
+    sent = 0
+    for email in emails:
+        try:
+            try:
+                mail_connection.send_messages([to_message(email)])
+            except smtplib.SMTPServerDisconnected:
+                mail_connection.close()
+                mail_connection.open()
+                mail_connection.send_messages([to_message(email)])
+        except Exception as error:
+            logger.warning("Sending outbox email %s failed: %s", email.pk, error)
+            _failed(email, error)
+            continue
+
+        email.status = OutboxEmail.STATUS_SENT
+        email.sent_at = timezone.now()
+        email.save(update_fields=["status", "sent_at"])
+        sent += 1
+    return sent
+
+
+def get_delivery_connection():
+    return get_connection(
+        getattr(
+            settings,
+            "OUTBOX_DELIVERY_BACKEND",
+            "django.core.mail.backends.smtp.EmailBackend",
+        )
+    )
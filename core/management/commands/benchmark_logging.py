@@ -0,0 +1,77 @@
+import logging
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.log import QueueFileHandler, SamplingFilter
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the per-request logging cost of the previous synchronous "
+        "console + file handlers with the queue based pipeline: the time spent "
+        "in the request thread, and the time until the records are written "
+        "(the queued ones once the writer thread drained the queue)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=5000)
+        parser.add_argument(
+            "--records", type=int, default=10, help="log records per request"
+        )
+
+    def make_logger(self, name, handlers):
+        logger = logging.Logger(name, logging.DEBUG)
+        for handler in handlers:
+            logger.addHandler(handler)
+        return logger
+
+    def measure(self, logger, requests, records, handler):
+        """seconds per request: (in the logging thread, until written)"""
+        start = time.perf_counter()
+        for request in range(requests):
+            for record in range(records):
+                logger.info("request %s record %s done", request, record)
+        logged = time.perf_counter()
+        # waits for the writer thread of a queued handler to drain the queue
+        handler.close()
+        written = time.perf_counter()
+        return (logged - start) / requests, (written - start) / requests
+
+    def handle(self, *args, **options):
+        requests, records = options["requests"], options["records"]
+        formatter = logging.Formatter(
+            "{asctime} ({levelname})- {name}- {message}", style="{"
+        )
+
+        with tempfile.TemporaryDirectory() as directory, open(
+            os.devnull, "w"
+        ) as devnull:
+            console = logging.StreamHandler(devnull)
+            file = logging.FileHandler(os.path.join(directory, "sync.log"))
+            file.setFormatter(formatter)
+            before = self.measure(
+                self.make_logger("sync", [console, file]), requests, records, file
+            )
+
+            queued = QueueFileHandler(os.path.join(directory, "queued.log"))
+            after = self.measure(
+                self.make_logger("queued", [queued]), requests, records, queued
+            )
+
+            sampled = QueueFileHandler(os.path.join(directory, "sampled.log"))
+            sampled.addFilter(SamplingFilter({"sampled": 0.01}))
+            sampled_cost = self.measure(
+                self.make_logger("sampled", [sampled]), requests, records, sampled
+            )
+
+        self.stdout.write(f"{requests} requests x {records} records per request")
+        self.stdout.write(f"{'us/request':<32} {'in request':>10} {'written':>10}")
+        for label, (cost, written) in [
+            ("sync console + file", before),
+            ("queue + background json writer", after),
+            ("queue, sampled at 1%", sampled_cost),
+        ]:
+            self.stdout.write(f"{label:<32} {cost * 1e6:10.1f} {written * 1e6:10.1f}")
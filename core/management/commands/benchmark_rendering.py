@@ -0,0 +1,78 @@
+import gzip
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from core.renderers import ORJSONRenderer
+from store.models import Order, Product
+from store.serializers import OrderSerializer, ProductSerializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares CPU time and bytes on the wire of the default JSON renderer and "
+        "the orjson renderer, with and without compression, on large product and "
+        "order pages"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=1000, help="items per page")
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def page(self, serializer_class, queryset, size):
+        data = list(serializer_class(queryset[:size], many=True).data)
+        if not data:
+            return []
+        # repeat the rows we have to reach the page size
+        return (data * (size // len(data) + 1))[:size]
+
+    def timed(self, function, repeat):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            best = min(best, time.perf_counter() - start)
+        return best, result
+
+    def report(self, name, data, repeat):
+        self.stdout.write(f"\n{name}: {len(data)} items")
+        self.stdout.write(f"{'':<28}{'cpu':>10}{'bytes':>12}")
+        for label, renderer in [
+            ("JSONRenderer", JSONRenderer()),
+            ("ORJSONRenderer", ORJSONRenderer()),
+        ]:
+            cost, body = self.timed(lambda: renderer.render(data), repeat)
+            self.stdout.write(f"{label:<28}{cost * 1000:>8.2f}ms{len(body):>12}")
+
+            encoders = [("gzip", lambda: gzip.compress(body, compresslevel=6))]
+            if brotli is not None:
+                encoders.append(("br", lambda: brotli.compress(body, quality=4)))
+            for encoding, compress in encoders:
+                compress_cost, compressed = self.timed(compress, repeat)
+                self.stdout.write(
+                    f"{'  + ' + encoding:<28}{(cost + compress_cost) * 1000:>8.2f}ms"
+                    f"{len(compressed):>12}"
+                )
+
+    def handle(self, *args, **options):
+        size, repeat = options["size"], options["repeat"]
+        products = self.page(
+            ProductSerializer,
+            Product.objects.prefetch_related("images").defer("description"),
+            size,
+        )
+        orders = self.page(
+            OrderSerializer, Order.objects.prefetch_related("items__product"), size
+        )
+
+        for name, data in [("products", products), ("orders", orders)]:
+            if data:
+                self.report(name, data, repeat)
+            else:
+                self.stdout.write(f"\n{name}: no rows to benchmark")
@@ -0,0 +1,57 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core import budgets
+
+
+class Command(BaseCommand):
+    help = (
+        "Lists the views closest to their query budgets (core.budgets), from the "
+        "counters written by the server processes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=20)
+        parser.add_argument("--json", action="store_true")
+        parser.add_argument(
+            "--reset", action="store_true", help="then forget the counters"
+        )
+
+    def handle(self, *args, **options):
+        rows = budgets.report()[: options["limit"]]
+        if options["json"]:
+            self.stdout.write(json.dumps(rows, indent=2))
+        elif not rows:
+            self.stdout.write("No requests recorded")
+        else:
+            self.write_table(rows)
+        if options["reset"]:
+            budgets.reset()
+
+    def write_table(self, rows):
+        width = max(len(row["name"]) for row in rows)
+        self.stdout.write(
+            f"{'view':<{width}}{'used':>7}{'requests':>10}{'over':>6}"
+            f"{'queries avg/max/budget':>24}{'db ms avg/max/budget':>24}"
+        )
+        for row in rows:
+            budget = row["budget"]
+            queries = (
+                f"{row['mean_queries']}/{row['max_queries']}/{budget.get('queries')}"
+            )
+            db_time = "/".join(
+                "-" if seconds is None else f"{seconds * 1000:.0f}"
+                for seconds in (
+                    row["mean_db_time"],
+                    row["max_db_time"],
+                    budget.get("db_time"),
+                )
+            )
+            used = "-" if row["utilization"] is None else f"{row['utilization']:.0%}"
+            line = (
+                f"{row['name']:<{width}}{used:>7}{row['requests']:>10}"
+                f"{row['over_budget']:>6}{queries:>24}{db_time:>24}"
+            )
+            style = self.style.WARNING if row["over_budget"] else self.style.SUCCESS
+            self.stdout.write(style(line))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.mail import claim_batch, deliver, get_delivery_connection
+
+
+class Command(BaseCommand):
+    help = (
+        "Delivers the emails of the outbox in batches, reusing one mail server "
+        "connection per batch and retrying failures with backoff"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument(
+            "--interval", type=float, default=2, help="seconds to sleep when idle"
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="drain the due emails and exit"
+        )
+
+    def handle(self, *args, **options):
+        mail_connection = get_delivery_connection()
+        while True:
+            # as between two requests: a connection the server dropped while
+            # idle, or older than CONN_MAX_AGE, is replaced
+            close_old_connections()
+            emails = claim_batch(options["batch_size"])
+            if emails:
+                sent = deliver(emails, mail_connection)
+                self.stdout.write(f"Sent {sent} of {len(emails)} emails")
+                continue
+
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,119 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# runs in a fresh interpreter, so that nothing is already imported
+BOOTSTRAP = """
+import json, resource, sys, time
+from django.apps.config import AppConfig
+
+timings = {}
+create = AppConfig.create.__func__
+
+
+def timed(name, phase, function):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings.setdefault(name, {})[phase] = time.perf_counter() - start
+    return wrapper
+
+
+def timed_create(cls, entry):
+    start = time.perf_counter()
+    app_config = create(cls, entry)
+    timings.setdefault(app_config.name, {})["import"] = time.perf_counter() - start
+    app_config.import_models = timed(app_config.name, "models", app_config.import_models)
+    app_config.ready = timed(app_config.name, "ready", app_config.ready)
+    return app_config
+
+
+AppConfig.create = classmethod(timed_create)
+
+start = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter() - start
+import ecommerce.wsgi
+wsgi = time.perf_counter() - start
+from django.urls import get_resolver
+get_resolver().url_patterns
+total = time.perf_counter() - start
+
+print(json.dumps({
+    "apps": timings,
+    "setup": setup,
+    "wsgi": wsgi,
+    "total": total,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}), file=sys.stdout)
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures cold start in a fresh interpreter: import / models / ready time "
+        "per installed app, slowest top-level imports and memory after startup"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=15)
+        parser.add_argument("--json", action="store_true")
+
+    def parse_importtime(self, stderr):
+        """cumulative microseconds of each top-level import from `-X importtime`"""
+        imports = {}
+        for line in stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line[len("import time:") :].split("|")
+            if name.startswith("  ") or not cumulative.strip().isdigit():
+                # only top-level imports; nested ones are part of their parent
+                continue
+            imports[name.strip()] = int(cumulative) / 1e6
+        return imports
+
+    def handle(self, *args, **options):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", BOOTSTRAP],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode:
+            self.stderr.write(result.stderr[-2000:])
+            return
+
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        imports = sorted(
+            self.parse_importtime(result.stderr).items(), key=lambda item: -item[1]
+        )[: options["top"]]
+        report["slowest_imports"] = dict(imports)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f"{'app':<40}{'import':>10}{'models':>10}{'ready':>10}")
+        for app, phases in report["apps"].items():
+            self.stdout.write(
+                f"{app:<40}"
+                + "".join(
+                    f"{phases.get(phase, 0) * 1000:>8.1f}ms"
+                    for phase in ["import", "models", "ready"]
+                )
+            )
+        self.stdout.write(f"\ndjango.setup(): {report['setup'] * 1000:.1f}ms")
+        self.stdout.write(f"+ wsgi application: {report['wsgi'] * 1000:.1f}ms")
+        self.stdout.write(f"+ url configuration: {report['total'] * 1000:.1f}ms")
+        self.stdout.write(f"max rss: {report['max_rss_kb'] / 1024:.1f}MB\n")
+
+        self.stdout.write("slowest top-level imports (cumulative):")
+        for name, seconds in imports:
+            self.stdout.write(f"  {name:<50}{seconds * 1000:>8.1f}ms")
@@ -0,0 +1,431 @@
+import gzip
+import hmac
+import math
+import random
+import re
+import secrets
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from core import budgets, identity, profiler
+from core.admission import get_state
+
+
+class HybridMiddleware:
+    """
+    - runs in the mode of the handler, sync under WSGI and async under ASGI: a
+    sync-only middleware would run the rest of an ASGI request (async views
+    included) in a worker thread
+
+    - subclasses implement `__call__`, which hands over to `__acall__` in the
+    async mode
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+
+class AdmissionControlMiddleware(HybridMiddleware):
+    """
+    - sheds load before it reaches the views: requests are classified into endpoint
+    classes (catalog reads, cart writes, order creation...) configured in
+    `settings.ADMISSION_CONTROL`
+
+    - each class has a concurrency limit shared by all worker processes (503 when
+    exceeded) and an optional per-client token bucket (429 when exhausted)
+
+    - requests run without going through the middleware (the sub-requests of a
+    batch) are admitted with `admitted`
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.config = getattr(settings, "ADMISSION_CONTROL", {})
+        self.enabled = self.config.get("ENABLED", False)
+        self.classes = [
+            (
+                name,
+                re.compile(options["path"]),
+                {method.upper() for method in options["methods"]},
+                options,
+            )
+            for name, options in self.config.get("CLASSES", {}).items()
+        ]
+
+    def classify(self, request):
+        for name, path, methods, options in self.classes:
+            if request.method in methods and path.match(request.path_info):
+                return name, options
+        return None, None
+
+    def client_key(self, request):
+        """
+        - the user id of a valid access token (its signature is checked, the user
+        is not loaded), otherwise the client ip: made up headers all share the
+        bucket of their ip
+        """
+        authentication = JWTAuthentication()
+        header = authentication.get_header(request)
+        token = None
+        try:
+            raw_token = header and authentication.get_raw_token(header)
+            if raw_token:
+                token = authentication.get_validated_token(raw_token)
+        except AuthenticationFailed:
+            pass
+        user_id = None if token is None else token.get(jwt_settings.USER_ID_CLAIM)
+        if user_id is not None:
+            return f"user:{user_id}"
+        return "ip:" + request.META.get("REMOTE_ADDR", "")
+
+    def reject(self, status, detail, retry_after):
+        response = JsonResponse({"detail": detail}, status=status)
+        response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    def admit(self, request):
+        """(class name, None) for an admitted request, (None, response) otherwise"""
+        if not self.enabled:
+            return None, None
+
+        name, options = self.classify(request)
+        if name is None:
+            return None, None
+
+        state = get_state(self.config)
+        if options.get("rate"):
+            retry_after = state.consume(
+                name,
+                self.client_key(request),
+                options["rate"],
+                options.get("burst", options["rate"]),
+            )
+            if retry_after:
+                return None, self.reject(429, "Request was throttled.", retry_after)
+
+        if not state.acquire(name, options.get("max_concurrency")):
+            return None, self.reject(
+                503,
+                "Server is busy, please retry later.",
+                options.get("retry_after", 1),
+            )
+        return name, None
+
+    @contextmanager
+    def admitted(self, request):
+        """
+        - yields None when `request` is admitted, holding its concurrency slot
+        until the block ends, otherwise the 429 / 503 response
+        """
+        name, rejected = self.admit(request)
+        try:
+            yield rejected
+        finally:
+            if name is not None:
+                get_state(self.config).release(name)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with self.admitted(request) as rejected:
+            return rejected or self.get_response(request)
+
+    async def __acall__(self, request):
+        with self.admitted(request) as rejected:
+            return rejected or await self.get_response(request)
+
+
+class CompressionMiddleware(HybridMiddleware):
+    """
+    - compresses responses with brotli (when installed) or gzip, according to the
+    client's Accept-Encoding
+
+    - small bodies and content types that are already compressed are left alone,
+    see `settings.RESPONSE_COMPRESSION`
+
+    - against BREACH, gzip output gets a random length padding like Django's
+    GZipMiddleware (`GZIP_PADDING` bytes at most); brotli has no room for one, so
+    requests with credentials, whose responses may reflect secrets, get gzip
+    """
+
+    accept_encoding_re = _lazy_re_compile(
+        r"([a-z*]+)\s*(?:;\s*q=([0-9]+(?:\.[0-9]*)?))?"
+    )
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        config = getattr(settings, "RESPONSE_COMPRESSION", {})
+        self.min_size = config.get("MIN_SIZE", 1024)
+        self.gzip_level = config.get("GZIP_LEVEL", 6)
+        self.gzip_padding = config.get("GZIP_PADDING", 100)
+        self.brotli_quality = config.get("BROTLI_QUALITY", 4)
+        self.content_types = tuple(
+            config.get(
+                "CONTENT_TYPES",
+                ["application/json", "text/", "application/javascript"],
+            )
+        )
+
+    def accepted_encodings(self, request):
+        """{encoding: quality} of the Accept-Encoding header"""
+        accepted = {}
+        header = request.META.get("HTTP_ACCEPT_ENCODING", "").lower()
+        for encoding, quality in self.accept_encoding_re.findall(header):
+            accepted[encoding] = float(quality) if quality else 1.0
+        return accepted
+
+    def has_credentials(self, request):
+        return (
+            "HTTP_AUTHORIZATION" in request.META
+            or settings.SESSION_COOKIE_NAME in request.COOKIES
+        )
+
+    def choose_encoding(self, request):
+        """
+        the available encoding of highest quality, brotli on a tie: encodings not
+        listed have the quality of `*`, and none of quality 0 is chosen
+        """
+        accepted = self.accepted_encodings(request)
+        available = ["gzip"]
+        if brotli is not None and not self.has_credentials(request):
+            available.insert(0, "br")
+        quality = {
+            encoding: accepted.get(encoding, accepted.get("*", 0))
+            for encoding in available
+        }
+        encoding = max(available, key=quality.get)
+        return encoding if quality[encoding] > 0 else None
+
+    def compress(self, content, encoding):
+        if encoding == "br":
+            return brotli.compress(content, quality=self.brotli_quality)
+        compressed = gzip.compress(content, compresslevel=self.gzip_level, mtime=0)
+        if not self.gzip_padding:
+            return compressed
+        # a file name of random length in the header, as
+        # django.utils.text.compress_string does for GZipMiddleware
+        header = bytearray(compressed[:10])
+        header[3] = gzip.FNAME
+        filename = b"a" * secrets.randbelow(self.gzip_padding) + b"\x00"
+        return bytes(header) + filename + compressed[10:]
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process(request, await self.get_response(request))
+
+    def process(self, request, response):
+        if (
+            response.streaming
+            or response.has_header("Content-Encoding")
+            or len(response.content) < self.min_size
+            or not response.get("Content-Type", "").startswith(self.content_types)
+        ):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = self.choose_encoding(request)
+        if encoding is None:
+            return response
+
+        compressed = self.compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response["Content-Length"] = str(len(compressed))
+        response["Content-Encoding"] = encoding
+        # the representation changed, so a strong ETag no longer applies
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        return response
+
+
+class ProfilingMiddleware(HybridMiddleware):
+    """
+    - profiles single requests in production (see core.profiler): requests
+    carrying `X-Profile: <PROFILER["TOKEN"]>`, and a `SAMPLE_RATE` fraction of
+    the requests whose path matches `PATHS`
+
+    - the profile id is returned in the `X-Profile-Id` response header
+
+    - under ASGI, the sampled thread is the one running the request's sync code
+    (sync views, database access): time spent awaiting on the event loop is not
+    profiled
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.token = profiler.config("TOKEN", "")
+        self.sample_rate = profiler.config("SAMPLE_RATE", 0)
+        self.paths = re.compile(profiler.config("PATHS", r"^/"))
+
+    def should_profile(self, request):
+        header = request.META.get("HTTP_X_PROFILE")
+        if header and self.token:
+            return hmac.compare_digest(header, self.token)
+        return (
+            self.sample_rate > 0
+            and random.random() < self.sample_rate
+            and self.paths.match(request.path_info) is not None
+        )
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        request_profiler = profiler.RequestProfiler().start()
+        if request_profiler is None:
+            # another request of this process is being profiled
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_profiler.stop()
+        response["X-Profile-Id"] = request_profiler.save(request, response)
+        return response
+
+    async def __acall__(self, request):
+        if not self.should_profile(request):
+            return await self.get_response(request)
+
+        # started in the thread the sync code of this request runs in
+        request_profiler = await sync_to_async(profiler.RequestProfiler().start)()
+        if request_profiler is None:
+            return await self.get_response(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(request_profiler.stop)()
+        response["X-Profile-Id"] = await sync_to_async(request_profiler.save)(
+            request, response
+        )
+        return response
+
+
+class IdentityMapMiddleware(HybridMiddleware):
+    """
+    - one identity map (core.identity) per request: rows looked up by primary or
+    unique key are loaded once, including across the sub-requests of a batch
+    """
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with identity.scope():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        # sync_to_async copies the context, so sync code shares the map
+        with identity.scope():
+            return await self.get_response(request)
+
+
+class QueryBudgetMiddleware(HybridMiddleware):
+    """
+    - counts the statements and database time of each request, on every
+    database connection, against the budget of its view (see core.budgets), and
+    applies its statement timeout
+
+    - requests over budget are logged, rejected or failed depending on
+    `QUERY_BUDGETS["MODE"]`
+
+    - connections are per thread: under ASGI the wrappers are installed in the
+    thread the sync code of the request (views, sync_to_async) runs in
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.mode = budgets.config("MODE", "log")
+
+    def install(self, stack, request_budget):
+        stack.enter_context(budgets.counting(request_budget))
+
+    def finish(self, request, response):
+        try:
+            request.query_budget.finish()
+        except budgets.QueryBudgetError:
+            return budgets.error_response(request)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if self.mode == "off":
+            return self.get_response(request)
+
+        request.query_budget = budgets.RequestBudget(request.method, self.mode)
+        with ExitStack() as stack:
+            self.install(stack, request.query_budget)
+            response = self.get_response(request)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        if self.mode == "off":
+            return await self.get_response(request)
+
+        request.query_budget = budgets.RequestBudget(request.method, self.mode)
+        stack = ExitStack()
+        await sync_to_async(self.install)(stack, request.query_budget)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.finish(request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request_budget = getattr(request, "query_budget", None)
+        if request_budget is not None:
+            request_budget.name, request_budget.budget = budgets.view_budget(
+                view_func, request.method
+            )
+
+
+class StaticFilesMiddleware(HybridMiddleware, WhiteNoiseMiddleware):
+    """
+    - whitenoise, which is sync-only, in both modes: under ASGI the requests
+    that are not for a static file are not run through a worker thread
+    """
+
+    def __init__(self, get_response):
+        WhiteNoiseMiddleware.__init__(self, get_response)
+        HybridMiddleware.__init__(self, get_response)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return WhiteNoiseMiddleware.__call__(self, request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
@@ -1,7 +1,49 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 
 
 # extending the Abstract User model in the core app to include email attribute
 class User(AbstractUser):
     email = models.EmailField(unique=True)
+
+
+class OutboxEmail(models.Model):
+    """
+    - an email written by the outbox email backend, inside the transaction of the
+    request that sent it
+
+    - delivered later, in batches, by the `send_outbox` worker
+    """
+
+    STATUS_PENDING = "P"
+    STATUS_SENDING = "S"
+    STATUS_SENT = "D"
+    STATUS_FAILED = "F"
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_SENDING, "Sending"),
+        (STATUS_SENT, "Sent"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    subject = models.TextField()
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    # recipients, headers, alternatives and attachments of the message
+    envelope = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=1, choices=STATUS_CHOICES, default=STATUS_PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+    def __str__(self):
+        return self.subject
@@ -0,0 +1,284 @@
+"""
+Per-request profiler, triggered by `core.middleware.ProfilingMiddleware`.
+
+- CPU: a sampling thread records the stack of the profiled request's thread every
+`INTERVAL` seconds; each sample is attributed to the innermost layer (orm,
+serializer, renderer, view) found on its stack
+
+- memory: the allocations made during the request, from a tracemalloc snapshot
+(tracemalloc is process wide, so with threaded workers the allocations of
+concurrent requests are included)
+
+Each profile is written to `PROFILER["DIRECTORY"]` as a speedscope file, a folded
+stacks file (flamegraph.pl / inferno input) and a json summary, listed by the
+admin page at /admin/profiles/.
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from django.conf import settings
+from django.utils import timezone
+
+# checked from the innermost frame outwards: the orm called by a serializer is orm
+LAYERS = [
+    ("orm", ["django/db/"]),
+    ("renderer", ["rest_framework/renderers.py", "core/renderers.py"]),
+    (
+        "serializer",
+        [
+            "rest_framework/serializers.py",
+            "rest_framework/fields.py",
+            "rest_framework/relations.py",
+            "store/serializers.py",
+            "store/fieldsets.py",
+        ],
+    ),
+    (
+        "view",
+        [
+            "rest_framework/views.py",
+            "rest_framework/viewsets.py",
+            "rest_framework/generics.py",
+            "rest_framework/mixins.py",
+            "store/views.py",
+            "core/views.py",
+        ],
+    ),
+]
+MEMORY_TOP = 25
+
+# serializes profiling: tracemalloc and the sampler are process wide
+_lock = threading.Lock()
+
+
+def config(name, default=None):
+    return getattr(settings, "PROFILER", {}).get(name, default)
+
+
+def _layer(filename):
+    filename = filename.replace(os.sep, "/")
+    for layer, paths in LAYERS:
+        if any(path in filename for path in paths):
+            return layer
+    return None
+
+
+class Sampler(threading.Thread):
+    def __init__(self, thread_id, interval):
+        super().__init__(name="request-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stopped = threading.Event()
+        # (seconds since the previous sample, stack as code objects root first)
+        self.samples = []
+
+    def run(self):
+        previous = time.perf_counter()
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append((now - previous, stack))
+            previous = now
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class RequestProfiler:
+    """
+    - `start()` / `stop()` around the request in the profiled thread, then
+    `save()`; returns None from `start()` when another request is being profiled
+    """
+
+    def __init__(self):
+        self.sampler = None
+        self.memory = config("MEMORY", True)
+        self.started_tracemalloc = False
+
+    def start(self):
+        if not _lock.acquire(blocking=False):
+            return None
+        try:
+            if self.memory:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(config("MEMORY_FRAMES", 10))
+                    self.started_tracemalloc = True
+                tracemalloc.reset_peak()
+                self.memory_before = tracemalloc.take_snapshot()
+            self.sampler = Sampler(threading.get_ident(), config("INTERVAL", 0.005))
+            self.started_at = time.perf_counter()
+            self.sampler.start()
+        except BaseException:
+            # or no request of the process would be profiled again
+            if self.started_tracemalloc:
+                tracemalloc.stop()
+            _lock.release()
+            raise
+        return self
+
+    def stop(self):
+        self.duration = time.perf_counter() - self.started_at
+        self.sampler.stop()
+        try:
+            if self.memory:
+                self.memory_after = tracemalloc.take_snapshot()
+                self.memory_peak = tracemalloc.get_traced_memory()[1]
+                if self.started_tracemalloc:
+                    tracemalloc.stop()
+        finally:
+            _lock.release()
+
+    def speedscope(self, name):
+        frames, index = [], {}
+        samples, weights = [], []
+        for weight, stack in self.sampler.samples:
+            sample = []
+            for code in stack:
+                key = (code.co_name, code.co_filename, code.co_firstlineno)
+                if key not in index:
+                    index[key] = len(frames)
+                    frames.append({"name": key[0], "file": key[1], "line": key[2]})
+                sample.append(index[key])
+            samples.append(sample)
+            weights.append(weight * 1000)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "ecommerce request profiler",
+            "shared": {"frames": frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": name,
+                    "unit": "milliseconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            ],
+        }
+
+    def folded(self):
+        counts = Counter()
+        for weight, stack in self.sampler.samples:
+            counts[
+                ";".join(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                    f":{code.co_firstlineno})"
+                    for code in stack
+                )
+            ] += 1
+        return "".join(f"{stack} {count}\n" for stack, count in counts.items())
+
+    def layers(self):
+        """milliseconds per layer"""
+        totals = Counter()
+        for weight, stack in self.sampler.samples:
+            layer = next(
+                (
+                    layer
+                    for layer in map(
+                        _layer, (code.co_filename for code in reversed(stack))
+                    )
+                    if layer is not None
+                ),
+                "other",
+            )
+            totals[layer] += weight * 1000
+        return {layer: round(total, 2) for layer, total in totals.most_common()}
+
+    def allocations(self):
+        if not self.memory:
+            return None
+        ignored = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+        statistics = self.memory_after.filter_traces(ignored).compare_to(
+            self.memory_before.filter_traces(ignored), "lineno"
+        )
+        return {
+            "peak_bytes": self.memory_peak,
+            "allocated_bytes": sum(stat.size_diff for stat in statistics),
+            "top": [
+                {
+                    "file": stat.traceback[0].filename,
+                    "line": stat.traceback[0].lineno,
+                    "size_diff": stat.size_diff,
+                    "count_diff": stat.count_diff,
+                }
+                for stat in statistics[:MEMORY_TOP]
+            ],
+        }
+
+    def save(self, request, response):
+        """writes the profile files and returns the profile id"""
+        directory = config("DIRECTORY")
+        os.makedirs(directory, exist_ok=True)
+        now = timezone.now()
+        slug = re.sub(r"[^\w]+", "-", request.path).strip("-")[:60] or "root"
+        profile_id = f"{now:%Y%m%d-%H%M%S-%f}-{request.method.lower()}-{slug}"
+        name = f"{request.method} {request.get_full_path()}"
+
+        summary = {
+            "id": profile_id,
+            "name": name,
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "started_at": now.isoformat(),
+            "duration_ms": round(self.duration * 1000, 2),
+            "samples": len(self.sampler.samples),
+            "layers": self.layers(),
+            "memory": self.allocations(),
+        }
+        base = os.path.join(directory, profile_id)
+        with open(f"{base}.speedscope.json", "w") as file:
+            json.dump(self.speedscope(name), file)
+        with open(f"{base}.folded.txt", "w") as file:
+            file.write(self.folded())
+        with open(f"{base}.json", "w") as file:
+            json.dump(summary, file, indent=2)
+
+        prune(directory, config("KEEP", 200))
+        return profile_id
+
+
+def list_profiles():
+    directory = config("DIRECTORY")
+    if not directory or not os.path.isdir(directory):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(directory), reverse=True):
+        if filename.endswith(".json") and not filename.endswith(".speedscope.json"):
+            with open(os.path.join(directory, filename)) as file:
+                profiles.append(json.load(file))
+    return profiles
+
+
+def prune(directory, keep):
+    """deletes the files of all but the `keep` most recent profiles"""
+    ids = sorted(
+        filename[: -len(".json")]
+        for filename in os.listdir(directory)
+        if filename.endswith(".json") and not filename.endswith(".speedscope.json")
+    )
+    for profile_id in ids[: max(len(ids) - keep, 0)]:
+        for suffix in (".json", ".speedscope.json", ".folded.txt"):
+            path = os.path.join(directory, profile_id + suffix)
+            if os.path.exists(path):
+                os.remove(path)
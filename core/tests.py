@@ -1,3 +1,388 @@
-from django.test import TestCase
+import gzip
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+from email import message_from_bytes
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import orjson
+from django.core import mail
+from django.core.management import call_command
+from django.db import transaction
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from core import identity, profiler
+from core.admission import SharedAdmissionState
+from core.authentication import JWTAuthentication
+from core.log import QueueFileHandler, SamplingFilter
+from core.mail import claim_batch, deliver, get_delivery_connection
+from core.middleware import AdmissionControlMiddleware, CompressionMiddleware
+from core.models import OutboxEmail, User
+from core.renderers import ORJSONRenderer
+
+
+class SharedAdmissionStateTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "admission")
+
+    def test_lock_excludes_threads(self):
+        # the threads of a process share the file descriptor, and so the flock
+        state = SharedAdmissionState(self.path, ["reads"])
+        thread = threading.Thread(target=state.acquire, args=("reads", None))
+        with state._locked():
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+        thread.join()
+        self.assertEqual(state.stats()["reads"]["admitted"], 1)
+
+    def test_clients_keep_their_buckets(self):
+        # a table of 4 slots: the clients cannot be addressed to distinct ones
+        state = SharedAdmissionState(self.path, ["reads"], bucket_slots=4)
+        self.assertEqual(state.consume("reads", "a", 1, 1), 0)
+        self.assertGreater(state.consume("reads", "a", 1, 1), 0)
+        for client in "bcd":
+            self.assertEqual(state.consume("reads", client, 1, 1), 0)
+        self.assertGreater(state.consume("reads", "a", 1, 1), 0)
+
+
+class ClientKeyTests(TestCase):
+    def setUp(self):
+        self.middleware = AdmissionControlMiddleware(lambda request: None)
+        self.factory = RequestFactory(REMOTE_ADDR="10.0.0.1")
+
+    def test_verified_user(self):
+        user = User.objects.create_user("customer", "customer@example.com", "pw")
+        request = self.factory.get(
+            "/", HTTP_AUTHORIZATION=f"JWT {AccessToken.for_user(user)}"
+        )
+        self.assertEqual(self.middleware.client_key(request), f"user:{user.id}")
+
+    def test_made_up_credentials(self):
+        for authorization in ["JWT made.up.token", "Basic abc", "JWT"]:
+            request = self.factory.get("/", HTTP_AUTHORIZATION=authorization)
+            self.assertEqual(self.middleware.client_key(request), "ip:10.0.0.1")
+
+
+@skipUnless(brotli, "brotli is not installed")
+class CompressionTests(SimpleTestCase):
+    def setUp(self):
+        data = {"products": [{"id": index, "title": "Product"} for index in range(200)]}
+        self.middleware = CompressionMiddleware(lambda request: JsonResponse(data))
+        self.content = JsonResponse(data).content
+        self.factory = RequestFactory()
+
+    def encoding(self, accept_encoding, **extra):
+        request = self.factory.get("/", HTTP_ACCEPT_ENCODING=accept_encoding, **extra)
+        return self.middleware(request).get("Content-Encoding")
+
+    def test_quality_values(self):
+        for accept_encoding, encoding in [
+            ("gzip, br", "br"),
+            ("*", "br"),
+            ("br;q=0, *", "gzip"),
+            ("gzip;q=1, br;q=0.1", "gzip"),
+            ("gzip;q=0, br;q=0", None),
+            ("br;q=0, gzip;q=0, *", None),
+            ("identity", None),
+        ]:
+            with self.subTest(accept_encoding):
+                self.assertEqual(self.encoding(accept_encoding), encoding)
+
+    def test_credentials_get_padded_gzip(self):
+        self.assertEqual(self.encoding("br", HTTP_AUTHORIZATION="JWT token"), None)
+        self.assertEqual(
+            self.encoding("br, gzip", HTTP_AUTHORIZATION="JWT token"), "gzip"
+        )
+
+        lengths = set()
+        for _ in range(20):
+            request = self.factory.get(
+                "/", HTTP_ACCEPT_ENCODING="gzip", HTTP_AUTHORIZATION="JWT token"
+            )
+            content = self.middleware(request).content
+            self.assertEqual(gzip.decompress(content), self.content)
+            lengths.add(len(content))
+        self.assertGreater(len(lengths), 1)
+
+
+class ORJSONRendererTests(SimpleTestCase):
+    def test_types_of_the_default_encoder(self):
+        data = {
+            "price": Decimal("10.50"),
+            "title": gettext_lazy("Title"),
+            "duration": timedelta(minutes=1),
+            "ids": {1},
+        }
+        self.assertEqual(
+            orjson.loads(ORJSONRenderer().render(data)),
+            {"price": 10.5, "title": "Title", "duration": "60.0", "ids": [1]},
+        )
+
+
+class LoggingPipelineTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "general.log")
+
+    def test_records_written_by_the_writer_thread(self):
+        handler = QueueFileHandler(self.path, batch_size=2)
+        logger = logging.Logger("pipeline", logging.DEBUG)
+        logger.addHandler(handler)
+        values = [1]
+        logger.info("values %s", values)
+        # merged when logged, not when written
+        values.append(2)
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("failed")
+        logger.warning("last")
+        handler.close()
+
+        with open(self.path) as file:
+            entries = [json.loads(line) for line in file]
+        self.assertEqual(
+            [entry["message"] for entry in entries], ["values [1]", "failed", "last"]
+        )
+        self.assertEqual(entries[0]["level"], "INFO")
+        self.assertIn("ZeroDivisionError", entries[1]["exception"])
+
+    def test_rotation(self):
+        # rolled over before a batch that would exceed max_bytes
+        handler = QueueFileHandler(
+            self.path, max_bytes=1000, backup_count=1, batch_size=1
+        )
+        logger = logging.Logger("pipeline", logging.DEBUG)
+        logger.addHandler(handler)
+        for index in range(50):
+            logger.info("record %s", index)
+        handler.close()
+        self.assertTrue(os.path.exists(self.path + ".1"))
+        self.assertLess(os.path.getsize(self.path), 1000)
+
+    def test_sampling(self):
+        def kept(rates, name, level=logging.DEBUG):
+            record = logging.LogRecord(name, level, __file__, 1, "sql", None, None)
+            return SamplingFilter(rates).filter(record)
+
+        rates = {"django.db": 0, "django.db.backends.schema": 1}
+        self.assertFalse(kept(rates, "django.db.backends"))
+        self.assertTrue(kept(rates, "django.db.backends", logging.WARNING))
+        # the most specific prefix wins
+        self.assertTrue(kept(rates, "django.db.backends.schema"))
+        self.assertTrue(kept(rates, "django.dbx"))
+        self.assertTrue(kept(rates, "store"))
+
+        with mock.patch("core.log.random.random", return_value=0.05):
+            self.assertTrue(kept({"store": 0.1}, "store.views"))
+            self.assertFalse(kept({"store": 0.01}, "store.views"))
+
+
+class RequestProfilerTests(SimpleTestCase):
+    def test_failed_start_releases_the_lock(self):
+        with mock.patch.object(
+            profiler.Sampler, "start", side_effect=RuntimeError("can't start")
+        ):
+            with self.assertRaises(RuntimeError):
+                profiler.RequestProfiler().start()
+        self.assertFalse(tracemalloc.is_tracing())
+
+        request_profiler = profiler.RequestProfiler().start()
+        self.assertIsNotNone(request_profiler)
+        request_profiler.stop()
+
+
+class JWTAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("customer", "customer@example.com", "pw")
+        self.token = AccessToken(str(AccessToken.for_user(self.user)))
+
+    def test_user_from_the_identity_map(self):
+        authentication = JWTAuthentication()
+        with identity.scope():
+            user = authentication.get_user(self.token)
+            self.assertEqual(user, self.user)
+            with self.assertNumQueries(0):
+                self.assertIs(authentication.get_user(self.token), user)
+                self.assertIs(identity.get(User, pk=self.user.id), user)
+
+    def test_inactive_or_deleted_user(self):
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            JWTAuthentication().get_user(self.token)
+        self.user.delete()
+        with self.assertRaises(AuthenticationFailed):
+            JWTAuthentication().get_user(self.token)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.envelopes = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("refused@"):
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.envelopes.append(envelope)
+        return "250 Message accepted for delivery"
+
+
+@skipUnless(Controller is not None, "needs aiosmtpd")
+@override_settings(
+    EMAIL_BACKEND="core.mail.OutboxEmailBackend",
+    OUTBOX_DELIVERY_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+    EMAIL_HOST="127.0.0.1",
+    EMAIL_USE_TLS=False,
+    OUTBOX={
+        "MAX_ATTEMPTS": 2,
+        "BACKOFF_SECONDS": 30,
+        "MAX_BACKOFF_SECONDS": 3600,
+        "LEASE_SECONDS": 300,
+    },
+)
+class OutboxTests(TestCase):
+    """the outbox backend and its delivery, against a local SMTP server"""
+
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.port = _free_port()
+        controller = Controller(self.handler, hostname="127.0.0.1", port=self.port)
+        controller.start()
+        self.addCleanup(controller.stop)
+
+    def send(self, subject="Order confirmed", to="customer@example.com"):
+        return mail.send_mail(subject, "Thank you", None, [to])
+
+    def invoice(self):
+        message = mail.EmailMultiAlternatives(
+            "Invoice",
+            "Attached",
+            to=["customer@example.com"],
+            bcc=["audit@example.com"],
+        )
+        message.attach_alternative("<p>Attached</p>", "text/html")
+        message.attach("invoice.pdf", b"%PDF-\x00\xff", "application/pdf")
+        return message
+
+    def test_backend_writes_to_the_outbox(self):
+        self.assertEqual(self.invoice().send(), 1)
+
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.status, OutboxEmail.STATUS_PENDING)
+        self.assertEqual(email.envelope["bcc"], ["audit@example.com"])
+        self.assertEqual(self.handler.envelopes, [])
+
+    def test_rolled_back_with_the_request(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.send()
+            raise RuntimeError
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_claim_is_a_lease(self):
+        self.send()
+        self.assertEqual(len(claim_batch(10)), 1)
+        # claimed: not handed to another worker
+        self.assertEqual(claim_batch(10), [])
+
+        # the lease of a crashed worker expired
+        OutboxEmail.objects.update(next_attempt_at=timezone.now() - timedelta(1))
+        self.assertEqual(len(claim_batch(10)), 1)
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.STATUS_SENDING)
+
+    def test_connections_renewed_between_batches(self):
+        with mock.patch(
+            "core.management.commands.send_outbox.close_old_connections"
+        ) as close_old_connections:
+            call_command("send_outbox", "--once", stdout=StringIO())
+        close_old_connections.assert_called_once_with()
+
+    def test_delivery(self):
+        self.invoice().send()
+
+        with override_settings(EMAIL_PORT=self.port):
+            call_command("send_outbox", "--once", stdout=StringIO())
+
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.status, OutboxEmail.STATUS_SENT)
+        self.assertIsNotNone(email.sent_at)
+        (envelope,) = self.handler.envelopes
+        self.assertEqual(
+            sorted(envelope.rcpt_tos), ["audit@example.com", "customer@example.com"]
+        )
+        received = message_from_bytes(envelope.content)
+        self.assertEqual(received["Subject"], "Invoice")
+        self.assertNotIn("Bcc", received)
+        parts = {part.get_content_type(): part for part in received.walk()}
+        self.assertEqual(parts["text/html"].get_payload(), "<p>Attached</p>")
+        self.assertEqual(
+            parts["application/pdf"].get_payload(decode=True), b"%PDF-\x00\xff"
+        )
+
+    def test_retry_with_backoff(self):
+        self.send()
+        # nothing listens on that port
+        with override_settings(EMAIL_PORT=_free_port()):
+            before = timezone.now()
+            self.assertEqual(deliver(claim_batch(10), get_delivery_connection()), 0)
+            email = OutboxEmail.objects.get()
+            self.assertEqual(email.status, OutboxEmail.STATUS_PENDING)
+            self.assertEqual(email.attempts, 1)
+            self.assertNotEqual(email.last_error, "")
+            # 30 seconds, +-20% of jitter
+            delay = (email.next_attempt_at - before).total_seconds()
+            self.assertTrue(24 <= delay <= 37, delay)
+            self.assertEqual(claim_batch(10), [])
+
+            OutboxEmail.objects.update(next_attempt_at=timezone.now())
+            deliver(claim_batch(10), get_delivery_connection())
+            email.refresh_from_db()
+            self.assertEqual(email.status, OutboxEmail.STATUS_FAILED)
+            self.assertEqual(email.attempts, 2)
+        self.assertEqual(claim_batch(10), [])
+
+    def test_failed_message_does_not_stop_the_batch(self):
+        self.send("First", to="refused@example.com")
+        self.send("Second")
+        with override_settings(EMAIL_PORT=self.port):
+            self.assertEqual(deliver(claim_batch(10), get_delivery_connection()), 1)
+        self.assertEqual(
+            dict(OutboxEmail.objects.values_list("subject", "status")),
+            {"First": OutboxEmail.STATUS_PENDING, "Second": OutboxEmail.STATUS_SENT},
+        )
+        self.assertEqual(len(self.handler.envelopes), 1)
@@ -1,5 +1,9 @@
 from django.urls import path
 from django.views.generic import TemplateView
+from . import views
 
-
-urlpatterns = [path("", TemplateView.as_view(template_name="core/index.html"))]
+urlpatterns = [
+    path("", TemplateView.as_view(template_name="core/index.html")),
+    path("admission/stats/", views.admission_stats),
+    path("query-budgets/", views.query_budgets),
+]
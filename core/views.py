@@ -1,3 +1,69 @@
+import os
+import re
+
+from django.conf import settings
+from django.contrib import admin
+from django.http import FileResponse, Http404
 from django.shortcuts import render
+from django.views.static import serve
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from core import budgets, profiler
+from core.admission import get_state
+
+
+@api_view()
+@permission_classes([IsAdminUser])
+def admission_stats(request):
+    """admitted / shed request counters per endpoint class, for monitoring"""
+    return Response(get_state(settings.ADMISSION_CONTROL).stats())
+
+
+@api_view()
+@permission_classes([IsAdminUser])
+def query_budgets(request):
+    """the views closest to their query budgets, see core.budgets"""
+    return Response(budgets.report())
+
+
+# names produced by store.storage.ContentAddressedStorage: <dir>/ab/<sha256>.<ext>
+CONTENT_ADDRESSED_NAME = re.compile(r"(^|/)([0-9a-f]{2})/\2[0-9a-f]{62}(\.\w+)?$")
+
+
+def serve_media(request, path):
+    """
+    - serves MEDIA_ROOT when django serves media (DEBUG)
+
+    - content-addressed files never change, so they are cached for a year
+    """
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if response.status_code == 200 and CONTENT_ADDRESSED_NAME.search(path):
+        response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+
+PROFILE_FILE_NAME = re.compile(r"^[\w-]+\.(json|speedscope\.json|folded\.txt)$")
+
+
+def profile_list(request):
+    """admin page listing the request profiles, see core.profiler"""
+    return render(
+        request,
+        "core/profiles.html",
+        {
+            **admin.site.each_context(request),
+            "title": "Request profiles",
+            "profiles": profiler.list_profiles(),
+        },
+    )
+
 
-# Create your views here.
+def profile_file(request, name):
+    if not PROFILE_FILE_NAME.match(name):
+        raise Http404
+    path = os.path.join(profiler.config("DIRECTORY"), name)
+    if not os.path.isfile(path):
+        raise Http404
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=name)
@@ -5,5 +5,13 @@ echo "Apply database migrations"
 python manage.py migrate
 
 # Start server
-echo "Starting server"
-python manage.py runserver 0.0.0.0:8000
\ No newline at end of file
+if [ "$DJANGO_SETTINGS_MODULE" = "ecommerce.settings.prod" ]; then
+    echo "Collecting static files"
+    python manage.py collectstatic --noinput
+
+    echo "Starting gunicorn"
+    exec gunicorn ecommerce.wsgi:application
+else
+    echo "Starting server"
+    python manage.py runserver 0.0.0.0:8000
+fi
@@ -9,12 +9,26 @@ https://docs.djangoproject.com/en/4.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
+
+import hashlib
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 
+# prefix of the files the workers of this deployment share on a host: other
+# checkouts or settings modules (e.g. the tests) get files of their own
+RUNTIME_PREFIX = os.path.join(
+    tempfile.gettempdir(),
+    "ecommerce-"
+    + hashlib.blake2b(
+        f"{BASE_DIR}:{os.environ.get('DJANGO_SETTINGS_MODULE')}".encode(),
+        digest_size=6,
+    ).hexdigest(),
+)
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -28,7 +42,6 @@ INSTALLED_APPS = [
     "django_filters",
     "rest_framework",
     "djoser",
-    "debug_toolbar",
     "store",
     "tags",
     "core",
@@ -36,9 +49,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
+    "core.middleware.AdmissionControlMiddleware",
+    "core.middleware.ProfilingMiddleware",
+    "core.middleware.IdentityMapMiddleware",
+    "core.middleware.QueryBudgetMiddleware",
+    "core.middleware.CompressionMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "core.middleware.StaticFilesMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -129,9 +146,25 @@ AUTH_USER_MODEL = "core.User"
 
 REST_FRAMEWORK = {
     "COERCE_DECIMAL_TO_STRING": False,
-    "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+    "DEFAULT_RENDERER_CLASSES": (
+        "core.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+    "DEFAULT_PARSER_CLASSES": (
+        "core.renderers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
     ),
+    "DEFAULT_AUTHENTICATION_CLASSES": ("core.authentication.JWTAuthentication",),
+}
+
+# responses smaller than MIN_SIZE bytes are not worth compressing
+RESPONSE_COMPRESSION = {
+    "MIN_SIZE": 1024,
+    "GZIP_LEVEL": 6,
+    # random padding of gzip responses against BREACH, see core.middleware
+    "GZIP_PADDING": 100,
+    "BROTLI_QUALITY": 4,
 }
 
 # pass `JWT` key as part of the request header (JWT <access_token> header)
@@ -147,27 +180,204 @@ DJOSER = {
 }
 
 # Configuring Email Backend
-EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
-EMAIL_HOST = "localhost"
+# emails are written to an outbox table in the request transaction and delivered
+# by the `send_outbox` worker through OUTBOX_DELIVERY_BACKEND
+EMAIL_BACKEND = "core.mail.OutboxEmailBackend"
+OUTBOX_DELIVERY_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+EMAIL_HOST = os.environ.get("EMAIL_HOST", "localhost")
 EMAIL_HOST_USER = ""
 EMAIL_HOST_PASSWORD = ""
-EMAIL_PORT = 2525
+EMAIL_PORT = int(os.environ.get("EMAIL_PORT", 2525))
 DEFAULT_FROM_EMAIL = "from@dennis.com"
 
+OUTBOX = {
+    "MAX_ATTEMPTS": 5,
+    # retry delays double from BACKOFF_SECONDS up to MAX_BACKOFF_SECONDS
+    "BACKOFF_SECONDS": 30,
+    "MAX_BACKOFF_SECONDS": 3600,
+    # an email claimed by a worker is retried once its lease expires
+    "LEASE_SECONDS": 300,
+}
+
+# Admission control: concurrency limits (shared by all worker processes of a host)
+# and per-client token buckets for each endpoint class, see core.middleware;
+# enabled by default in production only
+ADMISSION_CONTROL = {
+    "ENABLED": os.environ.get("ADMISSION_CONTROL_ENABLED", "0") == "1",
+    "STATE_FILE": os.environ.get(
+        "ADMISSION_CONTROL_STATE_FILE", RUNTIME_PREFIX + "-admission"
+    ),
+    "CLASSES": {
+        "catalog_reads": {
+            "methods": ["GET", "HEAD"],
+            "path": r"^/store/(products|collections|catalog)/",
+            "max_concurrency": 64,
+            "rate": 20,
+            "burst": 60,
+        },
+        "cart_writes": {
+            "methods": ["POST", "PATCH", "DELETE"],
+            "path": r"^/store/carts/",
+            "max_concurrency": 32,
+            "rate": 10,
+            "burst": 30,
+        },
+        "order_creation": {
+            "methods": ["POST"],
+            "path": r"^/store/orders/$",
+            "max_concurrency": 8,
+            "rate": 1,
+            "burst": 5,
+            "retry_after": 2,
+        },
+        # long-lived: a waiting long-poll holds its slot, a stream only while opening
+        "order_events": {
+            "methods": ["GET"],
+            "path": r"^/store/orders/events/$",
+            "max_concurrency": 1024,
+            "rate": 1,
+            "burst": 10,
+        },
+        # a batch carries up to 20 sub-requests, each also admitted in its class
+        "batch": {
+            "methods": ["POST"],
+            "path": r"^/store/batch/$",
+            "max_concurrency": 16,
+            "rate": 2,
+            "burst": 10,
+        },
+    },
+}
+
+# per-request cpu / memory profiles, browsable at /admin/profiles/ (core.profiler)
+PROFILER = {
+    # requests sent with `X-Profile: <TOKEN>` are profiled (disabled when empty)
+    "TOKEN": os.environ.get("PROFILER_TOKEN", ""),
+    # fraction of the requests matching PATHS that are profiled
+    "SAMPLE_RATE": float(os.environ.get("PROFILER_SAMPLE_RATE", 0)),
+    "PATHS": r"^/store/",
+    # seconds between two stack samples
+    "INTERVAL": 0.005,
+    "MEMORY": True,
+    "MEMORY_FRAMES": 10,
+    "DIRECTORY": os.environ.get("PROFILER_DIRECTORY", RUNTIME_PREFIX + "-profiles"),
+    # profiles kept, the oldest are deleted
+    "KEEP": 200,
+}
+
+# delta sync of the catalog (store.views.CatalogSyncViewSet)
+CATALOG_SYNC = {
+    "PAGE_SIZE": 500,
+    "MAX_PAGE_SIZE": 2000,
+    # changes are only handed out once older than the longest expected transaction
+    "SETTLE_SECONDS": 5,
+}
+
+# read-only catalog snapshot mapped by every worker (store.snapshot), written by
+# `manage.py build_catalog_snapshot`; product and collection reads without
+# filters are answered from it instead of the database. A catalog write sets
+# aside the snapshots of its host until the next build
+CATALOG_SNAPSHOT = {
+    "ENABLED": os.environ.get("CATALOG_SNAPSHOT_ENABLED", "0") == "1",
+    "PATH": os.environ.get(
+        "CATALOG_SNAPSHOT_PATH", RUNTIME_PREFIX + "-catalog.snapshot"
+    ),
+    # seconds between two checks for a newer file
+    "CHECK_INTERVAL": 2,
+    # an older snapshot (builder stopped) is ignored and reads go to the database
+    "MAX_AGE": 600,
+}
+
+# per-view query count / database time budgets and statement timeouts
+# (core.budgets), views override DEFAULT with their `query_budgets`
+QUERY_BUDGETS = {
+    # "log", "reject" (503 for GET / HEAD requests over budget), "raise" (tests,
+    # 503 once the request ran) or "off"
+    "MODE": os.environ.get("QUERY_BUDGETS_MODE", "log"),
+    "DEFAULT": {
+        "queries": 20,
+        # seconds
+        "db_time": 0.5,
+        "statement_timeout": float(os.environ.get("STATEMENT_TIMEOUT", 5)),
+    },
+    # per-process counters, merged by `manage.py query_budget_report`
+    "DIRECTORY": os.environ.get(
+        "QUERY_BUDGETS_DIRECTORY", RUNTIME_PREFIX + "-query-budgets"
+    ),
+    "FLUSH_INTERVAL": 30,
+}
+
+# set-based deletes of the admin bulk delete endpoints (store.bulkdelete)
+BULK_DELETE = {
+    # ids checked and deleted per transaction
+    "CHUNK_SIZE": 500,
+    # ids accepted by one request
+    "MAX_IDS": 10000,
+}
+
+# carts and cart items are hashed by cart id to one of these databases
+# (store.sharding), each a DATABASES alias; run `manage.py rebalance_carts` after
+# changing the list
+CART_SHARDS = {
+    "DATABASES": ["default"],
+}
+DATABASE_ROUTERS = ["store.sharding.CartShardRouter"]
+
+# cached cart summaries (store.carts), dropped when the cart's items change
+CART_SUMMARY = {
+    "TIMEOUT": 300,
+}
+
+# typeahead title index of each worker (store.autocomplete): the writes of the
+# other workers are applied within CHECK_INTERVAL, and the index is rebuilt every
+# RELOAD_SECONDS to follow the popularity they count
+AUTOCOMPLETE = {
+    "CHECK_INTERVAL": 1,
+    "RELOAD_SECONDS": 300,
+}
+
+# order status feed (store.events), best served by ASGI workers
+ORDER_EVENTS = {
+    # each worker reads the latest event id this often while clients wait
+    "POLL_INTERVAL": 1,
+    "LONG_POLL_TIMEOUT": 25,
+    "HEARTBEAT_SECONDS": 15,
+    # streams are closed after this long and the client reconnects
+    "STREAM_SECONDS": 300,
+    "RETRY_MILLISECONDS": 3000,
+    "BATCH_SIZE": 100,
+    # events are sent once this old, past the commit of any earlier event id
+    "SETTLE_SECONDS": 2,
+}
+
+# request threads only enqueue log records; a background thread writes them as
+# json lines to a rotating file, see core.log
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
+    "filters": {
+        "sampling": {
+            "()": "core.log.SamplingFilter",
+            # fraction of the sub-warning records kept for high-volume loggers
+            "rates": {
+                "django.db.backends": 0.01,
+                "django.server": 0.1,
+            },
+        }
+    },
     "handlers": {
-        "console": {"class": "logging.StreamHandler"},
+        "console": {"class": "logging.StreamHandler", "formatter": "verbose"},
         "file": {
-            "class": "logging.FileHandler",
+            "class": "core.log.QueueFileHandler",
             "filename": "general.log",
-            "formatter": "verbose",
+            "max_bytes": 10 * 1024 * 1024,
+            "backup_count": 5,
+            "filters": ["sampling"],
         },
     },
     "loggers": {
         "": {
-            "handlers": ["console", "file"],
+            "handlers": ["file"],
             "level": os.environ.get("DJANGO_LOG_LEVEL", "INFO"),
         }
     },
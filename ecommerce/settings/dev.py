@@ -1,8 +1,17 @@
 from .common import *
+import os
 
 DEBUG = True
 SECRET_KEY = "django-insecure-!5n(g239zz6174y)v-h)zm!jv3=oe*179pllhfw((&mvf%q!_b"
 
+# the debug toolbar is a development-only dependency
+INSTALLED_APPS += ["debug_toolbar"]
+# right after the compression middleware, so it injects into uncompressed html
+MIDDLEWARE.insert(
+    MIDDLEWARE.index("core.middleware.CompressionMiddleware") + 1,
+    "debug_toolbar.middleware.DebugToolbarMiddleware",
+)
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.mysql",
@@ -14,3 +23,16 @@ DATABASES = {
         "OPTIONS": {"init_command": "SET sql_mode='STRICT_TRANS_TABLES'"},
     }
 }
+
+# CART_SHARDS=<n> keeps carts in n SQLite files instead of MySQL, to try the
+# sharded carts (store.sharding) locally; `manage.py migrate --database carts_<i>`
+for index in range(int(os.environ.get("CART_SHARDS", 0))):
+    DATABASES[f"carts_{index}"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / f"carts_{index}.sqlite3",
+    }
+if "carts_0" in DATABASES:
+    CART_SHARDS["DATABASES"] = [alias for alias in DATABASES if alias != "default"]
+
+# echo logs to the console while developing (synchronously, unlike the file handler)
+LOGGING["loggers"][""]["handlers"] = ["console", "file"]
@@ -0,0 +1,14 @@
+from .dev import *
+
+# two cart databases on the development server, so that the tests go through the
+# sharded code paths (store.sharding); the test runner creates test_<NAME> for each
+for index in range(2):
+    DATABASES[f"carts_{index}"] = {
+        **DATABASES["default"],
+        "NAME": f"{DATABASES['default']['NAME']}_carts_{index}",
+    }
+CART_SHARDS["DATABASES"] = ["carts_0", "carts_1"]
+
+# uploads and the file log of a test run stay out of the source tree
+MEDIA_ROOT = RUNTIME_PREFIX + "-media"
+LOGGING["handlers"]["file"]["filename"] = RUNTIME_PREFIX + "-general.log"
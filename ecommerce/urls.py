@@ -15,21 +15,32 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+from core.views import profile_file, profile_list, serve_media
 
 admin.site.site_header = "Dennify Store Admin"
 admin.site.index_title = "Admin"
 
 urlpatterns = [
+    # before admin.site.urls, which would answer 404 for them
+    path("admin/profiles/", admin.site.admin_view(profile_list), name="profiles"),
+    path(
+        "admin/profiles/<str:name>",
+        admin.site.admin_view(profile_file),
+        name="profile-file",
+    ),
     path("admin/", admin.site.urls),
     path("", include("core.urls")),
     path("store/", include("store.urls")),
     path("auth/", include("djoser.urls")),
     path("auth/", include("djoser.urls.jwt")),
-    path("__debug__/", include("debug_toolbar.urls")),
 ]
 
+if "debug_toolbar" in settings.INSTALLED_APPS:
+    urlpatterns += [path("__debug__/", include("debug_toolbar.urls"))]
+
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += [
+        re_path(rf"^{settings.MEDIA_URL.lstrip('/')}(?P<path>.*)$", serve_media)
+    ]
@@ -0,0 +1,62 @@
+"""
+Production process model (picked up automatically by `gunicorn` from the project
+root). Every value can be overridden through the environment:
+
+- WSGI, threaded workers (default):
+    gunicorn ecommerce.wsgi:application
+- ASGI workers, needed for the streaming endpoints:
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn ecommerce.asgi:application
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+
+# processes for cpu parallelism, threads to overlap database and network waits
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# import django and the project once in the master, so workers fork with the
+# code already loaded (faster startup, copy-on-write shared memory)
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+# recycle workers now and then to bound memory growth, staggered by the jitter
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 200))
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
+
+
+def when_ready(server):
+    # with preload_app, load the url configuration (views, serializers...) in the
+    # master too, instead of lazily on the first request of every worker
+    if preload_app:
+        from django.urls import get_resolver
+
+        get_resolver().url_patterns
+
+
+def post_fork(server, worker):
+    # connections opened in the master while preloading must not be shared
+    from django.db import connections
+
+    connections.close_all()
+
+
+def post_worker_init(worker):
+    # warm the in-process title autocomplete index before serving requests
+    from store.autocomplete import title_index
+
+    title_index.load()
+
+    # map the catalog snapshot, when one has been built
+    from store.snapshot import get_snapshot
+
+    get_snapshot()
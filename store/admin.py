@@ -5,14 +5,27 @@ from django.contrib import admin, messages
 from django.db.models import Count
 from django.utils.html import format_html, urlencode
 from django.urls import reverse
+from django.utils import timezone
+from store import bulkdelete, changelog
 from store.models import Product, Customer, Order, Collection, OrderItem, ProductImage
 
 
+def report_bulk_delete(model_admin, request, result):
+    """messages for the result of a store.bulkdelete function"""
+    model_admin.message_user(request, f"{len(result['deleted'])} deleted.")
+    if result["blocked"]:
+        blocked = ", ".join(
+            f"{item['id']} ({item['reason']})" for item in result["blocked"]
+        )
+        model_admin.message_user(request, f"Not deleted: {blocked}.", messages.WARNING)
+
+
 # Register your models here.
 @admin.register(Collection)
 class CollectionAdmin(admin.ModelAdmin):
     list_display = ["title", "products_count"]
     search_fields = ["title"]
+    actions = ["bulk_delete"]
 
     @admin.display(ordering="products_count")
     def products_count(self, collection: Collection):
@@ -27,6 +40,14 @@ class CollectionAdmin(admin.ModelAdmin):
     def get_queryset(self, request: HttpRequest) -> QuerySet[Any]:
         return super().get_queryset(request).annotate(products_count=Count("products"))
 
+    @admin.action(
+        description="Delete selected collections without products (set-based)",
+        permissions=["delete"],
+    )
+    def bulk_delete(self, request, queryset):
+        ids = list(queryset.values_list("id", flat=True))
+        report_bulk_delete(self, request, bulkdelete.delete_collections(ids))
+
 
 # customising list_filter attribute of ProductAdmin
 class InventoryFilter(admin.SimpleListFilter):
@@ -65,7 +86,7 @@ class ProductAdmin(admin.ModelAdmin):
     list_select_related = ["collection"]
     list_filter = ["collection", "last_update", InventoryFilter]
     search_fields = ["title"]
-    actions = ["clear_inventory"]
+    actions = ["clear_inventory", "bulk_delete"]
     # customising the Product Add form
     autocomplete_fields = ["collection"]
     prepopulated_fields = {"slug": ["title"]}
@@ -84,11 +105,24 @@ class ProductAdmin(admin.ModelAdmin):
 
     @admin.action(description="Clear inventory")
     def clear_inventory(self, request, queryset):
-        updated_count = queryset.update(inventory=0)
+        product_ids = list(queryset.values_list("id", flat=True))
+        # update() skips the signals that keep the sync change log
+        updated_count = Product.objects.filter(id__in=product_ids).update(
+            inventory=0, last_update=timezone.now()
+        )
+        changelog.record(Product, product_ids)
         self.message_user(
             request, f"{updated_count} products were successfully updated.", messages
         )
 
+    @admin.action(
+        description="Delete selected products not ordered yet (set-based)",
+        permissions=["delete"],
+    )
+    def bulk_delete(self, request, queryset):
+        ids = list(queryset.values_list("id", flat=True))
+        report_bulk_delete(self, request, bulkdelete.delete_products(ids))
+
     class Media:
         css = {"all": ["store/styles.css"]}
 
@@ -0,0 +1,236 @@
+"""
+In-process prefix index of product titles for typeahead suggestions.
+
+Titles are normalized (case folded, accents and punctuation stripped) and kept in a
+sorted array, so the titles starting with a prefix are a contiguous slice found
+with two binary searches. Suggestions are the top-N of that slice by popularity
+(units ordered); prefixes matching many titles get their top-N cached until the
+next write.
+
+- the worker making a write updates its index in place once it commits, and
+bumps a titles version in the cache. The other workers read the version every
+`AUTOCOMPLETE["CHECK_INTERVAL"]` seconds; when it changed, they apply the
+products of the catalog change log (store.changelog) since their last position
+(with the per-process default cache, only the worker making the write follows
+it, set `REDIS_URL`)
+
+- popularity only changes in place, every index is also rebuilt after
+`AUTOCOMPLETE["RELOAD_SECONDS"]` to pick up the orders of other workers
+"""
+
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, bisect_right, insort
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+
+from store.models import CatalogChange, OrderItem, Product
+
+MAX_SUGGESTIONS = 10
+# prefixes matching more titles than this have their suggestions cached
+CACHED_SLICE_SIZE = 500
+MAX_CACHED_PREFIXES = 10000
+VERSION_KEY = "autocomplete:titles"
+# more changed products than this are applied by reloading the whole index
+MAX_APPLIED_CHANGES = 1000
+
+
+def config(name, default=None):
+    return getattr(settings, "AUTOCOMPLETE", {}).get(name, default)
+
+
+def settled_change_id():
+    """
+    the position of the change log below which no transaction still commits, as
+    assumed by the catalog sync (`CATALOG_SYNC["SETTLE_SECONDS"]`)
+    """
+    settle = getattr(settings, "CATALOG_SYNC", {}).get("SETTLE_SECONDS", 5)
+    settled = timezone.now() - timedelta(seconds=settle)
+    return (
+        CatalogChange.objects.filter(changed_at__lte=settled)
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+        or 0
+    )
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[^\w\s]", " ", text.casefold()).split())
+
+
+class TitleIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        # titles version the index reflects, when it was loaded and the version
+        # last read, and the change log position it reflects
+        self.version = None
+        self.loaded_at = 0.0
+        self.checked_at = 0.0
+        self.change_id = 0
+        # sorted (normalized title, product id), and per id: (title, popularity)
+        self.keys = []
+        self.products = {}
+        self.cache = {}
+
+    def load(self):
+        # read first: a write committed while loading bumps it again
+        version = cache.get(VERSION_KEY, 0)
+        change_id = settled_change_id()
+        popularity = dict(
+            OrderItem.objects.values("product_id")
+            .annotate(units=Sum("quantity"))
+            .values_list("product_id", "units")
+        )
+        keys, products = [], {}
+        for product_id, title in Product.objects.values_list("id", "title"):
+            keys.append((normalize(title), product_id))
+            products[product_id] = (title, popularity.get(product_id, 0))
+        keys.sort()
+
+        with self.lock:
+            self.keys, self.products, self.cache = keys, products, {}
+            self.loaded = True
+            self.version = version
+            self.loaded_at = self.checked_at = time.monotonic()
+            self.change_id = change_id
+
+    def apply_changes(self, version):
+        """
+        - the products changed since the position of the index, instead of a
+        reload
+
+        - the changes of the last `SETTLE_SECONDS` are applied again by the next
+        call, a transaction that commits late may have logged below them
+        """
+        change_id = settled_change_id()
+        product_ids = set(
+            CatalogChange.objects.filter(
+                kind=CatalogChange.KIND_PRODUCT, id__gt=self.change_id
+            ).values_list("object_id", flat=True)
+        )
+        if len(product_ids) > MAX_APPLIED_CHANGES:
+            self.load()
+            return
+        titles = dict(
+            Product.objects.filter(id__in=product_ids).values_list("id", "title")
+        )
+
+        with self.lock:
+            for product_id in product_ids:
+                if product_id in titles:
+                    self._put(product_id, titles[product_id])
+                else:
+                    self._remove(product_id)
+            self.cache = {}
+            self.version = version
+            self.change_id = max(self.change_id, change_id)
+
+    def ensure_loaded(self):
+        now = time.monotonic()
+        if not self.loaded or now - self.loaded_at > config("RELOAD_SECONDS", 300):
+            self.load()
+        elif now - self.checked_at > config("CHECK_INTERVAL", 1):
+            self.checked_at = now
+            version = cache.get(VERSION_KEY, 0)
+            if version != self.version:
+                self.apply_changes(version)
+
+    def _bump_version(self):
+        """called after an in-place change: the other workers reload"""
+        try:
+            version = cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, 1, None)
+            version = 1
+        with self.lock:
+            if self.version == version - 1:
+                # no other write in between: this index is up to date
+                self.version = version
+
+    def _remove(self, product_id):
+        title = self.products.pop(product_id, None)
+        if title is not None:
+            key = (normalize(title[0]), product_id)
+            index = bisect_left(self.keys, key)
+            if index < len(self.keys) and self.keys[index] == key:
+                del self.keys[index]
+
+    def _put(self, product_id, title):
+        popularity = self.products.get(product_id, (None, 0))[1]
+        self._remove(product_id)
+        insort(self.keys, (normalize(title), product_id))
+        self.products[product_id] = (title, popularity)
+
+    def update(self, product_id, title):
+        """a committed product save"""
+        if self.loaded:
+            with self.lock:
+                self._put(product_id, title)
+                self.cache = {}
+        self._bump_version()
+
+    def remove(self, product_ids):
+        """committed product deletes"""
+        if self.loaded:
+            with self.lock:
+                for product_id in product_ids:
+                    self._remove(product_id)
+                self.cache = {}
+        self._bump_version()
+
+    def add_popularity(self, quantities):
+        """quantities: {product_id: units}, from a newly placed order"""
+        if not self.loaded:
+            return
+        with self.lock:
+            for product_id, units in quantities.items():
+                if product_id in self.products:
+                    title, popularity = self.products[product_id]
+                    self.products[product_id] = (title, popularity + units)
+            self.cache = {}
+
+    def suggest(self, query, limit=MAX_SUGGESTIONS):
+        self.ensure_loaded()
+        prefix = normalize(query)
+        if not prefix:
+            return []
+
+        limit = min(limit, MAX_SUGGESTIONS)
+        with self.lock:
+            if prefix in self.cache:
+                return self.cache[prefix][:limit]
+
+            start = bisect_left(self.keys, (prefix,))
+            end = bisect_right(self.keys, (prefix + "\U0010ffff",))
+            cacheable = (
+                end - start > CACHED_SLICE_SIZE
+                and len(self.cache) < MAX_CACHED_PREFIXES
+            )
+            top = heapq.nsmallest(
+                MAX_SUGGESTIONS if cacheable else limit,
+                (
+                    (-self.products[product_id][1], key, product_id)
+                    for key, product_id in self.keys[start:end]
+                ),
+            )
+            suggestions = [
+                {"id": product_id, "title": self.products[product_id][0]}
+                for _, _, product_id in top
+            ]
+            if cacheable:
+                self.cache[prefix] = suggestions
+        return suggestions[:limit]
+
+
+title_index = TitleIndex()
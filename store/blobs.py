@@ -0,0 +1,51 @@
+"""
+Reference counting of the content-addressed image files (see store.storage).
+
+ProductImage signals acquire a reference when an image is stored and release it
+when the image is deleted or replaced; a file is deleted once its last reference
+is released and the transaction commits.
+"""
+
+import logging
+
+from django.db import transaction
+from django.db.models import F
+
+from store.models import ImageBlob
+
+logger = logging.getLogger(__name__)
+
+
+def acquire(name, storage, content=None):
+    """
+    - takes a reference to the stored file `name`
+
+    - `content`: the upload stored under that name, written again if the file
+    was deleted meanwhile
+    """
+    with transaction.atomic():
+        blob, _ = ImageBlob.objects.select_for_update().get_or_create(name=name)
+        ImageBlob.objects.filter(pk=blob.pk).update(references=F("references") + 1)
+        if storage.exists(name):
+            return
+        # a concurrent delete collected the file after this upload found it
+        # already stored, before the reference above was taken
+        if content is None:
+            logger.error("Image file %s is missing and cannot be restored", name)
+            return
+        storage.restore(name, content)
+
+
+def release(name, storage):
+    ImageBlob.objects.filter(name=name, references__gt=0).update(
+        references=F("references") - 1
+    )
+    transaction.on_commit(lambda: collect(name, storage))
+
+
+def collect(name, storage):
+    with transaction.atomic():
+        blob = ImageBlob.objects.select_for_update().filter(name=name).first()
+        if blob is not None and blob.references == 0:
+            storage.delete(name)
+            blob.delete()
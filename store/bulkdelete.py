@@ -0,0 +1,203 @@
+"""
+Set-based deletion of products and collections, for the admin bulk delete
+endpoints and actions.
+
+- the ids are checked with one query per chunk: an EXISTS on the protecting
+table (order items for products, products for collections) tells which rows
+cannot be deleted, under a row lock so no reference is added meanwhile
+
+- the dependent rows are deleted by one DELETE per table and chunk, instead of
+being loaded by the deletion collector; the side effects of their delete signals
+(image references, change log, collection indexes, cached cart summaries, title
+index) are applied in bulk
+
+- cart items are in the cart databases (store.sharding): they are deleted from
+each of them before the chunk commits, a rollback then only empties carts
+"""
+
+import logging
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+
+from store import blobs, carts, changelog, indexes, sharding
+from store.autocomplete import title_index
+from store.models import (
+    CartItem,
+    Collection,
+    CollectionProductIndex,
+    DailyCollectionSales,
+    DailyProductSales,
+    ImageBlob,
+    OrderItem,
+    Product,
+    ProductCoOccurrence,
+    ProductImage,
+    ProductRecommendation,
+    Review,
+)
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_DEPENDENTS = [
+    (Review, "product_id"),
+    (ProductImage, "product_id"),
+    (ProductCoOccurrence, "product_id"),
+    (ProductCoOccurrence, "other_id"),
+    (ProductRecommendation, "product_id"),
+    (ProductRecommendation, "recommended_id"),
+    (DailyProductSales, "product_id"),
+    (Product.promotions.through, "product_id"),
+]
+COLLECTION_DEPENDENTS = [
+    (CollectionProductIndex, "collection_id"),
+    (DailyCollectionSales, "collection_id"),
+]
+
+
+def config(name, default=None):
+    return getattr(settings, "BULK_DELETE", {}).get(name, default)
+
+
+def _chunks(ids, size):
+    ids = sorted(set(ids))
+    for start in range(0, len(ids), size):
+        yield ids[start : start + size]
+
+
+def _raw_delete(model, using=None, **lookup):
+    # a single DELETE, without loading the rows or sending signals (what the
+    # deletion collector does for models without dependents or receivers)
+    queryset = model.objects.using(using).filter(**lookup)
+    return queryset._raw_delete(queryset.db)
+
+
+def _release_images(images):
+    """the ProductImage post_delete signal, for many images: (id, name) pairs"""
+    if not images:
+        return
+    storage = ProductImage._meta.get_field("image").storage
+    for name, count in Counter(name for _, name in images).items():
+        updated = ImageBlob.objects.filter(name=name, references__gte=count).update(
+            references=F("references") - count
+        )
+        if not updated:
+            # the count drifted below the images using the file: it is recounted
+            # from the images left, the deleted rows are already gone
+            logger.warning(
+                "Image file %s has fewer references than the %d deleted images",
+                name,
+                count,
+            )
+            ImageBlob.objects.filter(name=name).update(
+                references=ProductImage.objects.filter(image=name).count()
+            )
+        transaction.on_commit(lambda name=name: blobs.collect(name, storage))
+    changelog.record(ProductImage, [image_id for image_id, _ in images], deleted=True)
+
+
+def _delete_product_chunk(product_ids, result):
+    with transaction.atomic():
+        rows = (
+            Product.objects.select_for_update()
+            .filter(id__in=product_ids)
+            .annotate(
+                ordered=Exists(OrderItem.objects.filter(product_id=OuterRef("pk")))
+            )
+            .values_list("id", "collection_id", "ordered")
+        )
+        deletable, collections = [], {}
+        for product_id, collection_id, ordered in rows:
+            result["found"].add(product_id)
+            if ordered:
+                result["blocked"].append(
+                    {"id": product_id, "reason": "referenced by order items"}
+                )
+            else:
+                deletable.append(product_id)
+                collections.setdefault(collection_id, set()).add(product_id)
+        if not deletable:
+            return
+
+        images = list(
+            ProductImage.objects.filter(product_id__in=deletable).values_list(
+                "id", "image"
+            )
+        )
+        cart_ids = set()
+        for alias in sharding.databases():
+            cart_ids.update(
+                CartItem.objects.using(alias)
+                .filter(product_id__in=deletable)
+                .values_list("cart_id", flat=True)
+            )
+            _raw_delete(CartItem, using=alias, product_id__in=deletable)
+        for model, field in PRODUCT_DEPENDENTS:
+            _raw_delete(model, **{f"{field}__in": deletable})
+        _raw_delete(Product, id__in=deletable)
+
+        _release_images(images)
+        changelog.record(Product, deletable, deleted=True)
+        for collection_id, removed in collections.items():
+            indexes.remove_products(removed, collection_id)
+        transaction.on_commit(lambda: _after_products_deleted(deletable, cart_ids))
+        result["deleted"].extend(deletable)
+
+
+def _after_products_deleted(product_ids, cart_ids):
+    title_index.remove(product_ids)
+    for cart_id in cart_ids:
+        carts.invalidate(cart_id)
+    carts.invalidate_prices()
+
+
+def _delete(ids, delete_chunk):
+    result = {"deleted": [], "blocked": [], "found": set()}
+    for chunk in _chunks(ids, config("CHUNK_SIZE", 500)):
+        delete_chunk(chunk, result)
+    result["not_found"] = sorted(set(ids) - result.pop("found"))
+    return result
+
+
+def delete_products(product_ids):
+    """
+    - deletes the products that no order item references, `CHUNK_SIZE` at a time
+    (one transaction per chunk)
+
+    - returns {"deleted": [ids], "blocked": [{"id", "reason"}], "not_found": [ids]}
+    """
+    return _delete(product_ids, _delete_product_chunk)
+
+
+def _delete_collection_chunk(collection_ids, result):
+    with transaction.atomic():
+        rows = (
+            Collection.objects.select_for_update()
+            .filter(id__in=collection_ids)
+            .annotate(used=Exists(Product.objects.filter(collection_id=OuterRef("pk"))))
+            .values_list("id", "used")
+        )
+        deletable = []
+        for collection_id, used in rows:
+            result["found"].add(collection_id)
+            if used:
+                result["blocked"].append(
+                    {"id": collection_id, "reason": "has products"}
+                )
+            else:
+                deletable.append(collection_id)
+        if not deletable:
+            return
+
+        for model, field in COLLECTION_DEPENDENTS:
+            _raw_delete(model, **{f"{field}__in": deletable})
+        _raw_delete(Collection, id__in=deletable)
+        changelog.record(Collection, deletable, deleted=True)
+        result["deleted"].extend(deletable)
+
+
+def delete_collections(collection_ids):
+    """same as `delete_products`, for collections without products"""
+    return _delete(collection_ids, _delete_collection_chunk)
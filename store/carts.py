@@ -0,0 +1,144 @@
+"""
+Item count and total of a cart, for the storefront header badge
+(/store/carts/<id>/summary/).
+
+- computed by one aggregate query, then cached per cart until an item of the
+cart is written (see store.signals). Carts kept out of the default database
+(store.sharding) cannot be joined with their products: their quantities and
+the prices are read by one query each
+
+- cached entries are keyed by a version of the cart, replaced when an item is
+written: a summary computed before the write and cached after it lands on the
+previous version and is never read. They also depend on a prices version,
+bumped when a product changes, so totals follow price changes without knowing
+which carts hold the product
+
+- only cached in a cache shared by the workers (`REDIS_URL`): with a cache per
+process, the other workers would not see the invalidations
+
+- the ETag is derived from the summary, so pollers revalidate with
+If-None-Match and get a 304 without a body
+"""
+
+import hashlib
+import uuid
+from decimal import Decimal
+
+import orjson
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import Coalesce
+
+from store import sharding
+from store.models import Cart, CartItem, Product
+
+PRICES_VERSION_KEY = "cart-summary:prices"
+
+
+def _timeout():
+    return getattr(settings, "CART_SUMMARY", {}).get("TIMEOUT", 300)
+
+
+def _shared_cache():
+    return not isinstance(caches["default"], LocMemCache)
+
+
+def _cart_key(cart_id):
+    # cart ids arrive as UUIDs or as the hex / dashed strings of urls
+    return f"cart-summary:{Cart._meta.pk.to_python(cart_id).hex}"
+
+
+def _aggregate(cart_id):
+    return (
+        Cart.objects.filter(pk=cart_id)
+        .annotate(
+            items_count=Count("items"),
+            quantity=Coalesce(Sum("items__quantity"), 0),
+            total_price=Coalesce(
+                Sum(
+                    F("items__quantity") * F("items__product__unit_price"),
+                    output_field=DecimalField(max_digits=12, decimal_places=2),
+                ),
+                0,
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+        .values("items_count", "quantity", "total_price")
+        .first()
+    )
+
+
+def _aggregate_across(cart_id):
+    lines = list(
+        CartItem.objects.for_cart(cart_id).values_list("product_id", "quantity")
+    )
+    if not lines and not Cart.objects.for_cart(cart_id).exists():
+        return None
+    prices = dict(
+        Product.objects.filter(
+            id__in=[product_id for product_id, _ in lines]
+        ).values_list("id", "unit_price")
+    )
+    return {
+        "items_count": len(lines),
+        "quantity": sum(quantity for _, quantity in lines),
+        "total_price": sum(
+            (quantity * prices.get(product_id, 0) for product_id, quantity in lines),
+            Decimal("0.00"),
+        ),
+    }
+
+
+def _compute(cart_id):
+    if sharding.shard_for(cart_id) == DEFAULT_DB_ALIAS:
+        summary = _aggregate(cart_id)
+    else:
+        summary = _aggregate_across(cart_id)
+    if summary is None:
+        return None
+    summary = {"id": str(cart_id), **summary}
+    summary["etag"] = (
+        '"%s"' % hashlib.md5(orjson.dumps(summary, default=str)).hexdigest()
+    )
+    return summary
+
+
+def get_summary(cart_id):
+    """
+    - {id, items_count, quantity, total_price, etag}, or None when the cart
+    does not exist
+
+    - a cached summary costs no query
+    """
+    if not _shared_cache():
+        return _compute(cart_id)
+
+    cart_key = _cart_key(cart_id)
+    # read before computing, so a write meanwhile moves the cart past this key
+    versions = cache.get_many([cart_key, PRICES_VERSION_KEY])
+    key = (
+        f"{cart_key}:{versions.get(cart_key, 0)}:"
+        f"{versions.get(PRICES_VERSION_KEY, 0)}"
+    )
+    summary = cache.get(key)
+    if summary is None:
+        summary = _compute(cart_id)
+        if summary is not None:
+            cache.set(key, summary, _timeout())
+    return summary
+
+
+def invalidate(cart_id):
+    # a new random version, which cannot come back as a counter could once
+    # expired; it outlives the summaries cached under the version it replaces
+    cache.set(_cart_key(cart_id), uuid.uuid4().hex, 2 * _timeout())
+
+
+def invalidate_prices():
+    try:
+        cache.incr(PRICES_VERSION_KEY)
+    except ValueError:
+        cache.set(PRICES_VERSION_KEY, 1, None)
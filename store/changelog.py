@@ -0,0 +1,20 @@
+from store import snapshot
+from store.models import CatalogChange, Collection, Product, ProductImage
+
+KINDS = {
+    Collection: CatalogChange.KIND_COLLECTION,
+    Product: CatalogChange.KIND_PRODUCT,
+    ProductImage: CatalogChange.KIND_IMAGE,
+}
+
+
+def record(model, object_ids, deleted=False):
+    """moves the objects to the end of the change log, and outdates the snapshot"""
+    kind = KINDS[model]
+    object_ids = list(object_ids)
+    CatalogChange.objects.filter(kind=kind, object_id__in=object_ids).delete()
+    CatalogChange.objects.bulk_create(
+        CatalogChange(kind=kind, object_id=object_id, deleted=deleted)
+        for object_id in object_ids
+    )
+    snapshot.mark_stale()
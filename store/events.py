@@ -0,0 +1,280 @@
+"""
+Order status change feed, served by `order_events` at /store/orders/events/.
+
+Every payment status change writes an OrderStatusEvent (see store.signals); a
+client waits for the events of its own orders instead of polling each order:
+
+- Server-Sent Events (`Accept: text/event-stream`): the connection stays open and
+receives events as they are written, resuming from `Last-Event-ID` when the
+browser reconnects
+
+- long-poll (any other Accept): returns as soon as there are events after
+`?since=<id>`, or an empty list after `?timeout=` seconds; the next request
+passes the returned `last_id`
+
+Event ids are handed out at insert, not in commit order: an event is only sent
+once it is `ORDER_EVENTS["SETTLE_SECONDS"]` old, so that a transaction that
+commits late cannot slip below a position a client already holds.
+
+The view is async. Under ASGI (the middlewares are async-capable) a waiting
+client costs a coroutine, not a worker thread; whatever the number of waiting
+clients, each event loop polls the database once per interval for the latest
+event id, and clients only query their own events when it moves. Under WSGI a
+long-poll holds a worker thread until it returns, and streams are refused (501):
+the whole stream would be buffered before being sent.
+"""
+
+import asyncio
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import orjson
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Max
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from store.models import Customer, OrderStatusEvent
+
+
+def _config(name, default):
+    return getattr(settings, "ORDER_EVENTS", {}).get(name, default)
+
+
+def _latest_event_id():
+    # the poller runs outside of any request, so nothing else recycles its
+    # connection (CONN_MAX_AGE, health checks)
+    close_old_connections()
+    return OrderStatusEvent.objects.aggregate(latest=Max("id"))["latest"] or 0
+
+
+def _settle_time():
+    return timedelta(seconds=_config("SETTLE_SECONDS", 2))
+
+
+def _settled_event_id():
+    """the position of a client starting now"""
+    settled = timezone.now() - _settle_time()
+    return (
+        OrderStatusEvent.objects.filter(created_at__lte=settled).aggregate(
+            latest=Max("id")
+        )["latest"]
+        or 0
+    )
+
+
+def _fetch_events(customer_id, since):
+    """
+    - (events, seconds until the next one settles or None): the settled events
+    after `since`, in id order, up to the first one that is too recent
+    """
+    queryset = OrderStatusEvent.objects.filter(id__gt=since)
+    if customer_id is not None:
+        queryset = queryset.filter(customer_id=customer_id)
+    now = timezone.now()
+    settled = now - _settle_time()
+    events = []
+    for event in queryset.order_by("id").values(
+        "id", "order_id", "payment_status", "created_at"
+    )[: _config("BATCH_SIZE", 100)]:
+        if event["created_at"] > settled:
+            return events, (event["created_at"] - settled).total_seconds()
+        events.append(
+            {
+                "id": event["id"],
+                "order": event["order_id"],
+                "payment_status": event["payment_status"],
+                "created_at": event["created_at"],
+            }
+        )
+    return events, None
+
+
+def _customer_id(user):
+    """None for admins, who follow every order"""
+    if user.is_staff:
+        return None
+    return Customer.objects.values_list("id", flat=True).get(user_id=user.id)
+
+
+class EventFeed:
+    def __init__(self):
+        self.latest_id = None
+        self.changed = asyncio.Event()
+        self.waiters = 0
+        self.poller = None
+        # the poller outlives the requests that start it, so it queries from a
+        # thread (and database connection) of its own
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="order-events")
+
+    async def _poll(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.waiters:
+                latest_id = await loop.run_in_executor(self.executor, _latest_event_id)
+                if latest_id != self.latest_id:
+                    self.latest_id = latest_id
+                    self.changed.set()
+                    self.changed = asyncio.Event()
+                await asyncio.sleep(_config("POLL_INTERVAL", 1))
+        finally:
+            self.poller = None
+        await loop.run_in_executor(self.executor, connections.close_all)
+
+    async def wait(self, seen, timeout):
+        """
+        - waits until the latest event id is no longer `seen` (read before the
+        caller's last query, so no change is missed), or `timeout` seconds
+
+        - returns False on timeout
+        """
+        if self.latest_id is not None and self.latest_id != seen:
+            return True
+
+        changed = self.changed
+        self.waiters += 1
+        if self.poller is None:
+            self.poller = asyncio.get_running_loop().create_task(self._poll())
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiters -= 1
+
+
+# asyncio primitives belong to one event loop: one feed per loop
+_feeds = weakref.WeakKeyDictionary()
+
+
+def get_feed():
+    loop = asyncio.get_running_loop()
+    if loop not in _feeds:
+        _feeds[loop] = EventFeed()
+    return _feeds[loop]
+
+
+def _format(event):
+    data = orjson.dumps(event).decode()
+    return f"id: {event['id']}\nevent: order_status\ndata: {data}\n\n"
+
+
+async def _stream(customer_id, since):
+    loop = asyncio.get_running_loop()
+    feed = get_feed()
+    # `id` alone sets the browser's Last-Event-ID, so a reconnection before the
+    # first event still resumes from here
+    yield f"retry: {_config('RETRY_MILLISECONDS', 3000)}\nid: {since}\n\n"
+
+    # the stream is closed now and then so clients spread over restarted workers
+    deadline = loop.time() + _config("STREAM_SECONDS", 300)
+    while loop.time() < deadline:
+        seen = feed.latest_id
+        events, settles_in = await sync_to_async(_fetch_events)(customer_id, since)
+        if events:
+            for event in events:
+                yield _format(event)
+            since = events[-1]["id"]
+            continue
+
+        timeout = min(_config("HEARTBEAT_SECONDS", 15), deadline - loop.time())
+        if settles_in is not None and settles_in < timeout:
+            await asyncio.sleep(settles_in)
+        elif not await feed.wait(seen, max(timeout, 0)):
+            # keeps proxies from closing an idle connection
+            yield ": heartbeat\n\n"
+
+
+async def _long_poll(customer_id, since, timeout):
+    loop = asyncio.get_running_loop()
+    feed = get_feed()
+    deadline = loop.time() + timeout
+    while True:
+        seen = feed.latest_id
+        events, settles_in = await sync_to_async(_fetch_events)(customer_id, since)
+        remaining = deadline - loop.time()
+        if events or remaining <= 0:
+            break
+        if settles_in is not None:
+            await asyncio.sleep(min(settles_in, remaining))
+        else:
+            await feed.wait(seen, remaining)
+
+    return JsonResponse(
+        {"events": events, "last_id": events[-1]["id"] if events else since}
+    )
+
+
+def _unauthorized(detail):
+    response = JsonResponse({"detail": detail}, status=401)
+    response["WWW-Authenticate"] = 'JWT realm="api"'
+    return response
+
+
+def _parse_int(value, name, maximum=None):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        number = -1
+    if number < 0 or (maximum is not None and number > maximum):
+        raise ValueError(
+            f"'{name}' must be an integer between 0 and {maximum}."
+            if maximum is not None
+            else f"'{name}' must be a positive integer."
+        )
+    return number
+
+
+async def order_events(request):
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+
+    try:
+        authenticated = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed as error:
+        return _unauthorized(error.detail)
+    if authenticated is None:
+        return _unauthorized("Authentication credentials were not provided.")
+    try:
+        customer_id = await sync_to_async(_customer_id)(authenticated[0])
+    except Customer.DoesNotExist:
+        return JsonResponse(
+            {"detail": "The authenticated user is not a customer."}, status=403
+        )
+
+    max_timeout = _config("LONG_POLL_TIMEOUT", 25)
+    since = request.META.get("HTTP_LAST_EVENT_ID") or request.GET.get("since")
+    try:
+        since = None if since is None else _parse_int(since, "since")
+        timeout = _parse_int(
+            request.GET.get("timeout", max_timeout), "timeout", max_timeout
+        )
+    except ValueError as error:
+        return JsonResponse({"detail": str(error)}, status=400)
+    stream = "text/event-stream" in request.META.get("HTTP_ACCEPT", "")
+    if stream and not isinstance(request, ASGIRequest):
+        # the WSGI handler reads an async stream to its end before sending it
+        return JsonResponse(
+            {"detail": "Streams need the ASGI server, use long-polling."},
+            status=501,
+        )
+    if since is None:
+        # without a position, the feed starts with the next change
+        since = await sync_to_async(_settled_event_id)()
+
+    if stream:
+        response = StreamingHttpResponse(
+            _stream(customer_id, since), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        # nginx would otherwise buffer the stream
+        response["X-Accel-Buffering"] = "no"
+        return response
+    return await _long_poll(customer_id, since, timeout)
@@ -0,0 +1,61 @@
+from django.db.models import Count, Q
+
+# (min, max) unit price ranges, the upper bound excluded
+PRICE_BUCKETS = [(0, 10), (10, 25), (25, 50), (50, 100), (100, None)]
+# same threshold as the "Low" inventory filter of the admin
+LOW_STOCK_INVENTORY = 10
+
+
+def _price_filter(low, high):
+    condition = Q(unit_price__gte=low)
+    if high is not None:
+        condition &= Q(unit_price__lt=high)
+    return condition
+
+
+def product_facets(queryset):
+    """
+    - facet counts (per collection, per price bucket, low stock vs in stock) of the
+    products matched by `queryset`
+
+    - computed in a single query grouped by collection, with one conditional count
+    per price bucket and stock level; the other facets are summed from those rows
+    """
+    rows = (
+        queryset.prefetch_related(None)
+        .order_by()
+        .values("collection_id", "collection__title")
+        .annotate(
+            count=Count("id"),
+            low_stock=Count("id", filter=Q(inventory__lt=LOW_STOCK_INVENTORY)),
+            **{
+                f"price_{index}": Count("id", filter=_price_filter(low, high))
+                for index, (low, high) in enumerate(PRICE_BUCKETS)
+            },
+        )
+    )
+
+    collections = []
+    prices = [0] * len(PRICE_BUCKETS)
+    low_stock = total = 0
+    for row in rows:
+        collections.append(
+            {
+                "id": row["collection_id"],
+                "title": row["collection__title"],
+                "count": row["count"],
+            }
+        )
+        for index in range(len(PRICE_BUCKETS)):
+            prices[index] += row[f"price_{index}"]
+        low_stock += row["low_stock"]
+        total += row["count"]
+
+    return {
+        "collections": sorted(collections, key=lambda facet: facet["title"]),
+        "price": [
+            {"min": low, "max": high, "count": count}
+            for (low, high), count in zip(PRICE_BUCKETS, prices)
+        ],
+        "stock": {"in_stock": total - low_stock, "low_stock": low_stock},
+    }
@@ -0,0 +1,90 @@
+from rest_framework.permissions import SAFE_METHODS
+
+
+class SparseFieldsSerializerMixin:
+    """
+    - `fields` in the serializer context restricts the output to those fields
+
+    - `expand` in the serializer context replaces the relations listed in
+    `Meta.expandable_fields` (name -> (serializer class, options)) by nested objects
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        expand = self.context.get("expand") or ()
+        expandable_fields = getattr(self.Meta, "expandable_fields", {})
+        for name, (serializer_class, options) in expandable_fields.items():
+            if name in expand:
+                self.fields[name] = serializer_class(read_only=True, **options)
+
+        fields = self.context.get("fields")
+        if fields is not None:
+            for name in list(self.fields):
+                if name not in fields:
+                    self.fields.pop(name)
+
+
+class SparseFieldsViewSetMixin:
+    """
+    - reads `?fields=a,b` and `?expand=c` and passes them to the serializer
+
+    - only for reads: a write validates and saves every field (a pruned or
+    expanded, read-only, field would be left out of the save) and answers with
+    all of them
+
+    - `wants()` / `expands()` / `get_columns()` let `get_queryset` load only what
+    the response needs: skip prefetches and annotations of fields that are not
+    requested and restrict the selected columns with `only()`
+
+    - `sparse_columns` maps serializer fields to the model columns they read, for
+    fields that are not model fields of the same name (an empty list for fields
+    served by prefetches or annotations)
+    """
+
+    sparse_columns = {}
+
+    def _query_list(self, name):
+        value = self.request.query_params.get(name)
+        if value is None or self.request.method not in SAFE_METHODS:
+            return None
+        return {item.strip() for item in value.split(",") if item.strip()}
+
+    def get_requested_fields(self):
+        return self._query_list("fields")
+
+    def get_expand(self):
+        return self._query_list("expand") or set()
+
+    def wants(self, field):
+        fields = self.get_requested_fields()
+        return fields is None or field in fields
+
+    def expands(self, field):
+        return field in self.get_expand() and self.wants(field)
+
+    def get_columns(self, model):
+        """
+        - the columns to pass to `only()`, or None to load the whole row
+
+        - writes always load whole rows: saving an instance with deferred fields only
+        saves the loaded ones, which would skip `auto_now` fields
+        """
+        fields = self.get_requested_fields()
+        if fields is None:
+            return None
+
+        concrete = {field.name for field in model._meta.concrete_fields}
+        columns = set()
+        for field in fields:
+            if field in self.sparse_columns:
+                columns.update(self.sparse_columns[field])
+            elif field in concrete:
+                columns.add(field)
+        return columns | {model._meta.pk.name}
+
+    def get_fieldset_context(self):
+        return {"fields": self.get_requested_fields(), "expand": self.get_expand()}
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), **self.get_fieldset_context()}
@@ -0,0 +1,133 @@
+"""
+Precomputed product ids of each collection, ordered by a sort key
+(CollectionProductIndex), for browsing a collection without sorting its products.
+
+- the Product signals keep the indexes up to date: every save of a product
+rewrites the entries of each index of its collection (one JSON list per sort
+key), so the cost of a save grows with the size of its collection
+
+- QuerySet.update(), bulk_create() and raw SQL send no signals: after changing
+products that way, run `manage.py rebuild_collection_indexes`
+
+- the maintenance of a collection's indexes and their lazy first build take the
+collection's row lock, so no product saved meanwhile is left out of a new index
+"""
+
+from bisect import insort
+from decimal import Decimal
+
+from django.db import transaction
+
+from store.models import Collection, CollectionProductIndex, Product
+
+# sort value of a product for each precomputed sort key, chosen so that plain
+# python comparison matches the order the catalog should be browsed in
+SORT_VALUES = {
+    CollectionProductIndex.SORT_TITLE: lambda title: title.casefold(),
+    CollectionProductIndex.SORT_UNIT_PRICE: lambda unit_price: int(
+        Decimal(str(unit_price)) * 100
+    ),
+    CollectionProductIndex.SORT_LAST_UPDATE: lambda last_update: last_update.isoformat(),
+}
+
+
+def build_entries(collection_id, sort_key):
+    to_sort_value = SORT_VALUES[sort_key]
+    rows = Product.objects.filter(collection_id=collection_id).values_list(
+        "id", sort_key
+    )
+    return sorted([to_sort_value(value), product_id] for product_id, value in rows)
+
+
+def _lock_collections(*collection_ids):
+    """locks the rows of the collections, in id order: returns the ids found"""
+    return list(
+        Collection.objects.select_for_update()
+        .filter(pk__in=[pk for pk in collection_ids if pk is not None])
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+
+
+def rebuild_index(collection_id, sort_key):
+    with transaction.atomic():
+        _lock_collections(collection_id)
+        entries = build_entries(collection_id, sort_key)
+        CollectionProductIndex.objects.update_or_create(
+            collection_id=collection_id,
+            sort_key=sort_key,
+            defaults={"entries": entries},
+        )
+    return entries
+
+
+def get_ordered_product_ids(collection_id, sort_key):
+    """
+    - returns the product ids of a collection in ascending `sort_key` order,
+    or None when the collection does not exist
+
+    - the index is built lazily the first time a collection is browsed by a key
+    """
+
+    def stored_entries():
+        return (
+            CollectionProductIndex.objects.filter(
+                collection_id=collection_id, sort_key=sort_key
+            )
+            .values_list("entries", flat=True)
+            .first()
+        )
+
+    entries = stored_entries()
+    if entries is None:
+        with transaction.atomic():
+            # a product saved before the lock is read below, one saved after it
+            # waits for the index to be created, and is then added to it
+            if not _lock_collections(collection_id):
+                return None
+            # or built by a concurrent request while waiting for the lock
+            entries = stored_entries()
+            if entries is None:
+                entries = build_entries(collection_id, sort_key)
+                CollectionProductIndex.objects.create(
+                    collection_id=collection_id, sort_key=sort_key, entries=entries
+                )
+
+    return [product_id for _, product_id in entries]
+
+
+def _locked_indexes(collection_id):
+    return CollectionProductIndex.objects.select_for_update().filter(
+        collection_id=collection_id
+    )
+
+
+def _without_products(entries, product_ids):
+    return [entry for entry in entries if entry[1] not in product_ids]
+
+
+def add_product(product: Product, previous_collection_id=None):
+    """re-positions a saved product in the indexes of its (old and new) collection"""
+    with transaction.atomic():
+        _lock_collections(previous_collection_id, product.collection_id)
+        if previous_collection_id not in (None, product.collection_id):
+            remove_product(product.id, previous_collection_id)
+
+        for index in _locked_indexes(product.collection_id):
+            entries = _without_products(index.entries, {product.id})
+            value = getattr(product, index.sort_key)
+            insort(entries, [SORT_VALUES[index.sort_key](value), product.id])
+            index.entries = entries
+            index.save(update_fields=["entries"])
+
+
+def remove_product(product_id, collection_id):
+    remove_products({product_id}, collection_id)
+
+
+def remove_products(product_ids, collection_id):
+    with transaction.atomic():
+        _lock_collections(collection_id)
+        for index in _locked_indexes(collection_id):
+            index.entries = _without_products(index.entries, product_ids)
+            index.save(update_fields=["entries"])
@@ -0,0 +1,188 @@
+"""
+Simulated shoppers for `manage.py load_checkout`: each one repeatedly creates a
+cart, adds items (product popularity skewed, so a few products are hot), reads
+the cart back and checks it out, over HTTP against a running server.
+
+Only the standard library is used here and nothing touches the database, so the
+shoppers can run in forked worker processes.
+"""
+
+import http.client
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+# matched against the body of failed responses (server tracebacks in DEBUG)
+ERROR_PATTERNS = [
+    ("deadlock", ["Deadlock found", "deadlock detected", "(1213,"]),
+    ("lock_timeout", ["Lock wait timeout", "(1205,", "lock timeout"]),
+    ("database_locked", ["database is locked", "database table is locked"]),
+    ("integrity", ["IntegrityError", "UNIQUE constraint failed", "Duplicate entry"]),
+]
+
+
+def classify(status, body):
+    if status is None:
+        return "network"
+    if status in (429, 503):
+        return "rejected"
+    for kind, patterns in ERROR_PATTERNS:
+        if any(pattern in body for pattern in patterns):
+            return kind
+    return "server" if status >= 500 else "client"
+
+
+def popularity_weights(count, skew):
+    """zipf-like: the product of rank r is picked with weight 1 / r ** skew"""
+    return [1 / (rank + 1) ** skew for rank in range(count)]
+
+
+class Session:
+    """one keep-alive connection per thread"""
+
+    def __init__(self, base_url, token, timeout):
+        url = urlsplit(base_url)
+        connection_class = (
+            http.client.HTTPSConnection
+            if url.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.local = threading.local()
+        self.connect = lambda: connection_class(url.netloc, timeout=timeout)
+        self.prefix = url.path.rstrip("/")
+        self.token = token
+
+    def request(self, method, path, body=None):
+        """(status or None, body text, seconds)"""
+        headers = {"Authorization": f"JWT {self.token}", "Accept": "application/json"}
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        started_at = time.perf_counter()
+        try:
+            if getattr(self.local, "connection", None) is None:
+                self.local.connection = self.connect()
+            self.local.connection.request(
+                method, self.prefix + path, body=body, headers=headers
+            )
+            response = self.local.connection.getresponse()
+            text = response.read().decode(errors="replace")
+            status = response.status
+        except (OSError, http.client.HTTPException) as error:
+            self.local.connection = None
+            text, status = repr(error), None
+        return status, text, time.perf_counter() - started_at
+
+
+class Shopper:
+    def __init__(self, session, products, weights, options, seed):
+        self.session = session
+        self.products = products
+        self.weights = weights
+        self.options = options
+        self.random = random.Random(seed)
+        # step -> [seconds of each successful request]
+        self.latencies = {}
+        # (step, error kind) -> count
+        self.errors = {}
+        self.checkouts = []
+        self.lost_increments = 0
+
+    def call(self, step, method, path, body=None, expected=(200, 201)):
+        status, text, seconds = self.session.request(method, path, body)
+        if status in expected:
+            self.latencies.setdefault(step, []).append(seconds)
+            return json.loads(text) if text else None
+        key = (step, classify(status, text))
+        self.errors[key] = self.errors.get(key, 0) + 1
+        return None
+
+    def add_item(self, cart_id, product_id, quantity):
+        body = {"product_id": product_id, "quantity": quantity}
+        added = self.call("add_item", "POST", f"/store/carts/{cart_id}/items/", body)
+        return (product_id, quantity) if added is not None else None
+
+    def checkout(self):
+        cart = self.call("create_cart", "POST", "/store/carts/")
+        if cart is None:
+            return
+        cart_id = cart["id"]
+
+        # hot products are likely picked twice: the second add increments the
+        # quantity of the existing cart item, concurrently with the first one
+        # when CART_CONCURRENCY > 1 (a double click)
+        lines = [
+            (product_id, self.random.randint(1, 3))
+            for product_id in self.random.choices(
+                self.products, self.weights, k=self.options["items_per_cart"]
+            )
+        ]
+        with ThreadPoolExecutor(self.options["cart_concurrency"]) as executor:
+            added = list(
+                executor.map(lambda line: self.add_item(cart_id, *line), lines)
+            )
+        expected = {}
+        for line in filter(None, added):
+            expected[line[0]] = expected.get(line[0], 0) + line[1]
+
+        cart = self.call("read_cart", "GET", f"/store/carts/{cart_id}/")
+        if cart is None or not cart["items"]:
+            return
+        contents = {item["product"]["id"]: item["quantity"] for item in cart["items"]}
+        self.lost_increments += sum(
+            max(quantity - contents.get(product_id, 0), 0)
+            for product_id, quantity in expected.items()
+        )
+
+        order = self.call("checkout", "POST", "/store/orders/", {"cart_id": cart_id})
+        if order is not None:
+            self.checkouts.append(
+                {"order_id": order["id"], "cart_id": cart_id, "contents": contents}
+            )
+
+    def run(self, deadline, checkouts):
+        while time.monotonic() < deadline and len(self.checkouts) < checkouts:
+            self.checkout()
+            if self.options["think_time"]:
+                time.sleep(self.random.uniform(0, 2 * self.options["think_time"]))
+        return self
+
+
+def run_shoppers(base_url, shoppers, products, options, seed):
+    """
+    - runs (token, checkouts) shoppers in threads until `DURATION` seconds pass or
+    they all reached their checkouts; returns their merged results
+
+    - the entry point of each worker process
+    """
+    weights = popularity_weights(len(products), options["skew"])
+    deadline = time.monotonic() + options["duration"]
+    with ThreadPoolExecutor(len(shoppers)) as executor:
+        futures = [
+            executor.submit(
+                Shopper(
+                    Session(base_url, token, options["timeout"]),
+                    products,
+                    weights,
+                    options,
+                    seed + index,
+                ).run,
+                deadline,
+                checkouts,
+            )
+            for index, (token, checkouts) in enumerate(shoppers)
+        ]
+        done = [future.result() for future in futures]
+
+    result = {"latencies": {}, "errors": {}, "checkouts": [], "lost_increments": 0}
+    for shopper in done:
+        for step, latencies in shopper.latencies.items():
+            result["latencies"].setdefault(step, []).extend(latencies)
+        for key, count in shopper.errors.items():
+            result["errors"][key] = result["errors"].get(key, 0) + count
+        result["checkouts"].extend(shopper.checkouts)
+        result["lost_increments"] += shopper.lost_increments
+    return result
@@ -0,0 +1,138 @@
+import random
+import time
+from uuid import uuid4
+
+from django.apps.registry import Apps
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+
+from store.fields import BinaryUUIDField, uuid7
+
+LAYOUTS = {
+    "uuid4_hex": lambda: models.UUIDField(primary_key=True, default=uuid4),
+    "uuid7_binary": lambda: BinaryUUIDField(primary_key=True, default=uuid7),
+}
+
+
+def scratch_models(layout):
+    """a cart / cart item pair keyed like Cart, in a registry of their own"""
+    registry = Apps()
+    meta = {"app_label": "store", "apps": registry}
+    cart = type(
+        f"Benchmark{layout}Cart",
+        (models.Model,),
+        {
+            "__module__": __name__,
+            "id": LAYOUTS[layout](),
+            "created_at": models.DateTimeField(auto_now_add=True),
+            "Meta": type("Meta", (), {**meta, "db_table": f"benchmark_{layout}_cart"}),
+        },
+    )
+    item = type(
+        f"Benchmark{layout}CartItem",
+        (models.Model,),
+        {
+            "__module__": __name__,
+            "cart": models.ForeignKey(cart, on_delete=models.CASCADE),
+            "product_id": models.IntegerField(),
+            "quantity": models.PositiveSmallIntegerField(),
+            "Meta": type(
+                "Meta",
+                (),
+                {
+                    **meta,
+                    "db_table": f"benchmark_{layout}_cartitem",
+                    "unique_together": [["cart", "product_id"]],
+                },
+            ),
+        },
+    )
+    return cart, item
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares inserts, lookups and table sizes of carts keyed by random uuid4 "
+        "hex strings (the former Cart.id) and by time-ordered binary uuid7 ids, in "
+        "scratch tables of the current database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--carts", type=int, default=50000)
+        parser.add_argument("--items-per-cart", type=int, default=3)
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--lookups", type=int, default=5000)
+
+    def table_sizes(self, *tables):
+        """data and index bytes, where the database reports them"""
+        if connection.vendor != "mysql":
+            return None
+        with connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute(f"ANALYZE TABLE {connection.ops.quote_name(table)}")
+                cursor.fetchall()
+            cursor.execute(
+                "SELECT SUM(data_length), SUM(index_length) FROM "
+                "information_schema.tables WHERE table_schema = DATABASE() "
+                f"AND table_name IN ({', '.join(['%s'] * len(tables))})",
+                list(tables),
+            )
+            return cursor.fetchone()
+
+    def run(self, layout, options):
+        cart_model, item_model = scratch_models(layout)
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(cart_model)
+            schema_editor.create_model(item_model)
+
+        try:
+            ids = []
+            start = time.perf_counter()
+            for offset in range(0, options["carts"], options["batch_size"]):
+                count = min(options["batch_size"], options["carts"] - offset)
+                with transaction.atomic():
+                    carts = cart_model.objects.bulk_create(
+                        cart_model() for _ in range(count)
+                    )
+                    item_model.objects.bulk_create(
+                        item_model(cart=cart, product_id=product_id, quantity=1)
+                        for cart in carts
+                        for product_id in range(options["items_per_cart"])
+                    )
+                ids.extend(cart.id for cart in carts)
+            insert_time = time.perf_counter() - start
+
+            lookups = random.choices(ids, k=options["lookups"])
+            start = time.perf_counter()
+            for cart_id in lookups:
+                cart_model.objects.get(pk=cart_id)
+                list(item_model.objects.filter(cart_id=cart_id))
+            lookup_time = time.perf_counter() - start
+
+            sizes = self.table_sizes(
+                cart_model._meta.db_table, item_model._meta.db_table
+            )
+        finally:
+            with connection.schema_editor() as schema_editor:
+                schema_editor.delete_model(item_model)
+                schema_editor.delete_model(cart_model)
+
+        line = (
+            f"{layout:<16}{insert_time:>10.2f}s"
+            f"{lookup_time / len(lookups) * 1e6:>12.0f}us"
+        )
+        if sizes is not None:
+            line += f"{sizes[0] / 2**20:>10.1f}MB{sizes[1] / 2**20:>10.1f}MB"
+        self.stdout.write(line)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{options['carts']} carts, {options['items_per_cart']} items each, "
+            f"{options['lookups']} lookups on {connection.vendor}"
+        )
+        header = f"{'layout':<16}{'insert':>11}{'per lookup':>14}"
+        if connection.vendor == "mysql":
+            header += f"{'data':>12}{'indexes':>12}"
+        self.stdout.write(header)
+        for layout in LAYOUTS:
+            self.run(layout, options)
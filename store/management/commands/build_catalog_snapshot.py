@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the catalog snapshot shared by the workers "
+        "(CATALOG_SNAPSHOT['PATH']), once or every --interval seconds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default=None)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="keep rebuilding the snapshot every INTERVAL seconds",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"] or snapshot.config("PATH")
+        while True:
+            started_at = time.monotonic()
+            version = snapshot.build(path)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Catalog snapshot {version} written to {path} "
+                    f"in {time.monotonic() - started_at:.2f}s"
+                )
+            )
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from store.recommendations import rebuild
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the frequently-bought-together tables from all order items"
+
+    def handle(self, *args, **options):
+        products = rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f"Recommendations built for {products} products")
+        )
@@ -0,0 +1,294 @@
+import json
+import math
+import time
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Count, Sum
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from store import sharding
+from store.loadtest import run_shoppers
+from store.models import Cart, DailyProductSales, Order, OrderItem, Product
+
+SHOPPER_PREFIX = "load-shopper-"
+STEPS = ["create_cart", "add_item", "read_cart", "checkout"]
+
+
+def percentile_ms(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    value = values[min(math.ceil(fraction * len(values)) - 1, len(values) - 1)]
+    return round(value * 1000, 1)
+
+
+class Command(BaseCommand):
+    help = (
+        "Drives the create cart -> add items -> checkout flow with parallel "
+        "simulated shoppers against a running server (sharing this database), then "
+        "reports throughput, latency percentiles, errors and consistency checks"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000")
+        parser.add_argument("--shoppers", type=int, default=20)
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="worker processes, the shoppers are split between them",
+        )
+        parser.add_argument("--duration", type=float, default=30)
+        parser.add_argument(
+            "--checkouts", type=int, default=1000, help="per shopper, at most"
+        )
+        parser.add_argument("--items-per-cart", type=int, default=4)
+        parser.add_argument(
+            "--cart-concurrency",
+            type=int,
+            default=2,
+            help="items of one cart added in parallel",
+        )
+        parser.add_argument("--products", type=int, default=100)
+        parser.add_argument(
+            "--skew", type=float, default=1.2, help="zipf exponent of popularity"
+        )
+        parser.add_argument("--think-time", type=float, default=0)
+        parser.add_argument("--timeout", type=float, default=30)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--json", help="also write the report to this file")
+
+    def shopper_tokens(self, count, seconds):
+        """
+        - access tokens of the shopper accounts (created once, reused by later
+        runs), valid for the whole run
+        """
+        User = get_user_model()
+        tokens = []
+        for index in range(count):
+            user, created = User.objects.get_or_create(
+                username=f"{SHOPPER_PREFIX}{index}",
+                defaults={"email": f"{SHOPPER_PREFIX}{index}@example.com"},
+            )
+            if created:
+                user.set_unusable_password()
+                user.save()
+            token = AccessToken.for_user(user)
+            token.set_exp(lifetime=timedelta(seconds=seconds))
+            tokens.append(str(token))
+        return tokens
+
+    def database_counters(self):
+        """lock waits and deadlocks reported by MySQL, None elsewhere"""
+        if connection.vendor != "mysql":
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SHOW GLOBAL STATUS WHERE Variable_name IN "
+                "('Innodb_row_lock_waits', 'Innodb_row_lock_time')"
+            )
+            counters = {name: int(value) for name, value in cursor.fetchall()}
+            cursor.execute(
+                "SELECT name, count FROM information_schema.innodb_metrics "
+                "WHERE name IN ('lock_deadlocks', 'lock_timeouts')"
+            )
+            counters.update({name: int(value) for name, value in cursor.fetchall()})
+        return counters
+
+    def sales_rollup(self, product_ids):
+        return dict(
+            DailyProductSales.objects.filter(
+                date=timezone.localdate(),
+                payment_status=Order.PAYMENT_STATUS_PENDING,
+                product_id__in=product_ids,
+            )
+            .values("product_id")
+            .annotate(quantity=Sum("quantity"))
+            .values_list("product_id", "quantity")
+        )
+
+    def consistency(self, checkouts, started_at, product_ids, inventory, rollup_before):
+        """what the database holds after the run, against what the shoppers saw"""
+        order_ids = [checkout["order_id"] for checkout in checkouts]
+        run_orders = Order.objects.filter(
+            customer__user__username__startswith=SHOPPER_PREFIX,
+            placed_at__gte=started_at,
+        )
+        lines, ordered = {}, {}
+        for order_id, product_id, quantity in OrderItem.objects.filter(
+            order__in=run_orders
+        ).values_list("order_id", "product_id", "quantity"):
+            lines.setdefault(order_id, {})[product_id] = quantity
+            ordered[product_id] = ordered.get(product_id, 0) + quantity
+
+        rollup_after = self.sales_rollup(product_ids)
+        return {
+            "orders_missing": len(order_ids)
+            - Order.objects.filter(id__in=order_ids).count(),
+            # committed, but the shopper got an error (e.g. from on_commit work)
+            "orders_unacknowledged": run_orders.exclude(id__in=order_ids).count(),
+            "orders_without_items": Order.objects.filter(id__in=order_ids)
+            .annotate(lines=Count("items"))
+            .filter(lines=0)
+            .count(),
+            # the order holds exactly the cart read just before the checkout
+            "orders_not_matching_cart": sum(
+                1
+                for checkout in checkouts
+                if lines.get(checkout["order_id"], {}) != checkout["contents"]
+            ),
+            "checked_out_carts_left": sum(
+                Cart.objects.using(alias)
+                .filter(id__in=[checkout["cart_id"] for checkout in checkouts])
+                .count()
+                for alias in sharding.databases()
+            ),
+            # rollups are maintained incrementally by the order signals
+            "sales_rollup_drift": sum(
+                abs(
+                    rollup_after.get(product_id, 0)
+                    - rollup_before.get(product_id, 0)
+                    - ordered.get(product_id, 0)
+                )
+                for product_id in product_ids
+            ),
+            # checkout does not check stock: products ordered beyond inventory
+            "oversold_products": sum(
+                1
+                for product_id, quantity in ordered.items()
+                if quantity > inventory.get(product_id, 0)
+            ),
+        }
+
+    def handle(self, *args, **options):
+        products = dict(
+            Product.objects.order_by("id").values_list("id", "inventory")[
+                : options["products"]
+            ]
+        )
+        if not products:
+            raise CommandError("There are no products to order, seed the catalog first")
+        product_ids = list(products)
+        tokens = self.shopper_tokens(options["shoppers"], options["duration"] + 600)
+        rollup_before = self.sales_rollup(product_ids)
+        counters_before = self.database_counters()
+        # forked workers must not share the connections of this process
+        connections.close_all()
+
+        shopper_options = {
+            "items_per_cart": options["items_per_cart"],
+            "cart_concurrency": options["cart_concurrency"],
+            "skew": options["skew"],
+            "think_time": options["think_time"],
+            "timeout": options["timeout"],
+            "duration": options["duration"],
+        }
+        processes = max(1, min(options["processes"], len(tokens)))
+        groups = [
+            [(token, options["checkouts"]) for token in tokens[index::processes]]
+            for index in range(processes)
+        ]
+        self.stdout.write(
+            f"{len(tokens)} shoppers in {processes} process(es) against "
+            f"{options['url']} for up to {options['duration']}s"
+        )
+        run_started_at = timezone.now()
+        started_at = time.perf_counter()
+        if processes == 1:
+            results = [
+                run_shoppers(
+                    options["url"],
+                    groups[0],
+                    product_ids,
+                    shopper_options,
+                    options["seed"],
+                )
+            ]
+        else:
+            with ProcessPoolExecutor(processes) as executor:
+                results = list(
+                    executor.map(
+                        run_shoppers,
+                        [options["url"]] * processes,
+                        groups,
+                        [product_ids] * processes,
+                        [shopper_options] * processes,
+                        [options["seed"] + index * 10000 for index in range(processes)],
+                    )
+                )
+        elapsed = time.perf_counter() - started_at
+
+        latencies, errors, checkouts, lost_increments = {}, {}, [], 0
+        for result in results:
+            for step, values in result["latencies"].items():
+                latencies.setdefault(step, []).extend(values)
+            for (step, kind), count in result["errors"].items():
+                errors.setdefault(step, {})
+                errors[step][kind] = errors[step].get(kind, 0) + count
+            checkouts.extend(result["checkouts"])
+            lost_increments += result["lost_increments"]
+
+        counters_after = self.database_counters()
+        report = {
+            "database": connection.vendor,
+            "seconds": round(elapsed, 2),
+            "checkouts": len(checkouts),
+            "checkouts_per_second": round(len(checkouts) / elapsed, 2),
+            "steps": {
+                step: {
+                    "ok": len(latencies.get(step, [])),
+                    "errors": errors.get(step, {}),
+                    **{
+                        f"p{int(fraction * 100)}_ms": percentile_ms(
+                            latencies.get(step), fraction
+                        )
+                        for fraction in (0.5, 0.9, 0.99, 1.0)
+                    },
+                }
+                for step in STEPS
+            },
+            "lost_increments": lost_increments,
+            "consistency": self.consistency(
+                checkouts, run_started_at, product_ids, products, rollup_before
+            ),
+        }
+        if counters_before is not None:
+            report["database_counters"] = {
+                name: counters_after[name] - counters_before.get(name, 0)
+                for name in counters_after
+            }
+        self.write_report(report)
+        if options["json"]:
+            with open(options["json"], "w") as file:
+                json.dump(report, file, indent=2)
+
+    def write_report(self, report):
+        self.stdout.write(
+            f"\n{report['checkouts']} checkouts in {report['seconds']}s on "
+            f"{report['database']}: {report['checkouts_per_second']}/s\n"
+        )
+        self.stdout.write(
+            f"{'step':<12}{'ok':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"
+            f"{'max ms':>10}  errors"
+        )
+        for step, stats in report["steps"].items():
+            cells = [stats[f"p{p}_ms"] for p in (50, 90, 99, 100)]
+            errors = ", ".join(f"{kind}: {n}" for kind, n in stats["errors"].items())
+            self.stdout.write(
+                f"{step:<12}{stats['ok']:>8}"
+                + "".join(f"{'-' if c is None else c:>10}" for c in cells)
+                + f"  {errors or '-'}"
+            )
+
+        self.stdout.write(f"\nlost cart item increments: {report['lost_increments']}")
+        for name, value in report.get("database_counters", {}).items():
+            self.stdout.write(f"{name}: {value}")
+        self.stdout.write("\nconsistency")
+        for name, value in report["consistency"].items():
+            style = self.style.SUCCESS if not value else self.style.WARNING
+            self.stdout.write(style(f"  {name}: {value}"))
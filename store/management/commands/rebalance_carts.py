@@ -0,0 +1,117 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Case, Value, When
+
+from store import sharding
+from store.models import Cart, CartItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves the carts that are not in the database they hash to (store.sharding), "
+        "e.g. after a cart database was added to CART_SHARDS. Until a cart is "
+        "moved it is not found by the api; moved cart items get new ids"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from",
+            dest="sources",
+            action="append",
+            default=[],
+            help="also empty this database, e.g. one removed from CART_SHARDS",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def misplaced(self, source, batch_size):
+        """batches of (target, [cart ids]) not belonging to `source`"""
+        last_id = None
+        while True:
+            carts = Cart.objects.using(source).order_by("id")
+            if last_id is not None:
+                carts = carts.filter(id__gt=last_id)
+            cart_ids = list(carts.values_list("id", flat=True)[:batch_size])
+            if not cart_ids:
+                return
+            last_id = cart_ids[-1]
+            targets = {}
+            for cart_id in cart_ids:
+                target = sharding.shard_for(cart_id)
+                if target != source:
+                    targets.setdefault(target, []).append(cart_id)
+            yield from targets.items()
+
+    def move(self, cart_ids, source, target):
+        """
+        - copies the carts and their items to `target`, then deletes them
+
+        - the target commits first: a cart already there was copied by a run
+        whose source delete failed, and may have been changed through the api
+        since, so it is kept and only the source copy is deleted
+        """
+        with transaction.atomic(using=source), transaction.atomic(using=target):
+            carts = list(
+                Cart.objects.using(source).select_for_update().filter(id__in=cart_ids)
+            )
+            if not carts:
+                return 0, 0
+            cart_ids = [cart.id for cart in carts]
+            copied = set(
+                Cart.objects.using(target)
+                .filter(id__in=cart_ids)
+                .values_list("id", flat=True)
+            )
+            carts = [cart for cart in carts if cart.id not in copied]
+            copy_ids = [cart.id for cart in carts]
+            items = list(CartItem.objects.using(source).filter(cart_id__in=copy_ids))
+
+            if carts:
+                Cart.objects.using(target).bulk_create(carts)
+                # bulk_create sets auto_now_add fields to now
+                Cart.objects.using(target).filter(id__in=copy_ids).update(
+                    created_at=Case(
+                        *[
+                            When(id=cart.id, then=Value(cart.created_at))
+                            for cart in carts
+                        ]
+                    )
+                )
+            for item in items:
+                # item ids are only unique within a database
+                item.pk = None
+            CartItem.objects.using(target).bulk_create(items)
+
+            Cart.objects.using(source).filter(id__in=cart_ids).delete()
+        return len(cart_ids), len(items)
+
+    def handle(self, *args, **options):
+        shards = sharding.databases()
+        sources = list(dict.fromkeys([*shards, DEFAULT_DB_ALIAS, *options["sources"]]))
+        for alias in sources:
+            if alias not in settings.DATABASES:
+                raise CommandError(f"Unknown database: {alias}")
+
+        moved = {}
+        for source in sources:
+            for target, cart_ids in self.misplaced(source, options["batch_size"]):
+                counts = moved.setdefault((source, target), [0, 0])
+                if options["dry_run"]:
+                    counts[0] += len(cart_ids)
+                    continue
+                carts, items = self.move(cart_ids, source, target)
+                counts[0] += carts
+                counts[1] += items
+
+        if not moved:
+            self.stdout.write(self.style.SUCCESS("Every cart is in its database"))
+        for (source, target), (carts, items) in moved.items():
+            if options["dry_run"]:
+                self.stdout.write(f"{carts} carts to move from {source} to {target}")
+            else:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Moved {carts} carts ({items} items) from {source} to {target}"
+                    )
+                )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from store.indexes import rebuild_index
+from store.models import Collection, CollectionProductIndex
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the precomputed sorted product indexes of every collection"
+
+    def handle(self, *args, **options):
+        sort_keys = [key for key, _ in CollectionProductIndex.SORT_CHOICES]
+        for collection_id in Collection.objects.values_list("id", flat=True):
+            for sort_key in sort_keys:
+                rebuild_index(collection_id, sort_key)
+        self.stdout.write(self.style.SUCCESS("Collection indexes rebuilt"))
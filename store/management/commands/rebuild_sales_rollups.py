@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from store.models import Order
+from store.rollups import rebuild_chunk
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the daily sales rollups from the order items, in parallel "
+        "chunks of days"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--start", help="first day (YYYY-MM-DD), default: first order"
+        )
+        parser.add_argument("--end", help="last day (YYYY-MM-DD), default: last order")
+        parser.add_argument("--chunk-days", type=int, default=7)
+        parser.add_argument("--workers", type=int, default=4)
+
+    def parse(self, value, default):
+        if value is None:
+            return default
+        date = parse_date(value)
+        if date is None:
+            raise CommandError(f"Invalid date: {value}")
+        return date
+
+    def run_chunk(self, start, end):
+        try:
+            rebuild_chunk(start, end)
+        finally:
+            # every worker thread opens its own connection
+            connection.close()
+        return start, end
+
+    def handle(self, *args, **options):
+        bounds = Order.objects.aggregate(first=Min("placed_at"), last=Max("placed_at"))
+        if bounds["first"] is None:
+            self.stdout.write("No orders to roll up")
+            return
+
+        start = self.parse(options["start"], timezone.localdate(bounds["first"]))
+        end = self.parse(options["end"], timezone.localdate(bounds["last"]))
+        step = timedelta(days=options["chunk_days"])
+
+        chunks = []
+        while start <= end:
+            chunks.append((start, min(start + step - timedelta(days=1), end)))
+            start += step
+
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            for chunk_start, chunk_end in executor.map(
+                lambda chunk: self.run_chunk(*chunk), chunks
+            ):
+                self.stdout.write(f"Rolled up {chunk_start} .. {chunk_end}")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Sales rollups rebuilt ({len(chunks)} chunks)")
+        )
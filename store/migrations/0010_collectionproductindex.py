@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0009_alter_productimage_image"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CollectionProductIndex",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "sort_key",
+                    models.CharField(
+                        choices=[
+                            ("title", "Title"),
+                            ("unit_price", "Unit price"),
+                            ("last_update", "Last update"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("entries", models.JSONField(default=list)),
+                (
+                    "collection",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="product_indexes",
+                        to="store.collection",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("collection", "sort_key")},
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:02
+
+import store.storage
+import store.validators
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_existing_references(apps, schema_editor):
+    ProductImage = apps.get_model("store", "ProductImage")
+    ImageBlob = apps.get_model("store", "ImageBlob")
+    ImageBlob.objects.bulk_create(
+        ImageBlob(name=row["image"], references=row["references"])
+        for row in ProductImage.objects.exclude(image="")
+        .values("image")
+        .annotate(references=Count("id"))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0013_orderstatusevent"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImageBlob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("references", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="productimage",
+            name="image",
+            field=models.ImageField(
+                storage=store.storage.ContentAddressedStorage(),
+                upload_to="store/images",
+                validators=[store.validators.validate_file_size],
+            ),
+        ),
+        migrations.RunPython(count_existing_references, migrations.RunPython.noop),
+    ]
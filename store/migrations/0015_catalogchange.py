@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:04
+
+from django.db import migrations, models
+
+
+def log_existing_catalog(apps, schema_editor):
+    """starts the change log with the whole catalog, for the first sync"""
+    CatalogChange = apps.get_model("store", "CatalogChange")
+    for kind, queryset in [
+        ("C", apps.get_model("store", "Collection").objects.order_by("id")),
+        ("P", apps.get_model("store", "Product").objects.order_by("last_update")),
+        ("I", apps.get_model("store", "ProductImage").objects.order_by("id")),
+    ]:
+        CatalogChange.objects.bulk_create(
+            (
+                CatalogChange(kind=kind, object_id=object_id)
+                for object_id in queryset.values_list("id", flat=True).iterator()
+            ),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0014_content_addressed_images"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CatalogChange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("C", "Collection"),
+                            ("P", "Product"),
+                            ("I", "Product image"),
+                        ],
+                        max_length=1,
+                    ),
+                ),
+                ("object_id", models.PositiveBigIntegerField()),
+                ("deleted", models.BooleanField(default=False)),
+                ("changed_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["kind", "object_id"], name="store_catal_kind_4de315_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(log_existing_catalog, migrations.RunPython.noop),
+    ]
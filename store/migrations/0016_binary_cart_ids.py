@@ -0,0 +1,198 @@
+import uuid
+
+from django.db import migrations
+from django.db.utils import NotSupportedError
+
+import store.fields
+
+CHUNK_SIZE = 1000
+
+
+def _fill_in_chunks(cursor, quote, table, column, value):
+    """sets `column` to the sql expression `value`, one primary key range at a time"""
+    last = None
+    while True:
+        cursor.execute(
+            f"SELECT id FROM {quote(table)}"
+            + (" WHERE id > %s" if last is not None else "")
+            + f" ORDER BY id LIMIT 1 OFFSET {CHUNK_SIZE - 1}",
+            [last] if last is not None else [],
+        )
+        row = cursor.fetchone()
+        bounds, params = [], []
+        if last is not None:
+            bounds.append("id > %s")
+            params.append(last)
+        if row is not None:
+            bounds.append("id <= %s")
+            params.append(row[0])
+        cursor.execute(
+            f"UPDATE {quote(table)} SET {quote(column)} = {value}"
+            + (" WHERE " + " AND ".join(bounds) if bounds else ""),
+            params,
+        )
+        if row is None:
+            return
+        last = row[0]
+
+
+def _convert_mysql(schema_editor, column_type, convert, prefix):
+    """
+    - copies the ids, converted by the sql function `convert`, into new
+    `column_type` columns in chunks while the tables stay writable, then swaps
+    the columns with the tables locked, after converting the rows written in the
+    meantime
+    """
+    quote = schema_editor.quote_name
+    connection = schema_editor.connection
+    cart_column, item_column = f"{prefix}_id", f"cart_{prefix}_id"
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, "store_cartitem")
+        foreign_key = next(
+            name
+            for name, constraint in constraints.items()
+            if constraint["foreign_key"] and constraint["columns"] == ["cart_id"]
+        )
+        unique = next(
+            name
+            for name, constraint in constraints.items()
+            if constraint["unique"]
+            and not constraint["primary_key"]
+            and sorted(constraint["columns"]) == ["cart_id", "product_id"]
+        )
+
+        cursor.execute(
+            f"ALTER TABLE store_cart ADD COLUMN {cart_column} {column_type} NULL"
+        )
+        cursor.execute(
+            f"ALTER TABLE store_cartitem ADD COLUMN {item_column} {column_type} NULL"
+        )
+        _fill_in_chunks(cursor, quote, "store_cart", cart_column, convert % "id")
+        _fill_in_chunks(
+            cursor, quote, "store_cartitem", item_column, convert % "cart_id"
+        )
+
+        # the foreign key checks of the cart items read store_product, where the
+        # database has it
+        tables = ["store_cart WRITE", "store_cartitem WRITE"]
+        if "store_product" in connection.introspection.table_names(cursor):
+            tables.append("store_product READ")
+        cursor.execute(f"LOCK TABLES {', '.join(tables)}")
+        try:
+            cursor.execute(
+                f"UPDATE store_cart SET {cart_column} = {convert % 'id'} "
+                f"WHERE {cart_column} IS NULL"
+            )
+            cursor.execute(
+                f"UPDATE store_cartitem SET {item_column} = {convert % 'cart_id'} "
+                f"WHERE {item_column} IS NULL"
+            )
+            cursor.execute(
+                f"ALTER TABLE store_cartitem DROP FOREIGN KEY {quote(foreign_key)}"
+            )
+            cursor.execute(f"ALTER TABLE store_cartitem DROP INDEX {quote(unique)}")
+            cursor.execute(
+                "ALTER TABLE store_cart DROP PRIMARY KEY, DROP COLUMN id, "
+                f"CHANGE {cart_column} id {column_type} NOT NULL, ADD PRIMARY KEY (id)"
+            )
+            cursor.execute(
+                "ALTER TABLE store_cartitem DROP COLUMN cart_id, "
+                f"CHANGE {item_column} cart_id {column_type} NOT NULL, "
+                f"ADD CONSTRAINT {quote(unique)} UNIQUE (cart_id, product_id), "
+                f"ADD CONSTRAINT {quote(foreign_key)} FOREIGN KEY (cart_id) "
+                "REFERENCES store_cart (id)"
+            )
+        finally:
+            cursor.execute("UNLOCK TABLES")
+
+
+def _convert_sqlite(apps, schema_editor):
+    Cart = apps.get_model("store", "Cart")
+    old_field = Cart._meta.get_field("id")
+    new_field = store.fields.BinaryUUIDField(
+        default=store.fields.uuid7, editable=False, primary_key=True, serialize=False
+    )
+    new_field.set_attributes_from_name("id")
+    new_field.model = Cart
+    # rebuilds store_cart and store_cartitem, keeping the hex values
+    schema_editor.alter_field(Cart, old_field, new_field)
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT id FROM store_cart")
+        for (hex_id,) in cursor.fetchall():
+            binary_id = uuid.UUID(hex_id).bytes
+            cursor.execute(
+                "UPDATE store_cart SET id = %s WHERE id = %s", [binary_id, hex_id]
+            )
+            cursor.execute(
+                "UPDATE store_cartitem SET cart_id = %s WHERE cart_id = %s",
+                [binary_id, hex_id],
+            )
+
+
+def _revert_sqlite(apps, schema_editor):
+    Cart = apps.get_model("store", "Cart")
+    old_field = store.fields.BinaryUUIDField(
+        default=store.fields.uuid7, editable=False, primary_key=True, serialize=False
+    )
+    old_field.set_attributes_from_name("id")
+    old_field.model = Cart
+    # rebuilds store_cart and store_cartitem, keeping the 16 byte values
+    schema_editor.alter_field(Cart, old_field, Cart._meta.get_field("id"))
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("UPDATE store_cart SET id = lower(hex(id))")
+        cursor.execute("UPDATE store_cartitem SET cart_id = lower(hex(cart_id))")
+
+
+def convert_cart_ids(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "mysql":
+        _convert_mysql(schema_editor, "binary(16)", "UNHEX(%s)", "binary")
+    elif vendor == "sqlite":
+        _convert_sqlite(apps, schema_editor)
+    elif not schema_editor.connection.features.has_native_uuid_field:
+        raise NotSupportedError(f"Converting cart ids is not supported on {vendor}")
+    # databases with a native uuid type already store 16 bytes
+
+
+def revert_cart_ids(apps, schema_editor):
+    """back to the 32 hex characters of UUIDField"""
+    vendor = schema_editor.connection.vendor
+    if vendor == "mysql":
+        _convert_mysql(schema_editor, "char(32)", "LOWER(HEX(%s))", "hex")
+    elif vendor == "sqlite":
+        _revert_sqlite(apps, schema_editor)
+    elif not schema_editor.connection.features.has_native_uuid_field:
+        raise NotSupportedError(f"Reverting cart ids is not supported on {vendor}")
+
+
+class Migration(migrations.Migration):
+    # the mysql conversion commits chunk by chunk
+    atomic = False
+
+    dependencies = [
+        ("store", "0015_catalogchange"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                # not run on the cart databases (store.sharding): their tables
+                # are created with binary ids by store.0019
+                migrations.RunPython(convert_cart_ids, revert_cart_ids, elidable=False),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name="cart",
+                    name="id",
+                    field=store.fields.BinaryUUIDField(
+                        default=store.fields.uuid7,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+            ],
+        ),
+    ]
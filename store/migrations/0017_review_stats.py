@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:14
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def count_existing_reviews(apps, schema_editor):
+    Product = apps.get_model("store", "Product")
+    Review = apps.get_model("store", "Review")
+    stats = (
+        Review.objects.order_by()
+        .values("product_id")
+        .annotate(count=Count("id"), latest=Max("date"))
+    )
+    for row in stats.iterator():
+        Product.objects.filter(id=row["product_id"]).update(
+            reviews_count=row["count"], last_review_at=row["latest"]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0016_binary_cart_ids"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="last_review_at",
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="reviews_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["product", "date"], name="store_revie_product_a44095_idx"
+            ),
+        ),
+        migrations.RunPython(count_existing_reviews, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:29
+
+import django.db.models.deletion
+import store.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0017_review_stats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="cart_id",
+            field=store.fields.BinaryUUIDField(editable=False, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="cartitem",
+            name="product",
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                to="store.product",
+            ),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import DEFAULT_DB_ALIAS, migrations
+
+
+def create_cart_tables(apps, schema_editor):
+    """
+    - the cart tables of a cart database (store.sharding), in their current form:
+    the earlier migrations only run on the default database, their history has a
+    foreign key to store_product, which cart databases do not have
+
+    - cart databases migrated before this one already have the tables
+    """
+    connection = schema_editor.connection
+    if connection.alias == DEFAULT_DB_ALIAS:
+        return
+    with connection.cursor() as cursor:
+        tables = connection.introspection.table_names(cursor)
+    for name in ("Cart", "CartItem"):
+        model = apps.get_model("store", name)
+        if model._meta.db_table not in tables:
+            schema_editor.create_model(model)
+
+
+def drop_cart_tables(apps, schema_editor):
+    if schema_editor.connection.alias == DEFAULT_DB_ALIAS:
+        return
+    for name in ("CartItem", "Cart"):
+        schema_editor.delete_model(apps.get_model("store", name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0018_cart_shards"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            create_cart_tables, drop_cart_tables, hints={"cart_databases": True}
+        ),
+    ]
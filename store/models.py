@@ -1,9 +1,11 @@
-from uuid import uuid4
 from django.contrib import admin
 from django.conf import settings
 from django.db import models
 from django.core.validators import MinValueValidator
 from django.db.models import CharField
+from store.fields import BinaryUUIDField, uuid7
+from store.sharding import CartShardQuerySet
+from store.storage import image_storage
 from store.validators import validate_file_size
 
 
@@ -41,6 +43,9 @@ class Product(models.Model):
         Collection, related_name="products", on_delete=models.PROTECT
     )
     promotions = models.ManyToManyField(Promotion, related_name="products", blank=True)
+    # maintained by the Review signals (store.reviewstats)
+    reviews_count = models.PositiveIntegerField(default=0, editable=False)
+    last_review_at = models.DateField(null=True, blank=True, editable=False)
 
     def __str__(self) -> CharField:
         return self.title
@@ -49,6 +54,34 @@ class Product(models.Model):
         ordering = ["title"]
 
 
+class CollectionProductIndex(models.Model):
+    """
+    - precomputed product ids of a collection, kept ordered by one sort key
+
+    - entries are stored as [sort_value, product_id] pairs so that a product can be
+    re-positioned incrementally when it is saved, instead of re-sorting the collection
+    """
+
+    SORT_TITLE = "title"
+    SORT_UNIT_PRICE = "unit_price"
+    SORT_LAST_UPDATE = "last_update"
+
+    SORT_CHOICES = [
+        (SORT_TITLE, "Title"),
+        (SORT_UNIT_PRICE, "Unit price"),
+        (SORT_LAST_UPDATE, "Last update"),
+    ]
+
+    collection = models.ForeignKey(
+        Collection, on_delete=models.CASCADE, related_name="product_indexes"
+    )
+    sort_key = models.CharField(max_length=20, choices=SORT_CHOICES)
+    entries = models.JSONField(default=list)
+
+    class Meta:
+        unique_together = [["collection", "sort_key"]]
+
+
 class Review(models.Model):
     product = models.ForeignKey(
         Product, on_delete=models.CASCADE, related_name="reviews"
@@ -57,6 +90,9 @@ class Review(models.Model):
     description = models.TextField()
     date = models.DateField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["product", "date"])]
+
 
 """Assuming a product can have multiple images"""
 
@@ -65,7 +101,49 @@ class ProductImage(models.Model):
     product = models.ForeignKey(
         Product, on_delete=models.CASCADE, related_name="images"
     )
-    image = models.ImageField(upload_to="store/images", validators=[validate_file_size])
+    image = models.ImageField(
+        upload_to="store/images",
+        storage=image_storage,
+        validators=[validate_file_size],
+    )
+
+
+class ImageBlob(models.Model):
+    """
+    - one row per stored image file, counting the ProductImage rows that use it
+    (see store.blobs)
+    """
+
+    name = models.CharField(max_length=255, unique=True)
+    references = models.PositiveIntegerField(default=0)
+
+
+class CatalogChange(models.Model):
+    """
+    - change log of the catalog, read by the delta sync endpoint: the id is the
+    sync position, and an object only keeps the row of its latest change (older
+    rows are deleted), so a delta lists each changed object once
+
+    - `deleted` rows are tombstones
+    """
+
+    KIND_COLLECTION = "C"
+    KIND_PRODUCT = "P"
+    KIND_IMAGE = "I"
+
+    KIND_CHOICES = [
+        (KIND_COLLECTION, "Collection"),
+        (KIND_PRODUCT, "Product"),
+        (KIND_IMAGE, "Product image"),
+    ]
+
+    kind = models.CharField(max_length=1, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["kind", "object_id"])]
 
 
 class Customer(models.Model):
@@ -120,12 +198,36 @@ class Order(models.Model):
     customer = models.ForeignKey(
         Customer, on_delete=models.PROTECT, related_name="orders"
     )
+    # the checked out cart, in its own database (store.sharding): a checkout
+    # retried after the order committed but the cart was not deleted finds it
+    cart_id = BinaryUUIDField(null=True, unique=True, editable=False)
     # items
 
     class Meta:
         permissions = [("cancel_order", "Can Cancel Order")]
 
 
+class OrderStatusEvent(models.Model):
+    """
+    - one row per payment status change of an order, written in the same
+    transaction as the change; the auto-increment id is the feed position that
+    clients resume from, once the event is settled (see store.events)
+    """
+
+    order = models.ForeignKey(
+        Order, on_delete=models.CASCADE, related_name="status_events"
+    )
+    # denormalized from the order, so a customer's feed is read without a join
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="+")
+    payment_status = models.CharField(
+        max_length=1, choices=Order.PAYMENT_STATUS_CHOICES
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["customer", "id"])]
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name="items", on_delete=models.PROTECT)
     product = models.ForeignKey(Product, on_delete=models.PROTECT)
@@ -133,6 +235,65 @@ class OrderItem(models.Model):
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
 
 
+class ProductCoOccurrence(models.Model):
+    """number of orders in which `product` was bought together with `other`"""
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [["product", "other"]]
+
+
+class ProductRecommendation(models.Model):
+    """top-K "frequently bought together" products, precomputed per product"""
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="recommendations"
+    )
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    score = models.PositiveIntegerField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ["rank"]
+        unique_together = [["product", "rank"]]
+
+
+class DailyProductSales(models.Model):
+    """sales rollup by day x product x payment status, maintained incrementally"""
+
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    payment_status = models.CharField(
+        max_length=1, choices=Order.PAYMENT_STATUS_CHOICES
+    )
+    orders = models.IntegerField(default=0)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [["date", "product", "payment_status"]]
+
+
+class DailyCollectionSales(models.Model):
+    """sales rollup by day x collection x payment status, maintained incrementally"""
+
+    date = models.DateField()
+    collection = models.ForeignKey(
+        Collection, on_delete=models.CASCADE, related_name="+"
+    )
+    payment_status = models.CharField(
+        max_length=1, choices=Order.PAYMENT_STATUS_CHOICES
+    )
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [["date", "collection", "payment_status"]]
+
+
 class Address(models.Model):
     street = models.CharField(max_length=255)
     city = models.CharField(max_length=255)
@@ -142,10 +303,14 @@ class Address(models.Model):
 
 
 class Cart(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid4)
+    # time-ordered and 16 bytes wide: new carts append to the primary key and
+    # cart item indexes, see store.fields
+    id = BinaryUUIDField(primary_key=True, default=uuid7, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     # items
 
+    objects = CartShardQuerySet.as_manager()
+
 
 class CartItem(models.Model):
     """
@@ -155,8 +320,14 @@ class CartItem(models.Model):
     """
 
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="items")
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # products are in the default database, carts maybe not (store.sharding):
+    # no constraint, cart items of a deleted product are removed by store.signals
+    product = models.ForeignKey(
+        Product, on_delete=models.DO_NOTHING, db_constraint=False
+    )
     quantity = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)])
 
+    objects = CartShardQuerySet.as_manager()
+
     class Meta:
         unique_together = [["cart", "product"]]
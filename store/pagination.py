@@ -1,5 +1,12 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class DefaultPagination(PageNumberPagination):
     page_size = 10
+
+
+class ReviewPagination(CursorPagination):
+    """newest first; the cursor stays stable while reviews are being added"""
+
+    page_size = 10
+    ordering = ("-date", "-id")
@@ -0,0 +1,122 @@
+from collections import Counter, defaultdict
+from itertools import combinations, groupby, permutations
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from store.models import OrderItem, ProductCoOccurrence, ProductRecommendation
+
+TOP_K = 10
+BATCH_SIZE = 1000
+
+
+def count_co_occurrences():
+    """
+    - one pass over the order items, ordered by order: a sparse
+    {product: Counter({other: orders})} matrix of the pairs that actually occur
+
+    - each order counts once per pair, whatever the quantities
+    """
+    counts = defaultdict(Counter)
+    rows = (
+        OrderItem.objects.order_by("order_id")
+        .values_list("order_id", "product_id")
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+    for _, items in groupby(rows, key=lambda row: row[0]):
+        product_ids = sorted({product_id for _, product_id in items})
+        for product_id, other_id in combinations(product_ids, 2):
+            counts[product_id][other_id] += 1
+            counts[other_id][product_id] += 1
+    return counts
+
+
+def top_k(others: Counter):
+    # ties are broken by product id, so that rebuilds are deterministic
+    return sorted(others.items(), key=lambda item: (-item[1], item[0]))[:TOP_K]
+
+
+def recommendation_rows(product_id, top):
+    return [
+        ProductRecommendation(
+            product_id=product_id, recommended_id=other_id, score=score, rank=rank
+        )
+        for rank, (other_id, score) in enumerate(top, start=1)
+    ]
+
+
+def rebuild():
+    counts = count_co_occurrences()
+    with transaction.atomic():
+        ProductCoOccurrence.objects.all().delete()
+        ProductRecommendation.objects.all().delete()
+
+        ProductCoOccurrence.objects.bulk_create(
+            (
+                ProductCoOccurrence(product_id=product_id, other_id=other_id, orders=n)
+                for product_id, others in counts.items()
+                for other_id, n in others.items()
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        ProductRecommendation.objects.bulk_create(
+            (
+                row
+                for product_id, others in counts.items()
+                for row in recommendation_rows(product_id, top_k(others))
+            ),
+            batch_size=BATCH_SIZE,
+        )
+    return len(counts)
+
+
+def _increment_pairs(product_ids):
+    """adds one order to every pair of `product_ids`, creating the missing rows"""
+    pending = set(permutations(product_ids, 2))
+    while pending:
+        # a locking read: it sees the rows other transactions committed since
+        rows = {
+            (product_id, other_id): pk
+            for pk, product_id, other_id in ProductCoOccurrence.objects.filter(
+                product_id__in=product_ids, other_id__in=product_ids
+            )
+            .select_for_update()
+            .values_list("id", "product_id", "other_id")
+        }
+        ProductCoOccurrence.objects.filter(
+            id__in=[rows[pair] for pair in pending if pair in rows]
+        ).update(orders=F("orders") + 1)
+        pending -= set(rows)
+        try:
+            with transaction.atomic():
+                ProductCoOccurrence.objects.bulk_create(
+                    ProductCoOccurrence(
+                        product_id=product_id, other_id=other_id, orders=1
+                    )
+                    for product_id, other_id in pending
+                )
+            return
+        except IntegrityError:
+            # some were created concurrently: incremented on the next pass
+            continue
+
+
+def record_order(product_ids):
+    """adds the pairs of a newly placed order and refreshes the affected top-K lists"""
+    product_ids = set(product_ids)
+    if len(product_ids) < 2:
+        return
+
+    with transaction.atomic():
+        _increment_pairs(product_ids)
+
+        for product_id in product_ids:
+            top = ProductCoOccurrence.objects.filter(product_id=product_id).order_by(
+                "-orders", "other_id"
+            )[:TOP_K]
+            ProductRecommendation.objects.filter(product_id=product_id).delete()
+            ProductRecommendation.objects.bulk_create(
+                recommendation_rows(
+                    product_id, [(pair.other_id, pair.orders) for pair in top]
+                )
+            )
@@ -0,0 +1,45 @@
+"""
+Review count and latest review date of each product, kept on the product row so
+product listings show them without aggregating the reviews.
+"""
+
+from django.db.models import Count, F, Max, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from store import changelog
+from store.models import Product, Review
+
+
+def review_added(product_id, date):
+    Product.objects.filter(id=product_id).update(
+        reviews_count=F("reviews_count") + 1,
+        # GREATEST is null as soon as one argument is, on MySQL and SQLite
+        last_review_at=Greatest(Coalesce("last_review_at", Value(date)), Value(date)),
+    )
+    changelog.record(Product, [product_id])
+
+
+def review_removed(product_id):
+    updated = Product.objects.filter(id=product_id, reviews_count__gt=0).update(
+        reviews_count=F("reviews_count") - 1,
+        # served by the (product, date) index
+        last_review_at=Review.objects.filter(product_id=product_id)
+        .values("product_id")
+        .annotate(latest=Max("date"))
+        .values("latest"),
+    )
+    if updated:
+        changelog.record(Product, [product_id])
+
+
+def recount(product_ids=None):
+    """recomputes the stats from the reviews, e.g. after bulk changes"""
+    queryset = Product.objects.all()
+    if product_ids is not None:
+        queryset = queryset.filter(id__in=product_ids)
+    for product in queryset.annotate(
+        count=Count("reviews"), latest=Max("reviews__date")
+    ).values("id", "count", "latest"):
+        Product.objects.filter(id=product["id"]).update(
+            reviews_count=product["count"], last_review_at=product["latest"]
+        )
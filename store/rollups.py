@@ -0,0 +1,133 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from store.models import DailyCollectionSales, DailyProductSales, Order, OrderItem
+
+
+def _increment(model, lookup, **amounts):
+    """adds `amounts` to the rollup row identified by `lookup`, creating it if needed"""
+    updates = {name: F(name) + value for name, value in amounts.items()}
+    if model.objects.filter(**lookup).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **amounts)
+    except IntegrityError:
+        # created concurrently
+        model.objects.filter(**lookup).update(**updates)
+
+
+def _apply(date, payment_status, lines, sign):
+    """
+    - lines: (product_id, collection_id, quantity, unit_price) of one order
+
+    - sign: 1 to add the order to the rollups of `payment_status`, -1 to remove it
+    """
+    products = defaultdict(lambda: [0, Decimal(0)])
+    collections = defaultdict(lambda: [0, Decimal(0)])
+    for product_id, collection_id, quantity, unit_price in lines:
+        for totals in (products[product_id], collections[collection_id]):
+            totals[0] += quantity
+            totals[1] += quantity * Decimal(unit_price)
+
+    with transaction.atomic():
+        for product_id, (quantity, revenue) in products.items():
+            _increment(
+                DailyProductSales,
+                {
+                    "date": date,
+                    "product_id": product_id,
+                    "payment_status": payment_status,
+                },
+                orders=sign,
+                quantity=sign * quantity,
+                revenue=sign * revenue,
+            )
+        for collection_id, (quantity, revenue) in collections.items():
+            _increment(
+                DailyCollectionSales,
+                {
+                    "date": date,
+                    "collection_id": collection_id,
+                    "payment_status": payment_status,
+                },
+                quantity=sign * quantity,
+                revenue=sign * revenue,
+            )
+
+
+def order_lines(items):
+    """the lines of an order, from its OrderItem instances with products loaded"""
+    return [
+        (item.product_id, item.product.collection_id, item.quantity, item.unit_price)
+        for item in items
+    ]
+
+
+def record_lines(date, payment_status, lines):
+    """adds a newly created order, from its `order_lines`"""
+    _apply(date, payment_status, lines, 1)
+
+
+def move_order(order: Order, previous_status, payment_status):
+    """moves an order from the rollups of its previous payment status to the new one"""
+    lines = list(
+        OrderItem.objects.filter(order_id=order.id).values_list(
+            "product_id", "product__collection_id", "quantity", "unit_price"
+        )
+    )
+    date = timezone.localdate(order.placed_at)
+    with transaction.atomic():
+        _apply(date, previous_status, lines, -1)
+        _apply(date, payment_status, lines, 1)
+
+
+def rebuild_chunk(start, end):
+    """recomputes the rollups of the orders placed between `start` and `end` (dates)"""
+    items = OrderItem.objects.filter(
+        order__placed_at__date__gte=start, order__placed_at__date__lte=end
+    ).annotate(
+        date=TruncDate("order__placed_at"),
+        payment_status=F("order__payment_status"),
+    )
+    totals = {
+        "total_quantity": Sum("quantity"),
+        "total_revenue": Sum(
+            F("quantity") * F("unit_price"), output_field=DecimalField()
+        ),
+    }
+
+    with transaction.atomic():
+        DailyProductSales.objects.filter(date__gte=start, date__lte=end).delete()
+        DailyCollectionSales.objects.filter(date__gte=start, date__lte=end).delete()
+
+        DailyProductSales.objects.bulk_create(
+            DailyProductSales(
+                date=row["date"],
+                product_id=row["product_id"],
+                payment_status=row["payment_status"],
+                orders=row["total_orders"],
+                quantity=row["total_quantity"],
+                revenue=row["total_revenue"],
+            )
+            for row in items.values("date", "product_id", "payment_status").annotate(
+                total_orders=Count("order_id", distinct=True), **totals
+            )
+        )
+        DailyCollectionSales.objects.bulk_create(
+            DailyCollectionSales(
+                date=row["date"],
+                collection_id=row["product__collection_id"],
+                payment_status=row["payment_status"],
+                quantity=row["total_quantity"],
+                revenue=row["total_revenue"],
+            )
+            for row in items.values(
+                "date", "product__collection_id", "payment_status"
+            ).annotate(**totals)
+        )
@@ -1,4 +1,7 @@
+from django.conf import settings
 from rest_framework import serializers
+
+from core import identity
 from .models import (
     Product,
     Collection,
@@ -9,12 +12,16 @@ from .models import (
     Order,
     OrderItem,
     ProductImage,
+    ProductRecommendation,
 )
 from decimal import Decimal
-from django.db import transaction
+from django.db import DEFAULT_DB_ALIAS, transaction
+from . import sharding
+from .fieldsets import SparseFieldsSerializerMixin
+from .signals import order_created
 
 
-class CollectionSerializer(serializers.ModelSerializer):
+class CollectionSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     products_count = serializers.IntegerField(read_only=True)
 
     class Meta:
@@ -22,6 +29,12 @@ class CollectionSerializer(serializers.ModelSerializer):
         fields = ["id", "title", "products_count"]
 
 
+class SimpleCollectionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Collection
+        fields = ["id", "title"]
+
+
 class ProductImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductImage
@@ -35,7 +48,13 @@ class ProductImageSerializer(serializers.ModelSerializer):
         return self.instance
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class CatalogImageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductImage
+        fields = ["id", "product", "image"]
+
+
+class ProductSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     price_with_tax = serializers.SerializerMethodField(method_name="calculate_tax")
     images = ProductImageSerializer(many=True, read_only=True)
 
@@ -49,7 +68,10 @@ class ProductSerializer(serializers.ModelSerializer):
             "collection",
             "price_with_tax",
             "images",
+            "reviews_count",
+            "last_review_at",
         ]
+        expandable_fields = {"collection": (SimpleCollectionSerializer, {})}
 
     def calculate_tax(self, product: Product):
         return product.unit_price * Decimal(1.1)
@@ -88,19 +110,19 @@ class AddCartItemSerializer(serializers.ModelSerializer):
 
         try:
             # update an existing instance
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
+            cart_item = CartItem.objects.for_cart(cart_id).get(product_id=product_id)
             cart_item.quantity = cart_item.quantity + quantity
             cart_item.save()
             self.instance = cart_item
         except CartItem.DoesNotExist:
             # create a new instance
-            self.instance = CartItem.objects.create(
+            self.instance = CartItem.objects.for_cart(cart_id).create(
                 cart_id=cart_id, **self.validated_data
             )
         return self.instance
 
     def validate_product_id(self, product_id):
-        if not Product.objects.filter(pk=product_id).exists():
+        if not identity.exists(Product, pk=product_id):
             raise serializers.ValidationError("No product with the given id was found")
         return product_id
 
@@ -117,6 +139,14 @@ class CustomProductSerializer(serializers.ModelSerializer):
         fields = ["id", "title", "unit_price"]
 
 
+class ProductRecommendationSerializer(serializers.ModelSerializer):
+    product = CustomProductSerializer(source="recommended")
+
+    class Meta:
+        model = ProductRecommendation
+        fields = ["product", "score"]
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     product = CustomProductSerializer()
     total_price = serializers.SerializerMethodField(method_name="calculate_total_price")
@@ -129,7 +159,7 @@ class CartItemSerializer(serializers.ModelSerializer):
         return cartItem.product.unit_price * cartItem.quantity
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField(method_name="get_total_price")
@@ -144,6 +174,10 @@ class CartSerializer(serializers.ModelSerializer):
         )
         return total_price
 
+    def create(self, validated_data):
+        # routed to the shard of its new id (store.sharding)
+        return Cart.objects.create(**validated_data)
+
 
 # Customer Profile Serializer
 class CustomerSerializer(serializers.ModelSerializer):
@@ -162,12 +196,13 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = ["id", "product", "quantity", "unit_price"]
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
 
     class Meta:
         model = Order
         fields = ["id", "placed_at", "payment_status", "customer", "items"]
+        expandable_fields = {"customer": (CustomerSerializer, {})}
 
 
 class CreateOrderSerializer(serializers.Serializer):
@@ -177,40 +212,64 @@ class CreateOrderSerializer(serializers.Serializer):
     - A customer/user should be the only one to create his own order
     
     - overriding the save method to encapsulates the logic for creating an order before save
+
+    - the cart may live in another database than the order (store.sharding):
+    the cart stays locked while the order is written, and is deleted once the
+    order is committed. When that delete fails, the order keeps the cart id and
+    a retried checkout by the same customer returns it instead of ordering the
+    cart twice; anyone else is told the cart does not exist
     """
 
     def save(self, **kwargs):
-        with transaction.atomic():
-            user_id = self.context["user_id"]
-            cart_id = self.validated_data["cart_id"]
-            customer = Customer.objects.get(user_id=user_id)
-
-            order = Order.objects.create(customer=customer)
+        user_id = self.context["user_id"]
+        cart_id = self.validated_data["cart_id"]
+
+        with transaction.atomic(using=sharding.shard_for(cart_id)):
+            carts = Cart.objects.for_cart(cart_id)
+            if not carts.select_for_update().exists():
+                # checked out meanwhile
+                raise serializers.ValidationError(
+                    {"cart_id": "No cart with the given id was found"}
+                )
+            cart_items = CartItem.objects.for_cart(cart_id).prefetch_related("product")
+
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                customer = identity.get(Customer, user_id=user_id)
+                order = Order.objects.filter(cart_id=cart_id).first()
+                if order is None:
+                    order = self.create_order(customer, cart_id, cart_items)
+                elif order.customer_id != customer.id:
+                    # ordered by someone else: not handed out, the cart is kept
+                    raise serializers.ValidationError(
+                        {"cart_id": "No cart with the given id was found"}
+                    )
 
-            cart_items = CartItem.objects.select_related("product").filter(
-                cart_id=cart_id
-            )
+            # after order, delete cart
+            carts.delete()
+            identity.forget(Cart, cart_id)
 
-            # transforming cart_items to order-item objects to create order-items
-            order_items = [
-                OrderItem(
-                    order=order,
-                    product=item.product,
-                    quantity=item.quantity,
-                    unit_price=item.product.unit_price,
-                )
-                for item in cart_items
-            ]
+        return order
 
-            OrderItem.objects.bulk_create(order_items)
+    def create_order(self, customer, cart_id, cart_items):
+        order = Order.objects.create(customer=customer, cart_id=cart_id)
 
-            # after order, delete cart
-            Cart.objects.filter(pk=cart_id).delete()
+        # transforming cart_items to order-item objects to create order-items
+        order_items = [
+            OrderItem(
+                order=order,
+                product=item.product,
+                quantity=item.quantity,
+                unit_price=item.product.unit_price,
+            )
+            for item in cart_items
+        ]
 
-            return order
+        OrderItem.objects.bulk_create(order_items)
+        order_created.send(sender=self.__class__, order=order, items=order_items)
+        return order
 
     def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
+        if not identity.exists(Cart, pk=cart_id):
             raise serializers.ValidationError("No cart with the given id was found")
         return cart_id
 
@@ -219,3 +278,33 @@ class UpdateOrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ["payment_status"]
+
+
+class BatchRequestSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=["GET", "POST", "PUT", "PATCH", "DELETE"])
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False)
+
+    def validate_path(self, path):
+        if not path.startswith("/store/") or path.startswith("/store/batch/"):
+            raise serializers.ValidationError(
+                "Only /store/ endpoints (other than batch) can be batched"
+            )
+        return path
+
+
+class TopProductsSerializer(serializers.Serializer):
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+
+class BulkDeleteSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_DELETE["MAX_IDS"],
+    )
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = BatchRequestSerializer(many=True, allow_empty=False, max_length=20)
+    atomic = serializers.BooleanField(default=False)
@@ -0,0 +1,114 @@
+"""
+Carts and their items, the highest rate writes, are spread over the databases
+listed in `CART_SHARDS["DATABASES"]`; everything else stays in the default
+database.
+
+- a cart lives in the database its id hashes to (`shard_for`), with all of its
+items, so cart reads and writes only touch one shard
+
+- rendezvous hashing: each cart goes to the shard with the highest hash of
+(cart id, alias), so adding a shard only moves the carts it now wins (about
+1 / n of them), see `manage.py rebalance_carts`
+
+- querysets have no cart id to route on: cart code goes through
+`Cart.objects.for_cart(cart_id)` / `CartItem.objects.for_cart(cart_id)`, while
+instances (saves, deletes, related managers) are routed by `CartShardRouter`
+
+- no foreign key crosses databases: CartItem.product has no constraint and cart
+items of deleted products are removed by store.signals / store.bulkdelete
+
+- migrations run on a cart database only when they carry the
+`hints={"cart_databases": True}` hint: later changes to the cart tables need a
+RunPython / RunSQL with it, applied to the cart databases only
+"""
+
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, models
+
+# model -> attribute holding the cart id
+SHARDED_MODELS = {"store.cart": "id", "store.cartitem": "cart_id"}
+
+
+def databases():
+    """the aliases of the cart databases"""
+    return list(
+        getattr(settings, "CART_SHARDS", {}).get("DATABASES", [DEFAULT_DB_ALIAS])
+    )
+
+
+def _weight(cart_id, alias):
+    return hashlib.blake2b(cart_id.bytes + alias.encode(), digest_size=8).digest()
+
+
+def shard_for(cart_id, aliases=None):
+    """the alias of the database holding the cart (ValueError on a malformed id)"""
+    aliases = aliases or databases()
+    if len(aliases) == 1:
+        return aliases[0]
+    if not isinstance(cart_id, uuid.UUID):
+        cart_id = uuid.UUID(str(cart_id))
+    return max(aliases, key=lambda alias: _weight(cart_id, alias))
+
+
+def is_sharded():
+    return databases() != [DEFAULT_DB_ALIAS]
+
+
+class CartShardQuerySet(models.QuerySet):
+    def for_cart(self, cart_id):
+        """the rows of one cart, read from / written to its shard"""
+        attname = SHARDED_MODELS[self.model._meta.label_lower]
+        return self.using(shard_for(cart_id)).filter(**{attname: cart_id})
+
+    def create(self, **kwargs):
+        if self._db is not None:
+            return super().create(**kwargs)
+        # saved through the instance, which the router places by its cart id
+        instance = self.model(**kwargs)
+        instance.save(force_insert=True)
+        return instance
+
+
+class CartShardRouter:
+    """routes Cart and CartItem instances to their shard, the rest to default"""
+
+    def _cart_id(self, model, hints):
+        instance = hints.get("instance")
+        if instance is not None:
+            attname = SHARDED_MODELS.get(instance._meta.label_lower)
+            return None if attname is None else getattr(instance, attname)
+        # identity map lookups (core.identity): {attname: value}
+        lookup = hints.get("lookup") or {}
+        return lookup.get(SHARDED_MODELS[model._meta.label_lower])
+
+    def _db(self, model, hints):
+        if model._meta.label_lower not in SHARDED_MODELS:
+            # also for the product of a cart item read from a shard
+            return DEFAULT_DB_ALIAS
+        cart_id = self._cart_id(model, hints)
+        return None if cart_id is None else shard_for(cart_id)
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if (
+            obj1._meta.label_lower in SHARDED_MODELS
+            or obj2._meta.label_lower in SHARDED_MODELS
+        ):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS or db not in databases():
+            return None
+        # shards only hold the cart tables, created in their current form by the
+        # operations carrying this hint (store.0019): the earlier history has a
+        # foreign key to store_product, which only the default database has
+        return bool(hints.get("cart_databases"))
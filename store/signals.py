@@ -1,10 +1,235 @@
 from django.conf import settings
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-from .models import Customer
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save, post_delete
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+from .models import (
+    Cart,
+    CartItem,
+    Collection,
+    Customer,
+    Order,
+    OrderStatusEvent,
+    Product,
+    ProductImage,
+    Review,
+)
+from . import (
+    blobs,
+    carts,
+    changelog,
+    indexes,
+    recommendations,
+    reviewstats,
+    rollups,
+    sharding,
+)
+from .autocomplete import title_index
+
+# sent by CreateOrderSerializer once the order and its items are created,
+# with `order` and `items` (the OrderItem instances) arguments
+order_created = Signal()
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_for_new_user(sender, **kwargs):
     if kwargs["created"]:
         Customer.objects.create(user=kwargs["instance"])
+
+
+# keeping the per-collection sorted product indexes in sync with product writes
+@receiver(pre_save, sender=Product)
+def remember_product_collection(sender, instance, **kwargs):
+    instance._previous_collection_id = (
+        Product.objects.filter(pk=instance.pk)
+        .values_list("collection_id", flat=True)
+        .first()
+        if instance.pk
+        else None
+    )
+
+
+@receiver(post_save, sender=Product)
+def update_collection_indexes(sender, instance, **kwargs):
+    indexes.add_product(instance, getattr(instance, "_previous_collection_id", None))
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_collection_indexes(sender, instance, **kwargs):
+    indexes.remove_product(instance.id, instance.collection_id)
+
+
+@receiver(order_created)
+def update_recommendations(sender, order, items, **kwargs):
+    product_ids = [item.product_id for item in items]
+    # robust: the order is committed, a failure here is logged instead of
+    # failing the checkout (the next rebuild catches up)
+    transaction.on_commit(
+        lambda: recommendations.record_order(product_ids), robust=True
+    )
+
+
+# keeping the sales rollups in sync with new orders and payment status changes,
+# once committed: the daily rows of popular products are updated by every
+# checkout, holding their locks until the checkout commits would serialize them.
+# robust: a failure is logged, `manage.py rebuild_sales_rollups` catches up
+@receiver(order_created)
+def add_order_to_rollups(sender, order, items, **kwargs):
+    lines = rollups.order_lines(items)
+    date, payment_status = timezone.localdate(order.placed_at), order.payment_status
+    transaction.on_commit(
+        lambda: rollups.record_lines(date, payment_status, lines), robust=True
+    )
+
+
+@receiver(pre_save, sender=Order)
+def remember_payment_status(sender, instance, **kwargs):
+    instance._previous_payment_status = (
+        Order.objects.filter(pk=instance.pk)
+        .values_list("payment_status", flat=True)
+        .first()
+        if instance.pk
+        else None
+    )
+
+
+@receiver(post_save, sender=Order)
+def move_order_in_rollups(sender, instance, created, **kwargs):
+    previous_status = getattr(instance, "_previous_payment_status", None)
+    if not created and previous_status not in (None, instance.payment_status):
+        order, payment_status = instance, instance.payment_status
+        transaction.on_commit(
+            lambda: rollups.move_order(order, previous_status, payment_status),
+            robust=True,
+        )
+
+
+# feeding /store/orders/events/ on every payment status change, whether it comes
+# from UpdateOrderSerializer or the admin
+@receiver(post_save, sender=Order)
+def record_order_status_event(sender, instance, created, **kwargs):
+    previous_status = getattr(instance, "_previous_payment_status", None)
+    if not created and previous_status not in (None, instance.payment_status):
+        OrderStatusEvent.objects.create(
+            order=instance,
+            customer_id=instance.customer_id,
+            payment_status=instance.payment_status,
+        )
+
+
+# keeping the in-process title autocomplete indexes up to date, once committed
+@receiver(post_save, sender=Product)
+def update_title_index(sender, instance, **kwargs):
+    product_id, title = instance.id, instance.title
+    transaction.on_commit(lambda: title_index.update(product_id, title))
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_title_index(sender, instance, **kwargs):
+    product_id = instance.id
+    transaction.on_commit(lambda: title_index.remove([product_id]))
+
+
+@receiver(order_created)
+def update_title_popularity(sender, order, items, **kwargs):
+    quantities = {}
+    for item in items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    transaction.on_commit(lambda: title_index.add_popularity(quantities), robust=True)
+
+
+# counting the references to the content-addressed image files, so deleting the
+# last image using a file deletes the file
+@receiver(pre_save, sender=ProductImage)
+def remember_image_name(sender, instance, **kwargs):
+    instance._previous_image_name = (
+        ProductImage.objects.filter(pk=instance.pk)
+        .values_list("image", flat=True)
+        .first()
+        if instance.pk
+        else None
+    )
+    # the upload, which the field replaces by its stored name when saving
+    instance._uploaded_image = (
+        None if instance.image._committed else instance.image.file
+    )
+
+
+@receiver(post_save, sender=ProductImage)
+def reference_image_blob(sender, instance, **kwargs):
+    previous_name = getattr(instance, "_previous_image_name", None)
+    if instance.image.name == previous_name:
+        return
+    if instance.image.name:
+        blobs.acquire(
+            instance.image.name,
+            instance.image.storage,
+            getattr(instance, "_uploaded_image", None),
+        )
+    if previous_name:
+        blobs.release(previous_name, instance.image.storage)
+
+
+@receiver(post_delete, sender=ProductImage)
+def release_image_blob(sender, instance, **kwargs):
+    if instance.image.name:
+        blobs.release(instance.image.name, instance.image.storage)
+
+
+# feeding the catalog delta sync endpoint
+@receiver(post_save, sender=Collection)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def record_catalog_change(sender, instance, **kwargs):
+    changelog.record(sender, [instance.pk])
+
+
+@receiver(post_delete, sender=Collection)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductImage)
+def record_catalog_deletion(sender, instance, **kwargs):
+    changelog.record(sender, [instance.pk], deleted=True)
+
+
+@receiver(post_save, sender=Review)
+def add_to_review_stats(sender, instance, created, **kwargs):
+    if created:
+        reviewstats.review_added(instance.product_id, instance.date)
+
+
+@receiver(post_delete, sender=Review)
+def remove_from_review_stats(sender, instance, origin=None, **kwargs):
+    # reviews deleted with their product (a Product instance or queryset) leave
+    # no stats to update, nor a product change to log once per review
+    if isinstance(origin, Product) or getattr(origin, "model", None) is Product:
+        return
+    reviewstats.review_removed(instance.product_id)
+
+
+# dropping cached cart summaries (store.carts) once the write is committed, in
+# the cart's database (store.sharding)
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_cart_summary(sender, instance, using, **kwargs):
+    cart_id = instance.cart_id
+    transaction.on_commit(lambda: carts.invalidate(cart_id), using=using)
+
+
+@receiver(post_delete, sender=Cart)
+def invalidate_deleted_cart_summary(sender, instance, using, **kwargs):
+    cart_id = instance.pk
+    transaction.on_commit(lambda: carts.invalidate(cart_id), using=using)
+
+
+# no foreign key reaches the cart databases: the cart items of a deleted product
+# are removed from each of them
+@receiver(post_delete, sender=Product)
+def remove_from_carts(sender, instance, **kwargs):
+    for alias in sharding.databases():
+        CartItem.objects.using(alias).filter(product_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_cart_totals(sender, instance, **kwargs):
+    transaction.on_commit(carts.invalidate_prices)
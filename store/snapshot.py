@@ -0,0 +1,451 @@
+"""
+Read-only catalog snapshot shared by the worker processes through mmap.
+
+`build_catalog_snapshot` writes products, prices, collection membership and image
+urls as typed arrays in one file, replaced atomically (rename). Every worker maps
+the file read-only, so the pages are shared through the page cache instead of
+being copied per process, and reads are array lookups without a database query.
+Workers check for a newer file every `CHECK_INTERVAL` seconds and swap to it.
+
+Catalog writes (everything recorded in the change log, store.changelog) mark the
+snapshot stale once committed: `PATH`.stale holds the time of the last write,
+and a snapshot whose build started before it is not used, reads go to the
+database until the next build. The marker is a file of the host, like the
+snapshot: writes made on other hosts are only picked up by the next build.
+
+Layout: a header (magic, version = build time in ns, section table) followed by
+8-byte aligned sections in native byte order. Strings are stored in one pool per
+field, addressed by an offsets array of n + 1 entries.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from datetime import date
+from bisect import bisect_left
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
+from rest_framework.response import Response
+
+from store.models import Collection, Product, ProductImage
+
+MAGIC = b"CATSNAP2"
+HEADER = struct.Struct("=8sQI4x")
+SECTION = struct.Struct("=QQ")
+SECTIONS = [
+    # products, sorted by id
+    ("product_ids", "q"),
+    ("product_collections", "q"),
+    ("product_prices", "q"),  # in cents
+    ("product_inventory", "q"),
+    ("product_reviews_counts", "q"),
+    ("product_last_reviews", "q"),  # date ordinals, 0 without reviews
+    ("product_title_offsets", "I"),
+    ("product_titles", "B"),
+    ("product_image_offsets", "I"),
+    # product rows in the default (title) order
+    ("product_title_order", "I"),
+    # images, grouped by product
+    ("image_ids", "q"),
+    ("image_url_offsets", "I"),
+    ("image_urls", "B"),
+    # collections, sorted by id
+    ("collection_ids", "q"),
+    ("collection_title_offsets", "I"),
+    ("collection_titles", "B"),
+    ("collection_title_order", "I"),
+    # product rows of each collection, in title order
+    ("collection_member_offsets", "I"),
+    ("collection_members", "I"),
+]
+
+
+def config(name, default=None):
+    return getattr(settings, "CATALOG_SNAPSHOT", {}).get(name, default)
+
+
+def _strings(values):
+    offsets, pool = array("I", [0]), bytearray()
+    for value in values:
+        pool += value.encode()
+        offsets.append(len(pool))
+    return offsets, array("B", pool)
+
+
+def build(path):
+    """writes a snapshot of the current catalog to `path`, returns its version"""
+    # taken before reading: a write committed during the build is newer than it
+    version = time.time_ns()
+    products = list(
+        Product.objects.order_by("id").values_list(
+            "id",
+            "collection_id",
+            "unit_price",
+            "inventory",
+            "title",
+            "reviews_count",
+            "last_review_at",
+        )
+    )
+    product_rows = {product[0]: row for row, product in enumerate(products)}
+
+    images = {}
+    storage = ProductImage._meta.get_field("image").storage
+    for product_id, image_id, name in ProductImage.objects.order_by(
+        "product_id", "id"
+    ).values_list("product_id", "id", "image"):
+        images.setdefault(product_id, []).append((image_id, storage.url(name)))
+    image_offsets, image_ids, image_urls = array("I", [0]), array("q"), []
+    for product_id, *_ in products:
+        for image_id, url in images.get(product_id, []):
+            image_ids.append(image_id)
+            image_urls.append(url)
+        image_offsets.append(len(image_ids))
+
+    title_order = array(
+        "I",
+        (
+            product_rows[product_id]
+            for product_id in Product.objects.order_by("title", "id").values_list(
+                "id", flat=True
+            )
+        ),
+    )
+
+    collections = list(Collection.objects.order_by("id").values_list("id", "title"))
+    collection_rows = {collection[0]: row for row, collection in enumerate(collections)}
+    members = {collection_id: [] for collection_id, _ in collections}
+    for row in title_order:
+        members[products[row][1]].append(row)
+    member_offsets, member_rows = array("I", [0]), array("I")
+    for collection_id, _ in collections:
+        member_rows.extend(members[collection_id])
+        member_offsets.append(len(member_rows))
+
+    product_title_offsets, product_titles = _strings(p[4] for p in products)
+    image_url_offsets, image_url_pool = _strings(image_urls)
+    collection_title_offsets, collection_titles = _strings(c[1] for c in collections)
+    sections = {
+        "product_ids": array("q", (p[0] for p in products)),
+        "product_collections": array("q", (p[1] for p in products)),
+        "product_prices": array("q", (int(p[2] * 100) for p in products)),
+        "product_inventory": array("q", (p[3] for p in products)),
+        "product_reviews_counts": array("q", (p[5] for p in products)),
+        "product_last_reviews": array(
+            "q", (p[6].toordinal() if p[6] else 0 for p in products)
+        ),
+        "product_title_offsets": product_title_offsets,
+        "product_titles": product_titles,
+        "product_image_offsets": image_offsets,
+        "product_title_order": title_order,
+        "image_ids": image_ids,
+        "image_url_offsets": image_url_offsets,
+        "image_urls": image_url_pool,
+        "collection_ids": array("q", (c[0] for c in collections)),
+        "collection_title_offsets": collection_title_offsets,
+        "collection_titles": collection_titles,
+        "collection_title_order": array(
+            "I",
+            (
+                collection_rows[collection_id]
+                for collection_id in Collection.objects.order_by(
+                    "title", "id"
+                ).values_list("id", flat=True)
+            ),
+        ),
+        "collection_member_offsets": member_offsets,
+        "collection_members": member_rows,
+    }
+
+    offset = HEADER.size + SECTION.size * len(SECTIONS)
+    table, body = [], bytearray()
+    for name, _ in SECTIONS:
+        data = sections[name].tobytes()
+        padding = -(offset + len(body)) % 8
+        body += b"\0" * padding
+        table.append(SECTION.pack(offset + len(body), len(data)))
+        body += data
+
+    # written next to the target and renamed over it: readers see either file
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, version, len(SECTIONS)))
+        file.write(b"".join(table))
+        file.write(body)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+    return version
+
+
+class CatalogSnapshot:
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.map)
+        magic, self.version, count = HEADER.unpack_from(view)
+        if magic != MAGIC or count != len(SECTIONS):
+            raise ValueError(f"{path} is not a catalog snapshot")
+        for index, (name, type_code) in enumerate(SECTIONS):
+            offset, length = SECTION.unpack_from(
+                view, HEADER.size + SECTION.size * index
+            )
+            setattr(self, name, view[offset : offset + length].cast(type_code))
+
+    @property
+    def age(self):
+        return (time.time_ns() - self.version) / 1e9
+
+    @staticmethod
+    def _string(pool, offsets, index):
+        return bytes(pool[offsets[index] : offsets[index + 1]]).decode()
+
+    @staticmethod
+    def _find(ids, object_id):
+        row = bisect_left(ids, object_id)
+        return row if row < len(ids) and ids[row] == object_id else None
+
+    def product_row(self, product_id):
+        return self._find(self.product_ids, product_id)
+
+    def collection_row(self, collection_id):
+        return self._find(self.collection_ids, collection_id)
+
+    def product_rows(self, collection_id=None):
+        """product rows in title order, of one collection or of the catalog"""
+        if collection_id is None:
+            return self.product_title_order
+        row = self.collection_row(collection_id)
+        if row is None:
+            return []
+        offsets = self.collection_member_offsets
+        return self.collection_members[offsets[row] : offsets[row + 1]]
+
+    def collection_rows(self):
+        return self.collection_title_order
+
+    def collection(self, row):
+        return {
+            "id": self.collection_ids[row],
+            "title": self._string(
+                self.collection_titles, self.collection_title_offsets, row
+            ),
+        }
+
+    def products_count(self, row):
+        offsets = self.collection_member_offsets
+        return offsets[row + 1] - offsets[row]
+
+    def product(self, row, expand_collection=False):
+        """the ProductSerializer representation, with relative image urls"""
+        unit_price = Decimal(self.product_prices[row]).scaleb(-2)
+        collection_id = self.product_collections[row]
+        offsets = self.product_image_offsets
+        last_review = self.product_last_reviews[row]
+        return {
+            "id": self.product_ids[row],
+            "title": self._string(self.product_titles, self.product_title_offsets, row),
+            "unit_price": unit_price,
+            "inventory": self.product_inventory[row],
+            "collection": (
+                self.collection(self.collection_row(collection_id))
+                if expand_collection
+                else collection_id
+            ),
+            "price_with_tax": unit_price * Decimal(1.1),
+            "images": [
+                {
+                    "id": self.image_ids[image],
+                    "image": self._string(
+                        self.image_urls, self.image_url_offsets, image
+                    ),
+                }
+                for image in range(offsets[row], offsets[row + 1])
+            ],
+            "reviews_count": self.product_reviews_counts[row],
+            "last_review_at": (
+                date.fromordinal(last_review).isoformat() if last_review else None
+            ),
+        }
+
+
+def _stale_path():
+    return config("PATH") + ".stale"
+
+
+def _stale_since():
+    """time (ns) of the last catalog write on this host, 0 without any"""
+    try:
+        return os.stat(_stale_path()).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _mark_stale():
+    # the commit time, rather than the coarser clock of file timestamps
+    now = time.time_ns()
+    with open(_stale_path(), "a"):
+        pass
+    os.utime(_stale_path(), ns=(now, now))
+
+
+def mark_stale():
+    """sets the current snapshot aside once the catalog write being made commits"""
+    if config("ENABLED", False):
+        transaction.on_commit(_mark_stale, robust=True)
+
+
+_lock = threading.Lock()
+_current = {"snapshot": None, "file": None, "checked_at": float("-inf")}
+
+
+def get_snapshot():
+    """
+    - the current snapshot of this process, or None when there is no usable one
+    (disabled, not built yet, older than `MAX_AGE` seconds, or older than the
+    last catalog write)
+
+    - the file is checked for a newer version at most every `CHECK_INTERVAL`
+    seconds, and swapped in without blocking readers of the previous one
+    """
+    if not config("ENABLED", False):
+        return None
+
+    now = time.monotonic()
+    if now - _current["checked_at"] >= config("CHECK_INTERVAL", 2):
+        with _lock:
+            _current["checked_at"] = now
+            try:
+                stat = os.stat(config("PATH"))
+                file = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+                if file != _current["file"]:
+                    _current["snapshot"] = CatalogSnapshot(config("PATH"))
+                    _current["file"] = file
+            except (OSError, ValueError):
+                _current["snapshot"] = _current["file"] = None
+
+    snapshot = _current["snapshot"]
+    if snapshot is None or snapshot.age > config("MAX_AGE", 600):
+        return None
+    if snapshot.version <= _stale_since():
+        return None
+    return snapshot
+
+
+class RowSequence:
+    """lazily maps snapshot rows to representations, for the paginator"""
+
+    def __init__(self, rows, represent):
+        self.rows = rows
+        self.represent = represent
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.represent(row) for row in self.rows[index]]
+        return self.represent(self.rows[index])
+
+
+class SnapshotViewSetMixin:
+    """
+    - answers safe requests from the catalog snapshot when one is available and
+    the query only uses `snapshot_params`, falling back to the database otherwise
+
+    - responses served from the snapshot carry `X-Catalog-Snapshot: <version>`
+    """
+
+    snapshot_params = {"page", "fields", "expand", "format"}
+
+    def get_snapshot(self):
+        if self.request.method not in ("GET", "HEAD"):
+            return None
+        if set(self.request.query_params) - self.snapshot_params:
+            return None
+        return get_snapshot()
+
+    def sparse(self, representation):
+        fields = self.get_requested_fields()
+        if fields is None:
+            return representation
+        return {key: value for key, value in representation.items() if key in fields}
+
+    def snapshot_response(self, snapshot, response):
+        response["X-Catalog-Snapshot"] = str(snapshot.version)
+        return response
+
+
+class SnapshotProductMixin(SnapshotViewSetMixin):
+    snapshot_params = SnapshotViewSetMixin.snapshot_params | {"collection_id"}
+
+    def represent_product(self, snapshot, row):
+        product = snapshot.product(row, self.expands("collection"))
+        for image in product["images"]:
+            image["image"] = self.request.build_absolute_uri(image["image"])
+        return self.sparse(product)
+
+    def list(self, request, *args, **kwargs):
+        snapshot = self.get_snapshot()
+        collection_id = request.query_params.get("collection_id")
+        if snapshot is not None and collection_id is not None:
+            collection_id = int(collection_id) if collection_id.isdigit() else None
+            if collection_id is None or snapshot.collection_row(collection_id) is None:
+                # the filter reports the invalid choice
+                snapshot = None
+        if snapshot is None:
+            return super().list(request, *args, **kwargs)
+
+        rows = snapshot.product_rows(collection_id)
+        page = self.paginate_queryset(
+            RowSequence(rows, lambda row: self.represent_product(snapshot, row))
+        )
+        return self.snapshot_response(snapshot, self.get_paginated_response(page))
+
+    def retrieve(self, request, *args, **kwargs):
+        snapshot = self.get_snapshot()
+        if snapshot is None or not kwargs["pk"].isdigit():
+            return super().retrieve(request, *args, **kwargs)
+
+        row = snapshot.product_row(int(kwargs["pk"]))
+        if row is None:
+            raise Http404
+        return self.snapshot_response(
+            snapshot, Response(self.represent_product(snapshot, row))
+        )
+
+
+class SnapshotCollectionMixin(SnapshotViewSetMixin):
+    def represent_collection(self, snapshot, row):
+        collection = snapshot.collection(row)
+        collection["products_count"] = snapshot.products_count(row)
+        return self.sparse(collection)
+
+    def list(self, request, *args, **kwargs):
+        snapshot = self.get_snapshot()
+        if snapshot is None:
+            return super().list(request, *args, **kwargs)
+
+        data = [
+            self.represent_collection(snapshot, row)
+            for row in snapshot.collection_rows()
+        ]
+        return self.snapshot_response(snapshot, Response(data))
+
+    def retrieve(self, request, *args, **kwargs):
+        snapshot = self.get_snapshot()
+        if snapshot is None or not kwargs["pk"].isdigit():
+            return super().retrieve(request, *args, **kwargs)
+
+        row = snapshot.collection_row(int(kwargs["pk"]))
+        if row is None:
+            raise Http404
+        return self.snapshot_response(
+            snapshot, Response(self.represent_collection(snapshot, row))
+        )
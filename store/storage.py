@@ -0,0 +1,62 @@
+import hashlib
+import os
+import uuid
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    - files are named after the sha256 of their content, as
+    `<upload_to>/<first 2 hex digits>/<sha256><extension>`: identical uploads are
+    stored once, and a name never changes content, so its url can be cached forever
+
+    - saving content that is already stored returns the existing name; the
+    references to each file are counted in ImageBlob (see store.blobs)
+
+    - a name is never given a suffix: two uploads of the same content saved at the
+    same time both write the file under its hashed name (same bytes)
+    """
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        hexdigest = digest.hexdigest()
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return "/".join(
+            part for part in (directory, hexdigest[:2], hexdigest + extension) if part
+        )
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+    def restore(self, name, content):
+        """writes `content` under `name`, its hashed name, e.g. after a delete"""
+        return super().save(name, content)
+
+    def get_available_name(self, name, max_length=None):
+        # an existing file of that name has the same content
+        return name
+
+    def _save(self, name, content):
+        # written next to the target and renamed over it, so a concurrent save of
+        # the same name never sees a partial file nor makes this one fail
+        temporary_name = super()._save(f"{name}.{uuid.uuid4().hex}.tmp", content)
+        os.replace(self.path(temporary_name), self.path(name))
+        return name
+
+
+image_storage = ContentAddressedStorage()
@@ -1,3 +1,1505 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import ExitStack
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models.query import QuerySet
+from django.test import (
+    LiveServerTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils.module_loading import import_string
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core import admission, budgets
+from core.models import User
+from store import (
+    carts,
+    events,
+    indexes,
+    loadtest,
+    recommendations,
+    reviewstats,
+    sharding,
+    snapshot,
+)
+from store.autocomplete import TitleIndex
+from store.bulkdelete import delete_collections, delete_products
+from store.fields import uuid7
+from store.models import (
+    Cart,
+    CartItem,
+    CatalogChange,
+    Collection,
+    CollectionProductIndex,
+    Customer,
+    DailyProductSales,
+    ImageBlob,
+    Order,
+    OrderItem,
+    OrderStatusEvent,
+    Product,
+    ProductCoOccurrence,
+    ProductImage,
+    Review,
+)
+from store.signals import order_created
+from store.storage import ContentAddressedStorage, image_storage
+from store.views import ProductViewSet
+
+WITHOUT_IDENTITY_MAP = [
+    middleware
+    for middleware in settings.MIDDLEWARE
+    if middleware != "core.middleware.IdentityMapMiddleware"
+]
+
+
+@override_settings(ADMISSION_CONTROL={"ENABLED": False})
+class IdentityMapTests(TestCase):
+    """the same requests, with and without the request-scoped identity map"""
+
+    # carts may be in other databases (store.sharding)
+    databases = "__all__"
+
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title="Collection")
+        cls.product = Product.objects.create(
+            title="Product",
+            slug="product",
+            unit_price=Decimal("10.00"),
+            inventory=10,
+            collection=collection,
+        )
+        User.objects.create_user("customer", "customer@example.com", "password")
+
+    def setUp(self):
+        response = APIClient().post(
+            "/auth/jwt/create/",
+            {"username": "customer", "password": "password"},
+            format="json",
+        )
+        self.token = response.data["access"]
+
+    def count_queries(self, method, path, data=None):
+        # a new client loads the middleware of the current settings
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION="JWT " + self.token)
+        with ExitStack() as stack:
+            queries = [
+                stack.enter_context(CaptureQueriesContext(connections[alias]))
+                for alias in connections
+            ]
+            response = getattr(client, method)(path, data, format="json")
+        self.assertLess(response.status_code, 400, response.data)
+        return sum(len(captured) for captured in queries), response
+
+    def compare(self, method, path, data=None):
+        """(queries without, queries with the identity map)"""
+        with override_settings(MIDDLEWARE=WITHOUT_IDENTITY_MAP):
+            without, _ = self.count_queries(method, path, data)
+        with_map, _ = self.count_queries(method, path, data)
+        return without, with_map
+
+    def batch(self, *requests):
+        return {
+            "requests": [
+                {"method": method, "path": path, **({"body": body} if body else {})}
+                for method, path, body in requests
+            ]
+        }
+
+    def test_customer_lookups_in_batch(self):
+        # OrderViewSet.get_queryset and CustomerViewSet.me load the customer
+        without, with_map = self.compare(
+            "post",
+            "/store/batch/",
+            self.batch(
+                ("GET", "/store/orders/", None),
+                ("GET", "/store/orders/", None),
+                ("GET", "/store/customers/me/", None),
+            ),
+        )
+        self.assertEqual(without - with_map, 2)
+
+    def test_product_validation_in_batch(self):
+        # AddCartItemSerializer checks the product exists on every item
+        cart = Cart.objects.create()
+        item = ("POST", f"/store/carts/{cart.id}/items/", None)
+        body = {"product_id": self.product.id, "quantity": 1}
+        without, with_map = self.compare(
+            "post", "/store/batch/", self.batch(*[item[:2] + (body,)] * 3)
+        )
+        self.assertEqual(without - with_map, 2)
+
+    def test_order_from_cart(self):
+        # the customer of the order and the cart checked by the validator
+        def order_requests():
+            cart = Cart.objects.create()
+            return self.batch(
+                ("GET", "/store/customers/me/", None),
+                (
+                    "POST",
+                    f"/store/carts/{cart.id}/items/",
+                    {"product_id": self.product.id, "quantity": 2},
+                ),
+                ("POST", "/store/orders/", {"cart_id": str(cart.id)}),
+                ("GET", "/store/orders/", None),
+            )
+
+        # warms up what is loaded once per process (e.g. the title index)
+        self.count_queries("post", "/store/batch/", order_requests())
+        with override_settings(MIDDLEWARE=WITHOUT_IDENTITY_MAP):
+            without, _ = self.count_queries("post", "/store/batch/", order_requests())
+        with_map, response = self.count_queries(
+            "post", "/store/batch/", order_requests()
+        )
+        self.assertEqual(without - with_map, 2)
+        self.assertEqual(
+            [item["status"] for item in response.data["responses"]],
+            [200, 201, 200, 200],
+        )
+        self.assertEqual(Order.objects.count(), 3)
+
+    def test_forget_after_write(self):
+        # the profile read after the update is not the cached instance
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION="JWT " + self.token)
+        response = client.post(
+            "/store/batch/",
+            self.batch(
+                ("GET", "/store/customers/me/", None),
+                ("PUT", "/store/customers/me/", {"phone": "555-0100"}),
+                ("GET", "/store/customers/me/", None),
+            ),
+            format="json",
+        )
+        self.assertEqual(response.data["responses"][2]["body"]["phone"], "555-0100")
+
+
+@skipUnless(len(sharding.databases()) > 1, "needs several CART_SHARDS databases")
+@override_settings(ADMISSION_CONTROL={"ENABLED": False})
+class CartShardTests(TestCase):
+    databases = "__all__"
+
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title="Collection")
+        cls.products = [
+            Product.objects.create(
+                title=f"Product {index}",
+                slug=f"product-{index}",
+                unit_price=Decimal("10.00"),
+                inventory=10,
+                collection=collection,
+            )
+            for index in range(3)
+        ]
+        User.objects.create_user("customer", "customer@example.com", "password")
+
+    def setUp(self):
+        self.client = APIClient()
+        response = self.client.post(
+            "/auth/jwt/create/",
+            {"username": "customer", "password": "password"},
+            format="json",
+        )
+        self.client.credentials(HTTP_AUTHORIZATION="JWT " + response.data["access"])
+
+    def create_cart(self, quantities=(1, 2)):
+        cart_id = self.client.post("/store/carts/", format="json").data["id"]
+        for product, quantity in zip(self.products, quantities):
+            self.client.post(
+                f"/store/carts/{cart_id}/items/",
+                {"product_id": product.id, "quantity": quantity},
+                format="json",
+            )
+        return cart_id
+
+    def shards_holding(self, cart_id):
+        return [
+            alias
+            for alias in sharding.databases()
+            if Cart.objects.using(alias).filter(id=cart_id).exists()
+        ]
+
+    def test_cart_databases_only_hold_the_cart_tables(self):
+        for alias in sharding.databases():
+            with connections[alias].cursor() as cursor:
+                introspection = connections[alias].introspection
+                tables = set(introspection.table_names(cursor))
+                constraints = introspection.get_constraints(cursor, "store_cartitem")
+            self.assertEqual(
+                tables - {"django_migrations", "sqlite_sequence"},
+                {"store_cart", "store_cartitem"},
+            )
+            self.assertEqual(
+                [
+                    constraint["foreign_key"]
+                    for constraint in constraints.values()
+                    if constraint["foreign_key"]
+                ],
+                [("store_cart", "id")],
+            )
+
+    def test_carts_are_spread_over_shards(self):
+        cart_ids = [self.create_cart() for _ in range(10)]
+        for cart_id in cart_ids:
+            self.assertEqual(
+                self.shards_holding(cart_id), [sharding.shard_for(cart_id)]
+            )
+            self.assertEqual(CartItem.objects.for_cart(cart_id).count(), 2)
+        self.assertGreater(len({sharding.shard_for(id) for id in cart_ids}), 1)
+
+        response = self.client.get(f"/store/carts/{cart_ids[0]}/summary/")
+        self.assertEqual(response.data["quantity"], 3)
+        self.assertEqual(response.data["total_price"], Decimal("30.00"))
+
+    def test_checkout(self):
+        cart_id = self.create_cart()
+        response = self.client.post(
+            "/store/orders/", {"cart_id": cart_id}, format="json"
+        )
+        order = Order.objects.get(pk=response.data["id"])
+        self.assertEqual(order.items.count(), 2)
+        self.assertEqual(self.shards_holding(cart_id), [])
+
+    def test_checkout_retried_after_the_cart_was_not_deleted(self):
+        cart_id = self.create_cart()
+        with mock.patch.object(QuerySet, "delete", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post("/store/orders/", {"cart_id": cart_id}, format="json")
+        self.assertEqual(self.shards_holding(cart_id), [sharding.shard_for(cart_id)])
+
+        response = self.client.post(
+            "/store/orders/", {"cart_id": cart_id}, format="json"
+        )
+        self.assertEqual(Order.objects.get(cart_id=cart_id).pk, response.data["id"])
+        self.assertEqual(self.shards_holding(cart_id), [])
+
+    def test_checkout_retried_by_someone_else(self):
+        cart_id = self.create_cart()
+        with mock.patch.object(QuerySet, "delete", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post("/store/orders/", {"cart_id": cart_id}, format="json")
+
+        User.objects.create_user("other", "other@example.com", "password")
+        other = APIClient()
+        token = other.post(
+            "/auth/jwt/create/",
+            {"username": "other", "password": "password"},
+            format="json",
+        ).data["access"]
+        other.credentials(HTTP_AUTHORIZATION="JWT " + token)
+        response = other.post("/store/orders/", {"cart_id": cart_id}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn("items", response.data)
+        self.assertEqual(self.shards_holding(cart_id), [sharding.shard_for(cart_id)])
+
+        # the customer who ordered it still gets the order
+        response = self.client.post(
+            "/store/orders/", {"cart_id": cart_id}, format="json"
+        )
+        self.assertEqual(Order.objects.get(cart_id=cart_id).pk, response.data["id"])
+
+    def test_atomic_batch_rolls_back_the_cart_databases(self):
+        cart_id = self.create_cart()
+        response = self.client.post(
+            "/store/batch/",
+            {
+                "atomic": True,
+                "requests": [
+                    {
+                        "method": "POST",
+                        "path": f"/store/carts/{cart_id}/items/",
+                        "body": {"product_id": self.products[2].id, "quantity": 1},
+                    },
+                    {"method": "GET", "path": "/store/products/0/"},
+                ],
+            },
+            format="json",
+        )
+        self.assertTrue(response.data["rolled_back"])
+        self.assertEqual(CartItem.objects.for_cart(cart_id).count(), 2)
+
+    def test_rebalance_after_adding_a_shard(self):
+        first, *_ = sharding.databases()
+        with override_settings(CART_SHARDS={"DATABASES": [first]}):
+            cart_ids = [self.create_cart() for _ in range(10)]
+        self.assertEqual(Cart.objects.using(first).count(), 10)
+
+        call_command("rebalance_carts", stdout=StringIO())
+        for cart_id in cart_ids:
+            self.assertEqual(
+                self.shards_holding(cart_id), [sharding.shard_for(cart_id)]
+            )
+            self.assertEqual(
+                list(
+                    CartItem.objects.for_cart(cart_id)
+                    .order_by("product_id")
+                    .values_list("quantity", flat=True)
+                ),
+                [1, 2],
+            )
+
+        output = StringIO()
+        call_command("rebalance_carts", stdout=output)
+        self.assertIn("Every cart is in its database", output.getvalue())
+
+    def test_rebalance_keeps_a_copy_already_moved(self):
+        # a run whose source delete failed, then a change through the api
+        first, *_ = sharding.databases()
+        with override_settings(CART_SHARDS={"DATABASES": [first]}):
+            cart_ids = [self.create_cart() for _ in range(10)]
+        cart_id = next(id for id in cart_ids if sharding.shard_for(id) != first)
+        target = sharding.shard_for(cart_id)
+        Cart.objects.using(target).create(id=cart_id)
+        CartItem.objects.using(target).create(
+            cart_id=cart_id, product=self.products[2], quantity=5
+        )
+
+        call_command("rebalance_carts", stdout=StringIO())
+        self.assertEqual(self.shards_holding(cart_id), [target])
+        self.assertEqual(
+            list(CartItem.objects.for_cart(cart_id).values_list("quantity", flat=True)),
+            [5],
+        )
+
+
+@override_settings(
+    ADMISSION_CONTROL={"ENABLED": False},
+    QUERY_BUDGETS={**settings.QUERY_BUDGETS, "MODE": "raise", "DIRECTORY": None},
+)
+class QueryBudgetTests(TestCase):
+    """requests over the budget of their view fail with QueryBudgetError"""
+
+    # queries of the cart databases count too (store.sharding)
+    databases = "__all__"
+
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title="Collection")
+        cls.products = [
+            Product.objects.create(
+                title=f"Product {index}",
+                slug=f"product-{index}",
+                unit_price=Decimal("10.00"),
+                inventory=10,
+                collection=collection,
+            )
+            for index in range(10)
+        ]
+        User.objects.create_user("customer", "customer@example.com", "password")
+
+    def setUp(self):
+        self.client = APIClient()
+        response = self.client.post(
+            "/auth/jwt/create/",
+            {"username": "customer", "password": "password"},
+            format="json",
+        )
+        self.authorization = "JWT " + response.data["access"]
+        self.client.credentials(HTTP_AUTHORIZATION=self.authorization)
+
+    def test_storefront_within_budgets(self):
+        self.client.get("/store/products/")
+        self.client.get("/store/products/?facets=true&search=Product")
+        self.client.get(f"/store/products/{self.products[0].id}/")
+        for _ in range(3):
+            cart_id = self.client.post("/store/carts/", format="json").data["id"]
+            for product in self.products:
+                self.client.post(
+                    f"/store/carts/{cart_id}/items/",
+                    {"product_id": product.id, "quantity": 1},
+                    format="json",
+                )
+            self.client.get(f"/store/carts/{cart_id}/")
+            self.client.get(f"/store/carts/{cart_id}/summary/")
+            order = self.client.post(
+                "/store/orders/", {"cart_id": cart_id}, format="json"
+            ).data
+            self.assertEqual(len(order["items"]), 10)
+        self.client.get("/store/orders/")
+        self.client.get(f"/store/orders/{order['id']}/")
+
+    def test_over_budget(self):
+        with mock.patch.object(
+            ProductViewSet, "query_budgets", {"list": {"queries": 1}}
+        ):
+            with self.assertRaises(budgets.QueryBudgetError):
+                self.client.get("/store/products/")
+
+            # what a server answers
+            client = APIClient(raise_request_exception=False)
+            client.credentials(HTTP_AUTHORIZATION=self.authorization)
+            with self.assertLogs("core.budgets", "ERROR"):
+                response = client.get("/store/products/")
+        self.assertEqual(response.status_code, 503)
+
+    @override_settings(
+        QUERY_BUDGETS={**settings.QUERY_BUDGETS, "MODE": "reject", "DIRECTORY": None}
+    )
+    def test_reject_over_budget(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.authorization)
+        with mock.patch.object(
+            ProductViewSet, "query_budgets", {"list": {"queries": 1}}
+        ):
+            response = client.get("/store/products/")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.data["detail"].code, "query_budget_exceeded")
+
+    def test_batched_request_over_budget(self):
+        batch = {"requests": [{"method": "GET", "path": "/store/products/"}]}
+        with mock.patch.object(
+            ProductViewSet, "query_budgets", {"list": {"queries": 1}}
+        ):
+            with self.assertRaises(budgets.QueryBudgetError):
+                self.client.post("/store/batch/", batch, format="json")
+
+    @override_settings(
+        QUERY_BUDGETS={**settings.QUERY_BUDGETS, "MODE": "reject", "DIRECTORY": None}
+    )
+    def test_reject_batched_request_over_budget(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.authorization)
+        batch = {
+            "requests": [
+                {"method": "GET", "path": f"/store/products/{self.products[0].id}/"},
+                {"method": "GET", "path": "/store/products/"},
+            ]
+        }
+        with mock.patch.object(
+            ProductViewSet, "query_budgets", {"list": {"queries": 1}}
+        ):
+            response = client.post("/store/batch/", batch, format="json")
+        self.assertEqual(
+            [sub["status"] for sub in response.data["responses"]], [200, 503]
+        )
+
+    def test_report_skips_exited_processes(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        exited = subprocess.Popen([sys.executable, "-c", ""])
+        exited.wait()
+        with override_settings(
+            QUERY_BUDGETS={**settings.QUERY_BUDGETS, "DIRECTORY": directory.name}
+        ):
+            budgets.reset()
+            self.addCleanup(budgets.reset)
+            self.client.get("/store/products/")
+            budgets.flush()
+            # the same counters, written by a process that exited since
+            shutil.copy(
+                os.path.join(directory.name, f"{os.getpid()}.json"),
+                os.path.join(directory.name, f"{exited.pid}.json"),
+            )
+            self.assertEqual([row["requests"] for row in budgets.report()], [1])
+            self.assertEqual(os.listdir(directory.name), [f"{os.getpid()}.json"])
+
+    @skipUnless(connection.vendor == "sqlite", "interrupts SQLite statements")
+    def test_statement_timeout(self):
+        request_budget = budgets.RequestBudget("GET", "log")
+        request_budget.budget = {"statement_timeout": 0.05}
+        with connection.execute_wrapper(request_budget):
+            with self.assertRaises(budgets.StatementTimeout):
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL "
+                        "SELECT x + 1 FROM n WHERE x < 100000000) SELECT count(*) FROM n"
+                    )
+        self.assertEqual(request_budget.timeouts, 1)
+
+
+@override_settings(ADMISSION_CONTROL={"ENABLED": False})
+class OrderEventsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user("customer", "customer@example.com", "password")
+        cls.customer = Customer.objects.get(user=user)
+        cls.order = Order.objects.create(customer=cls.customer)
+
+    def test_middlewares_async_capable(self):
+        # a sync-only middleware would run ASGI requests in a worker thread
+        for path in settings.MIDDLEWARE:
+            self.assertTrue(getattr(import_string(path), "async_capable", False), path)
+
+    def test_stream_needs_asgi(self):
+        client = APIClient()
+        access = client.post(
+            "/auth/jwt/create/",
+            {"username": "customer", "password": "password"},
+            format="json",
+        ).data["access"]
+        response = client.get(
+            "/store/orders/events/",
+            HTTP_AUTHORIZATION="JWT " + access,
+            HTTP_ACCEPT="text/event-stream",
+        )
+        self.assertEqual(response.status_code, 501)
+
+    def test_user_without_customer(self):
+        user = User.objects.create_user("other", "other@example.com", "password")
+        Customer.objects.filter(user=user).delete()
+        response = APIClient().get(
+            "/store/orders/events/",
+            HTTP_AUTHORIZATION=f"JWT {AccessToken.for_user(user)}",
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_recent_events_held_back(self):
+        event = OrderStatusEvent.objects.create(
+            order=self.order, customer=self.customer, payment_status="C"
+        )
+        with override_settings(ORDER_EVENTS={"SETTLE_SECONDS": 60}):
+            fetched, settles_in = events._fetch_events(self.customer.id, 0)
+            self.assertEqual(fetched, [])
+            self.assertGreater(settles_in, 50)
+            self.assertEqual(events._settled_event_id(), 0)
+        with override_settings(ORDER_EVENTS={"SETTLE_SECONDS": 0}):
+            fetched, settles_in = events._fetch_events(self.customer.id, 0)
+            self.assertEqual([row["id"] for row in fetched], [event.id])
+            self.assertIsNone(settles_in)
+
+
+@override_settings(ADMISSION_CONTROL={"ENABLED": False})
+class SparseFieldsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = Collection.objects.create(title="Collection")
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+
+    def setUp(self):
+        self.client = APIClient()
+        access = self.client.post(
+            "/auth/jwt/create/",
+            {"username": "admin", "password": "password"},
+            format="json",
+        ).data["access"]
+        self.client.credentials(HTTP_AUTHORIZATION="JWT " + access)
+
+    def test_writes_ignore_fields(self):
+        response = self.client.post(
+            "/store/products/?fields=id&expand=collection",
+            {
+                "title": "Product",
+                "unit_price": "10.00",
+                "inventory": 5,
+                "collection": self.collection.id,
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["collection"], self.collection.id)
+        product_id = response.data["id"]
+
+        response = self.client.patch(
+            f"/store/products/{product_id}/?fields=id",
+            {"title": "Renamed"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Product.objects.get(id=product_id).title, "Renamed")
+
+        response = self.client.get(f"/store/products/{product_id}/?fields=id,title")
+        self.assertEqual(response.data, {"id": product_id, "title": "Renamed"})
+
+
+@override_settings(
+    AUTOCOMPLETE={"CHECK_INTERVAL": 0}, ADMISSION_CONTROL={"ENABLED": False}
+)
+class AutocompleteTests(TestCase):
+    # deleting a product empties the carts of every cart database
+    databases = "__all__"
+
+    def setUp(self):
+        collection = Collection.objects.create(title="Collection")
+        self.product = Product.objects.create(
+            title="Crab",
+            slug="crab",
+            unit_price=Decimal("10.00"),
+            inventory=10,
+            collection=collection,
+        )
+
+    def test_other_workers_follow_writes(self):
+        product = self.product
+        # the index of another worker, whose signals do not fire
+        other_worker = TitleIndex()
+        self.assertEqual(
+            other_worker.suggest("cr"), [{"id": product.id, "title": "Crab"}]
+        )
+
+        product.title = "Zebra cake"
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        # applied from the change log, without reloading every title
+        with mock.patch.object(other_worker, "load") as load:
+            self.assertEqual(other_worker.suggest("cr"), [])
+            self.assertEqual(
+                other_worker.suggest("zeb"),
+                [{"id": product.id, "title": "Zebra cake"}],
+            )
+        load.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertEqual(other_worker.suggest("zeb"), [])
+
+    def test_version_read_once_per_interval(self):
+        index = TitleIndex()
+        index.suggest("cr")
+        with override_settings(AUTOCOMPLETE={"CHECK_INTERVAL": 60}):
+            with mock.patch("store.autocomplete.cache") as cache:
+                index.suggest("cr")
+                index.suggest("cra")
+        cache.get.assert_not_called()
+
+    @mock.patch("store.views.title_index", TitleIndex())
+    def test_limit(self):
+        client = APIClient()
+        for limit in ["0", "-1", "x"]:
+            response = client.get(
+                "/store/products/autocomplete/", {"q": "cr", "limit": limit}
+            )
+            self.assertEqual(response.status_code, 400, limit)
+        response = client.get("/store/products/autocomplete/", {"q": "cr", "limit": 1})
+        self.assertEqual(response.data, [{"id": self.product.id, "title": "Crab"}])
+
+
+class CartSummaryTests(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # shared by the workers, unlike the default per-process cache
+        settings_override = override_settings(
+            CACHES={
+                "default": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": directory.name,
+                }
+            }
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        collection = Collection.objects.create(title="Collection")
+        self.product = Product.objects.create(
+            title="Product",
+            slug="product",
+            unit_price=Decimal("10.00"),
+            inventory=10,
+            collection=collection,
+        )
+        self.cart = Cart.objects.create()
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+
+    def test_cached_until_invalidated(self):
+        self.assertEqual(carts.get_summary(self.cart.id)["quantity"], 1)
+        with mock.patch.object(carts, "_compute") as compute:
+            self.assertEqual(carts.get_summary(self.cart.id)["quantity"], 1)
+        compute.assert_not_called()
+
+        CartItem.objects.for_cart(self.cart.id).update(quantity=2)
+        carts.invalidate(self.cart.id)
+        self.assertEqual(carts.get_summary(self.cart.id)["quantity"], 2)
+
+    def test_write_while_computing(self):
+        compute = carts._compute
+
+        def compute_then_write(cart_id):
+            summary = compute(cart_id)
+            # committed by another request before this one caches its summary
+            CartItem.objects.for_cart(cart_id).update(quantity=3)
+            carts.invalidate(cart_id)
+            return summary
+
+        with mock.patch.object(carts, "_compute", compute_then_write):
+            self.assertEqual(carts.get_summary(self.cart.id)["quantity"], 1)
+        self.assertEqual(carts.get_summary(self.cart.id)["quantity"], 3)
+
+    def test_not_cached_per_process(self):
+        with override_settings(
+            CACHES={
+                "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+            }
+        ):
+            carts.get_summary(self.cart.id)
+            CartItem.objects.for_cart(self.cart.id).update(quantity=4)
+            # another worker wrote it: this one was not told
+            self.assertEqual(carts.get_summary(self.cart.id)["quantity"], 4)
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title="Collection")
+        self.products = [
+            Product.objects.create(
+                title=f"Product {index}",
+                slug=f"product-{index}",
+                unit_price=Decimal("10.00"),
+                inventory=10,
+                collection=collection,
+            )
+            for index in range(3)
+        ]
+
+    def orders(self, product, other):
+        return ProductCoOccurrence.objects.get(product=product, other=other).orders
+
+    def test_pair_created_concurrently(self):
+        first, second, third = self.products
+        update = QuerySet.update
+
+        def update_then_create(queryset, **kwargs):
+            updated = update(queryset, **kwargs)
+            if not ProductCoOccurrence.objects.exists():
+                # committed by another order between the read and the insert
+                ProductCoOccurrence.objects.create(
+                    product=first, other=second, orders=1
+                )
+            return updated
+
+        with mock.patch.object(
+            QuerySet, "update", autospec=True, side_effect=update_then_create
+        ):
+            recommendations.record_order([first.id, second.id, third.id])
+        self.assertEqual(self.orders(first, second), 2)
+        self.assertEqual(self.orders(second, first), 1)
+        self.assertEqual(self.orders(first, third), 1)
+
+        recommendations.record_order([first.id, second.id])
+        self.assertEqual(self.orders(first, second), 3)
+        self.assertEqual(self.orders(first, third), 1)
+
+    def test_failure_after_the_order_committed(self):
+        first, second, _ = self.products
+        with mock.patch.object(
+            recommendations, "record_order", side_effect=RuntimeError
+        ), self.assertLogs("django", "ERROR"):
+            with self.captureOnCommitCallbacks(execute=True):
+                user = User.objects.create_user("customer", "customer@example.com")
+                order = Order.objects.create(customer=Customer.objects.get(user=user))
+                order_items = [
+                    order.items.create(product=product, quantity=1, unit_price=1)
+                    for product in (first, second)
+                ]
+                order_created.send(sender=None, order=order, items=order_items)
+
+
+class CartIdTests(TestCase):
+    databases = "__all__"
+
+    def test_uuid7(self):
+        first = uuid7()
+        time.sleep(0.002)
+        second = uuid7()
+        self.assertEqual((first.version, first.variant), (7, uuid.RFC_4122))
+        # ordered by creation time, as the index entries they key
+        self.assertLess(first.bytes, second.bytes)
+        self.assertAlmostEqual((first.int >> 80) / 1000, time.time(), delta=5)
+
+    def test_stored_in_16_bytes(self):
+        cart = Cart.objects.create()
+        alias = sharding.shard_for(cart.id)
+        with connections[alias].cursor() as cursor:
+            cursor.execute("SELECT id FROM store_cart")
+            (stored,) = cursor.fetchone()
+        if not connections[alias].features.has_native_uuid_field:
+            self.assertEqual(bytes(stored), cart.id.bytes)
+        for value in (cart.id, cart.id.hex, str(cart.id)):
+            self.assertEqual(Cart.objects.for_cart(value).get().id, cart.id)
+
+
+class CartIdBenchmarkTests(TransactionTestCase):
+    # schema changes cannot run in the transaction of a TestCase on SQLite
+    def test_scratch_tables_dropped(self):
+        tables = connection.introspection.table_names()
+        output = StringIO()
+        call_command("benchmark_cart_ids", "--carts=20", "--lookups=5", stdout=output)
+        self.assertEqual(
+            [line.split()[0] for line in output.getvalue().splitlines()[2:]],
+            ["uuid4_hex", "uuid7_binary"],
+        )
+        self.assertEqual(connection.introspection.table_names(), tables)
+
+
+@override_settings(ADMISSION_CONTROL={"ENABLED": False})
+class ProductFacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Collection.objects.create(title="Shoes")
+        cls.hats = Collection.objects.create(title="Hats")
+        for title, collection, unit_price, inventory in [
+            ("Red shoes", cls.shoes, "5.00", 3),
+            ("Blue shoes", cls.shoes, "10.00", 20),
+            ("Red hat", cls.hats, "49.99", 10),
+            ("Gold hat", cls.hats, "150.00", 1),
+        ]:
+            Product.objects.create(
+                title=title,
+                slug=title.lower().replace(" ", "-"),
+                unit_price=Decimal(unit_price),
+                inventory=inventory,
+                collection=collection,
+            )
+
+    def facets(self, **params):
+        response = APIClient().get("/store/products/", {"facets": "true", **params})
+        return response.data["facets"]
+
+    def test_counts(self):
+        facets = self.facets()
+        self.assertEqual(
+            facets["collections"],
+            [
+                {"id": self.hats.id, "title": "Hats", "count": 2},
+                {"id": self.shoes.id, "title": "Shoes", "count": 2},
+            ],
+        )
+        self.assertEqual(
+            [bucket["count"] for bucket in facets["price"]], [1, 1, 1, 0, 1]
+        )
+        self.assertEqual(facets["price"][1], {"min": 10, "max": 25, "count": 1})
+        self.assertEqual(facets["stock"], {"in_stock": 2, "low_stock": 2})
+
+    def test_counts_follow_filters_and_search(self):
+        facets = self.facets(search="red", unit_price__lt=100)
+        self.assertEqual(
+            [facet["title"] for facet in facets["collections"]], ["Hats", "Shoes"]
+        )
+        self.assertEqual(
+            [bucket["count"] for bucket in facets["price"]], [1, 0, 1, 0, 0]
+        )
+        self.assertEqual(facets["stock"], {"in_stock": 1, "low_stock": 1})
+
+        facets = self.facets(collection_id=self.shoes.id)
+        self.assertEqual(
+            facets["collections"], [{"id": self.shoes.id, "title": "Shoes", "count": 2}]
+        )
+
+
+@override_settings(
+    ADMISSION_CONTROL={"ENABLED": False}, CATALOG_SYNC={"SETTLE_SECONDS": 0}
+)
+class CatalogSyncTests(TestCase):
+    # deleting a product empties the carts of every cart database
+    databases = "__all__"
+
+    def setUp(self):
+        self.collection = Collection.objects.create(title="Collection")
+        self.products = [
+            Product.objects.create(
+                title=f"Product {index}",
+                slug=f"product-{index}",
+                unit_price=Decimal("10.00"),
+                inventory=10,
+                collection=self.collection,
+            )
+            for index in range(3)
+        ]
+
+    def sync(self, since=None, **params):
+        if since is not None:
+            params["since"] = since
+        return APIClient().get("/store/catalog/", params).data
+
+    def product_ids(self, delta):
+        return sorted(product["id"] for product in delta["products"])
+
+    def test_deltas(self):
+        delta = self.sync()
+        self.assertEqual(delta["collections"][0]["id"], self.collection.id)
+        self.assertEqual(
+            self.product_ids(delta), [product.id for product in self.products]
+        )
+        self.assertFalse(delta["has_more"])
+
+        changed, deleted, _ = self.products
+        deleted_id = deleted.id
+        changed.unit_price = Decimal("12.00")
+        changed.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            deleted.delete()
+        delta = self.sync(delta["next"])
+        self.assertEqual(self.product_ids(delta), [changed.id])
+        self.assertEqual(delta["products"][0]["unit_price"], Decimal("12.00"))
+        self.assertEqual(delta["deleted"]["products"], [deleted_id])
+
+        delta = self.sync(delta["next"])
+        self.assertEqual(delta["products"], [])
+        self.assertEqual(delta["deleted"]["products"], [])
+
+    def test_paged(self):
+        token, product_ids = "0", []
+        while True:
+            delta = self.sync(token, limit=2)
+            product_ids += self.product_ids(delta)
+            token = delta["next"]
+            if not delta["has_more"]:
+                break
+        self.assertEqual(sorted(product_ids), [product.id for product in self.products])
+
+    def test_recent_changes_held_back(self):
+        token = self.sync()["next"]
+        self.products[0].save()
+        with override_settings(CATALOG_SYNC={"SETTLE_SECONDS": 60}):
+            delta = self.sync(token)
+        self.assertEqual(delta["products"], [])
+        self.assertEqual(delta["next"], token)
+        self.assertEqual(self.product_ids(self.sync(token)), [self.products[0].id])
+
+
+class ReviewStatsTests(TestCase):
+    # deleting a product empties the carts of every cart database
+    databases = "__all__"
+
+    def setUp(self):
+        collection = Collection.objects.create(title="Collection")
+        self.product = Product.objects.create(
+            title="Product",
+            slug="product",
+            unit_price=Decimal("10.00"),
+            inventory=10,
+            collection=collection,
+        )
+
+    def stats(self):
+        self.product.refresh_from_db()
+        return self.product.reviews_count, self.product.last_review_at
+
+    def test_maintained_by_review_signals(self):
+        first = Review.objects.create(product=self.product, name="A", description="-")
+        second = Review.objects.create(product=self.product, name="B", description="-")
+        self.assertEqual(self.stats(), (2, first.date))
+
+        Review.objects.filter(id=second.id).update(date=first.date - timedelta(1))
+        first.delete()
+        self.assertEqual(self.stats(), (1, first.date - timedelta(1)))
+        second.delete()
+        self.assertEqual(self.stats(), (0, None))
+        self.assertTrue(
+            CatalogChange.objects.filter(
+                kind=CatalogChange.KIND_PRODUCT, object_id=self.product.id
+            ).exists()
+        )
+
+    def test_recount(self):
+        Review.objects.create(product=self.product, name="A", description="-")
+        Product.objects.update(reviews_count=5, last_review_at=None)
+        reviewstats.recount()
+        self.assertEqual(self.stats(), (1, Review.objects.get().date))
+
+    def test_product_deleted_with_its_reviews(self):
+        for name in "ABC":
+            Review.objects.create(product=self.product, name=name, description="-")
+        product_id = self.product.id
+        with mock.patch.object(reviewstats, "review_removed") as review_removed:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.delete()
+        review_removed.assert_not_called()
+        self.assertEqual(
+            list(
+                CatalogChange.objects.filter(
+                    kind=CatalogChange.KIND_PRODUCT, object_id=product_id
+                ).values_list("deleted", flat=True)
+            ),
+            [True],
+        )
+
+        # and the reviews of a product deleted in bulk
+        product = Product.objects.create(
+            title="Other",
+            slug="other",
+            unit_price=Decimal("10.00"),
+            inventory=10,
+            collection=Collection.objects.get(),
+        )
+        Review.objects.create(product=product, name="A", description="-")
+        with mock.patch.object(reviewstats, "review_removed") as review_removed:
+            with self.captureOnCommitCallbacks(execute=True):
+                Product.objects.filter(id=product.id).delete()
+        review_removed.assert_not_called()
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title="Collection")
+        self.product = Product.objects.create(
+            title="Product",
+            slug="product",
+            unit_price=Decimal("10.00"),
+            inventory=10,
+            collection=collection,
+        )
+        user = User.objects.create_user("customer", "customer@example.com")
+        self.customer = Customer.objects.get(user=user)
+
+    def rollups(self):
+        return list(
+            DailyProductSales.objects.values_list(
+                "payment_status", "orders", "quantity"
+            ).order_by("payment_status")
+        )
+
+    def test_updated_once_committed(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            order = Order.objects.create(customer=self.customer)
+            items = [
+                order.items.create(product=self.product, quantity=2, unit_price=10)
+            ]
+            order_created.send(sender=None, order=order, items=items)
+        self.assertEqual(self.rollups(), [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.rollups(), [("P", 1, 2)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.payment_status = Order.PAYMENT_STATUS_COMPLETED
+            order.save()
+        self.assertEqual(self.rollups(), [("C", 1, 2), ("P", 0, 0)])
+
+
+@override_settings(ADMISSION_CONTROL={"ENABLED": False})
+class SalesAnalyticsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_superuser("admin", "admin@example.com", "password")
+        )
+
+    def test_top_products_limit(self):
+        url = "/store/analytics/top-products/"
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(url, {"limit": 100}).status_code, 200)
+        for limit in ("-1", "0", "101", "ten"):
+            response = self.client.get(url, {"limit": limit})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("limit", response.json())
+
+
+class CatalogSnapshotTests(TestCase):
+    # bulk deletes empty the carts of every cart database
+    databases = "__all__"
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f"{directory.name}/catalog.snapshot"
+        settings_override = override_settings(
+            CATALOG_SNAPSHOT={"ENABLED": True, "PATH": self.path, "CHECK_INTERVAL": 0}
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        collection = Collection.objects.create(title="Collection")
+        self.products = [
+            Product.objects.create(
+                title=f"Product {index}",
+                slug=f"product-{index}",
+                unit_price=Decimal("10.00"),
+                inventory=10,
+                collection=collection,
+            )
+            for index in range(2)
+        ]
+        snapshot.build(self.path)
+
+    def test_set_aside_by_writes_until_rebuilt(self):
+        self.assertIsNotNone(snapshot.get_snapshot())
+
+        product = self.products[0]
+        product.unit_price = Decimal("12.00")
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertIsNone(snapshot.get_snapshot())
+
+        snapshot.build(self.path)
+        current = snapshot.get_snapshot()
+        row = current.product_row(product.id)
+        self.assertEqual(current.product(row)["unit_price"], Decimal("12.00"))
+
+    def test_set_aside_by_bulk_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_products([self.products[1].id])
+        self.assertIsNone(snapshot.get_snapshot())
+
+
+class BatchAdmissionTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        classes = {
+            "catalog_reads": {
+                "methods": ["GET"],
+                "path": r"^/store/products/",
+                "max_concurrency": 8,
+                "rate": 0.001,
+                "burst": 2,
+            },
+            "batch": {"methods": ["POST"], "path": r"^/store/batch/$"},
+        }
+        settings_override = override_settings(
+            ADMISSION_CONTROL={
+                "ENABLED": True,
+                "STATE_FILE": f"{directory.name}/admission",
+                "CLASSES": classes,
+            }
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # the state of the process is opened for these classes
+        state_patch = mock.patch.object(admission, "_state", None)
+        state_patch.start()
+        self.addCleanup(state_patch.stop)
+
+    def test_sub_requests_take_tokens(self):
+        batch = {"requests": [{"method": "GET", "path": "/store/products/"}] * 3}
+        response = APIClient().post("/store/batch/", batch, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [sub["status"] for sub in response.data["responses"]], [200, 200, 429]
+        )
+        self.assertEqual(APIClient().get("/store/products/").status_code, 429)
+
+
+class ImageBlobTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        collection = Collection.objects.create(title="Collection")
+        self.product = Product.objects.create(
+            title="Product",
+            slug="product",
+            unit_price=Decimal("10.00"),
+            inventory=10,
+            collection=collection,
+        )
+        self.name = "store/images/ba/" + hashlib.sha256(b"abc").hexdigest() + ".jpg"
+
+    def add_image(self, content=b"abc"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductImage.objects.create(
+                product=self.product, image=SimpleUploadedFile("photo.JPG", content)
+            )
+
+    def references(self):
+        return ImageBlob.objects.get(name=self.name).references
+
+    def test_identical_uploads_are_stored_once(self):
+        first, second = self.add_image(), self.add_image()
+        self.assertEqual(first.image.name, self.name)
+        self.assertEqual(second.image.name, self.name)
+        self.assertEqual(self.references(), 2)
+        self.assertEqual(
+            os.listdir(os.path.dirname(image_storage.path(self.name))),
+            [os.path.basename(self.name)],
+        )
+
+    def test_file_deleted_with_its_last_reference(self):
+        first, second = self.add_image(), self.add_image()
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(self.references(), 1)
+        self.assertTrue(image_storage.exists(self.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(ImageBlob.objects.filter(name=self.name).exists())
+        self.assertFalse(image_storage.exists(self.name))
+
+    def test_file_collected_while_uploading(self):
+        self.add_image()
+        save = ContentAddressedStorage.save
+
+        def save_then_collect(storage, name, content, max_length=None):
+            saved = save(storage, name, content, max_length)
+            # the last image using the file was deleted meanwhile
+            storage.delete(saved)
+            return saved
+
+        with mock.patch.object(ContentAddressedStorage, "save", save_then_collect):
+            image = self.add_image()
+        self.assertEqual(image.image.name, self.name)
+        with image_storage.open(self.name) as file:
+            self.assertEqual(file.read(), b"abc")
+        self.assertEqual(self.references(), 2)
+
+    def test_concurrent_saves_keep_the_hashed_name(self):
+        for _ in range(2):
+            # as if the other upload stored the file after the exists check
+            name = image_storage.restore(self.name, ContentFile(b"abc"))
+            self.assertEqual(name, self.name)
+        self.assertEqual(
+            os.listdir(os.path.dirname(image_storage.path(self.name))),
+            [os.path.basename(self.name)],
+        )
+
+
+@override_settings(ADMISSION_CONTROL={"ENABLED": False})
+class BulkDeleteTests(TestCase):
+    # cart items are deleted from every cart database
+    databases = "__all__"
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.collection = Collection.objects.create(title="Collection")
+        self.products = [
+            Product.objects.create(
+                title=f"Product {index}",
+                slug=f"product-{index}",
+                unit_price=Decimal("10.00"),
+                inventory=10,
+                collection=self.collection,
+            )
+            for index in range(3)
+        ]
+        self.cart = Cart.objects.create()
+        with self.captureOnCommitCallbacks(execute=True):
+            for product in self.products:
+                CartItem.objects.create(cart=self.cart, product=product, quantity=1)
+                Review.objects.create(product=product, name="Name", description="-")
+                ProductImage.objects.create(
+                    product=product, image=SimpleUploadedFile("photo.jpg", b"abc")
+                )
+        self.name = ProductImage.objects.first().image.name
+        indexes.get_ordered_product_ids(self.collection.id, "title")
+
+        user = User.objects.create_user("customer", "customer@example.com", "x")
+        order = Order.objects.create(customer=Customer.objects.get(user=user))
+        OrderItem.objects.create(
+            order=order, product=self.products[2], quantity=1, unit_price=10
+        )
+
+    def test_delete_products(self):
+        ids = [product.id for product in self.products]
+        image_ids = list(
+            ProductImage.objects.filter(product_id__in=ids[:2]).values_list(
+                "id", flat=True
+            )
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            result = delete_products(ids + [0])
+        self.assertEqual(result["deleted"], ids[:2])
+        self.assertEqual(
+            result["blocked"], [{"id": ids[2], "reason": "referenced by order items"}]
+        )
+        self.assertEqual(result["not_found"], [0])
+
+        self.assertEqual(
+            list(
+                CartItem.objects.for_cart(self.cart.id).values_list(
+                    "product_id", flat=True
+                )
+            ),
+            [ids[2]],
+        )
+        for model in (Review, ProductImage):
+            self.assertEqual(
+                list(model.objects.values_list("product_id", flat=True)), [ids[2]]
+            )
+        self.assertEqual(
+            indexes.get_ordered_product_ids(self.collection.id, "title"), [ids[2]]
+        )
+        self.assertEqual(ImageBlob.objects.get(name=self.name).references, 1)
+        self.assertTrue(image_storage.exists(self.name))
+        self.assertEqual(
+            set(
+                CatalogChange.objects.filter(deleted=True).values_list(
+                    "kind", "object_id"
+                )
+            ),
+            {(CatalogChange.KIND_PRODUCT, id) for id in ids[:2]}
+            | {(CatalogChange.KIND_IMAGE, id) for id in image_ids},
+        )
+
+    def test_last_references_released(self):
+        OrderItem.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_products([product.id for product in self.products])
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(image_storage.exists(self.name))
+        self.assertFalse(CartItem.objects.for_cart(self.cart.id).exists())
+
+    def test_references_below_the_deleted_images(self):
+        ImageBlob.objects.update(references=1)
+        OrderItem.objects.all().delete()
+        with self.assertLogs("store.bulkdelete", "WARNING"):
+            with self.captureOnCommitCallbacks(execute=True):
+                delete_products([product.id for product in self.products[:2]])
+        # recounted from the image left
+        self.assertEqual(ImageBlob.objects.get(name=self.name).references, 1)
+        self.assertTrue(image_storage.exists(self.name))
+
+    def test_delete_collections(self):
+        empty = Collection.objects.create(title="Empty")
+        indexes.get_ordered_product_ids(empty.id, "title")
+        result = delete_collections([self.collection.id, empty.id])
+        self.assertEqual(result["deleted"], [empty.id])
+        self.assertEqual(
+            result["blocked"], [{"id": self.collection.id, "reason": "has products"}]
+        )
+        self.assertEqual(
+            list(
+                CollectionProductIndex.objects.values_list("collection_id", flat=True)
+            ),
+            [self.collection.id],
+        )
+        self.assertTrue(
+            CatalogChange.objects.filter(
+                kind=CatalogChange.KIND_COLLECTION, object_id=empty.id, deleted=True
+            ).exists()
+        )
+
+
+class CollectionIndexTests(TestCase):
+    # deleting a product empties the carts of every cart database
+    databases = "__all__"
+
+    def setUp(self):
+        self.collection = Collection.objects.create(title="Collection")
+        self.products = [
+            Product.objects.create(
+                title=title,
+                slug=title.lower(),
+                unit_price=Decimal(unit_price),
+                inventory=10,
+                collection=self.collection,
+            )
+            for title, unit_price in [("b", "30.00"), ("A", "10.00"), ("c", "20.00")]
+        ]
+
+    def ordered(self, sort_key, collection=None):
+        collection = collection or self.collection
+        return indexes.get_ordered_product_ids(collection.id, sort_key)
+
+    def ids(self, *positions):
+        return [self.products[position].id for position in positions]
+
+    def test_built_lazily_for_each_key(self):
+        self.assertFalse(CollectionProductIndex.objects.exists())
+        self.assertEqual(self.ordered("title"), self.ids(1, 0, 2))
+        self.assertEqual(self.ordered("unit_price"), self.ids(1, 2, 0))
+        self.assertEqual(CollectionProductIndex.objects.count(), 2)
+        self.assertIsNone(indexes.get_ordered_product_ids(0, "title"))
+
+    def test_maintained_by_product_saves(self):
+        self.ordered("unit_price")
+        other = Collection.objects.create(title="Other")
+        self.ordered("unit_price", other)
+
+        self.products[0].unit_price = Decimal("5.00")
+        self.products[0].save()
+        self.assertEqual(self.ordered("unit_price"), self.ids(0, 1, 2))
+
+        added = Product.objects.create(
+            title="d",
+            slug="d",
+            unit_price=Decimal("15.00"),
+            inventory=10,
+            collection=self.collection,
+        )
+        self.assertEqual(
+            self.ordered("unit_price"), self.ids(0, 1) + [added.id] + self.ids(2)
+        )
+
+        added.collection = other
+        added.save()
+        self.assertEqual(self.ordered("unit_price"), self.ids(0, 1, 2))
+        self.assertEqual(self.ordered("unit_price", other), [added.id])
+
+        self.products[1].delete()
+        self.assertEqual(self.ordered("unit_price"), self.ids(0, 2))
+
+    def test_queryset_updates_need_a_rebuild(self):
+        self.ordered("unit_price")
+        Product.objects.filter(id=self.products[0].id).update(unit_price=5)
+        self.assertEqual(self.ordered("unit_price"), self.ids(1, 2, 0))
+
+        call_command("rebuild_collection_indexes", stdout=StringIO())
+        self.assertEqual(self.ordered("unit_price"), self.ids(0, 1, 2))
+
+
+# the server threads share the connection of an in-memory SQLite test database,
+# their query budgets would count each other's statements
+@override_settings(
+    ADMISSION_CONTROL={"ENABLED": False},
+    QUERY_BUDGETS={**settings.QUERY_BUDGETS, "MODE": "off"},
+)
+class LoadCheckoutTests(LiveServerTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        collection = Collection.objects.create(title="Collection")
+        for index in range(5):
+            Product.objects.create(
+                title=f"Product {index}",
+                slug=f"product-{index}",
+                unit_price=Decimal("10.00"),
+                inventory=100,
+                collection=collection,
+            )
+
+    def test_report(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "report.json")
+        call_command(
+            "load_checkout",
+            f"--url={self.live_server_url}",
+            "--shoppers=2",
+            "--checkouts=2",
+            "--items-per-cart=3",
+            "--duration=60",
+            f"--json={path}",
+            stdout=StringIO(),
+        )
+        with open(path) as file:
+            report = json.load(file)
+        self.assertEqual(report["checkouts"], 4)
+        self.assertEqual(report["steps"]["checkout"]["ok"], 4)
+        self.assertEqual(report["steps"]["checkout"]["errors"], {})
+        self.assertEqual(report["lost_increments"], 0)
+        self.assertEqual(set(report["consistency"].values()), {0})
+        self.assertEqual(Order.objects.count(), 4)
+
+    def test_error_kinds(self):
+        for status, body, kind in [
+            (None, "ConnectionRefusedError()", "network"),
+            (503, "", "rejected"),
+            (500, "OperationalError: (1213, 'Deadlock found')", "deadlock"),
+            (500, "database is locked", "database_locked"),
+            (500, "", "server"),
+            (400, "", "client"),
+        ]:
+            self.assertEqual(loadtest.classify(status, body), kind)
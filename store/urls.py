@@ -1,5 +1,6 @@
+from django.urls import path
 from rest_framework_nested import routers
-from . import views
+from . import events, views
 
 # parent router -> /products, /collections
 router = routers.DefaultRouter()
@@ -8,14 +9,31 @@ router.register("collections", views.CollectionViewSet)
 router.register("carts", views.CartViewSet, basename="carts")
 router.register("customers", views.CustomerViewSet)
 router.register("orders", views.OrderViewSet, basename="orders")
+router.register("batch", views.BatchViewSet, basename="batch")
+router.register("catalog", views.CatalogSyncViewSet, basename="catalog")
+router.register("analytics", views.SalesAnalyticsViewSet, basename="analytics")
 
 # children router -> /products/1/reviews
 product_router = routers.NestedDefaultRouter(router, "products", lookup="product")
 product_router.register("reviews", views.ReviewViewSet, basename="product-reviews")
 product_router.register("images", views.ProductImageViewSet, basename="product-images")
 
+collection_router = routers.NestedDefaultRouter(
+    router, "collections", lookup="collection"
+)
+collection_router.register(
+    "products", views.CollectionProductViewSet, basename="collection-products"
+)
+
 cart_router = routers.NestedDefaultRouter(router, "carts", lookup="cart")
 cart_router.register("items", views.CartItemViewSet, basename="cart-items")
 
 
-urlpatterns = router.urls + product_router.urls + cart_router.urls
+urlpatterns = (
+    # before the router, which would read "events" as an order id
+    [path("orders/events/", events.order_events, name="order-events")]
+    + router.urls
+    + product_router.urls
+    + collection_router.urls
+    + cart_router.urls
+)
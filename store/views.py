@@ -1,8 +1,23 @@
-from django.db.models import Count
+import json
+import logging
+from contextlib import ExitStack, nullcontext
+from io import BytesIO
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import prefetch_related_objects
+from datetime import timedelta
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.http import parse_etags
+from django.urls import Resolver404, resolve
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework.mixins import (
     CreateModelMixin,
+    ListModelMixin,
     RetrieveModelMixin,
     DestroyModelMixin,
 )
@@ -10,8 +25,12 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated, IsAdminUser
-from store.pagination import DefaultPagination
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, SAFE_METHODS
+from core import budgets, identity
+from core.identity import IdentityMapViewSetMixin
+from core.middleware import AdmissionControlMiddleware
+from store.pagination import DefaultPagination, ReviewPagination
 from .serializers import (
     AddCartItemSerializer,
     CartItemSerializer,
@@ -25,6 +44,12 @@ from .serializers import (
     CreateOrderSerializer,
     UpdateOrderSerializer,
     ProductImageSerializer,
+    BatchSerializer,
+    BulkDeleteSerializer,
+    ProductRecommendationSerializer,
+    CatalogImageSerializer,
+    SimpleCollectionSerializer,
+    TopProductsSerializer,
 )
 from .models import (
     Cart,
@@ -36,19 +61,45 @@ from .models import (
     Customer,
     Order,
     ProductImage,
+    ProductRecommendation,
+    DailyProductSales,
+    DailyCollectionSales,
+    CatalogChange,
 )
 from .filters import ProductFilter
 from .permissions import IsAdminOrViewOnly
+from .indexes import get_ordered_product_ids
+from .fieldsets import SparseFieldsViewSetMixin
+from .facets import product_facets
+from .autocomplete import MAX_SUGGESTIONS, title_index
+from .carts import get_summary as get_cart_summary
+from .bulkdelete import delete_collections, delete_products
+from .snapshot import SnapshotCollectionMixin, SnapshotProductMixin
+from . import sharding
 
+logger = logging.getLogger(__name__)
 
-class CollectionViewSet(ModelViewSet):
+
+class CollectionViewSet(
+    SnapshotCollectionMixin, SparseFieldsViewSetMixin, ModelViewSet
+):
     queryset = Collection.objects.annotate(products_count=Count("products")).all()
     serializer_class = CollectionSerializer
     permission_classes = [IsAdminOrViewOnly]
+    sparse_columns = {"products_count": []}
+
+    def get_queryset(self):
+        queryset = Collection.objects.all()
+        if self.wants("products_count"):
+            queryset = queryset.annotate(products_count=Count("products"))
+        columns = self.get_columns(Collection)
+        if columns is not None:
+            queryset = queryset.only(*columns)
+        return queryset
 
     def destroy(self, request, *args, **kwargs):
         collection_id = kwargs.get("pk")
-        if Product.objects.filter(collection_id=collection_id).count() > 0:
+        if Product.objects.filter(collection_id=collection_id).exists():
             return Response(
                 {
                     "error": "Collection cannot be deleted because it associated with product"
@@ -57,11 +108,41 @@ class CollectionViewSet(ModelViewSet):
             )
         return super().destroy(request, *args, **kwargs)
 
-
-class ProductViewSet(ModelViewSet):
-    queryset = (
-        Product.objects.select_related("collection").prefetch_related("images").all()
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="bulk-delete",
+        permission_classes=[IsAdminUser],
     )
+    def bulk_delete(self, request):
+        """deletes `{"ids": [...]}` set-based, see store.bulkdelete"""
+        serializer = BulkDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(delete_collections(serializer.validated_data["ids"]))
+
+
+class ProductQuerysetMixin(SparseFieldsViewSetMixin):
+    sparse_columns = {"price_with_tax": ["unit_price"], "images": []}
+
+    def get_queryset(self):
+        queryset = Product.objects.all()
+        if self.wants("images"):
+            queryset = queryset.prefetch_related("images")
+        if self.expands("collection"):
+            queryset = queryset.select_related("collection")
+
+        columns = self.get_columns(Product)
+        if columns is not None:
+            queryset = queryset.only(*columns)
+        elif self.request.method in SAFE_METHODS:
+            # not part of the representation, and potentially large
+            queryset = queryset.defer("description")
+        return queryset
+
+
+class ProductViewSet(
+    SnapshotProductMixin, IdentityMapViewSetMixin, ProductQuerysetMixin, ModelViewSet
+):
     serializer_class = ProductSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_class = ProductFilter
@@ -69,10 +150,45 @@ class ProductViewSet(ModelViewSet):
     ordering_fields = ["unit_price", "last_update"]
     pagination_class = DefaultPagination
     permission_classes = [IsAdminOrViewOnly]
+    # core.budgets
+    query_budgets = {
+        "list": {"queries": 8, "db_time": 0.3},
+        "retrieve": {"queries": 5, "db_time": 0.1},
+    }
+
+    def list(self, request, *args, **kwargs):
+        """`?facets=true` adds facet counts for the current filters and search"""
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get("facets") in ("1", "true"):
+            response.data["facets"] = product_facets(
+                self.filter_queryset(self.get_queryset())
+            )
+        return response
+
+    @action(detail=False)
+    def autocomplete(self, request):
+        """typeahead suggestions for `?q=`, from the in-process title index"""
+        try:
+            limit = int(request.query_params.get("limit", 5))
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            raise ValidationError({"limit": "A positive integer is required"})
+        limit = min(limit, MAX_SUGGESTIONS)
+        return Response(title_index.suggest(request.query_params.get("q", ""), limit))
+
+    @action(detail=True)
+    def recommendations(self, request, pk=None):
+        """products frequently bought together with this one, precomputed"""
+        recommendations = ProductRecommendation.objects.filter(
+            product_id=pk
+        ).select_related("recommended")
+        serializer = ProductRecommendationSerializer(recommendations, many=True)
+        return Response(serializer.data)
 
     def destroy(self, request, *args, **kwargs):
         product_id = kwargs.get("pk")
-        if OrderItem.objects.filter(product_id=product_id).count() > 0:
+        if OrderItem.objects.filter(product_id=product_id).exists():
             return Response(
                 {
                     "error": "Product cannot be deleted because it associated with an order item"
@@ -81,9 +197,65 @@ class ProductViewSet(ModelViewSet):
             )
         return super().destroy(request, *args, **kwargs)
 
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="bulk-delete",
+        permission_classes=[IsAdminUser],
+    )
+    def bulk_delete(self, request):
+        """
+        - deletes `{"ids": [...]}` set-based, see store.bulkdelete
+
+        - products referenced by order items are reported in `blocked`
+        """
+        serializer = BulkDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = delete_products(serializer.validated_data["ids"])
+        for product_id in result["deleted"]:
+            identity.forget(Product, product_id)
+        return Response(result)
+
+
+class CollectionProductViewSet(ProductQuerysetMixin, ListModelMixin, GenericViewSet):
+    """
+    - lists the products of a collection from its precomputed sorted index
+
+    - a page costs a single primary-key lookup instead of re-sorting the collection
+    """
+
+    serializer_class = ProductSerializer
+    pagination_class = DefaultPagination
+    ordering_fields = ["title", "unit_price", "last_update"]
+
+    def get_sort(self):
+        ordering = self.request.query_params.get("ordering", "title")
+        sort_key = ordering.lstrip("-")
+        if sort_key not in self.ordering_fields:
+            raise ValidationError(
+                {"ordering": f"ordering must be one of {self.ordering_fields}"}
+            )
+        return sort_key, ordering.startswith("-")
+
+    def list(self, request, *args, **kwargs):
+        sort_key, descending = self.get_sort()
+        product_ids = get_ordered_product_ids(self.kwargs["collection_pk"], sort_key)
+        if product_ids is None:
+            raise NotFound("No collection with the given id was found")
+        if descending:
+            product_ids.reverse()
+
+        page = self.paginate_queryset(product_ids)
+        products = self.get_queryset().in_bulk(page)
+        serializer = self.get_serializer(
+            [products[pk] for pk in page if pk in products], many=True
+        )
+        return self.get_paginated_response(serializer.data)
+
 
 class ReviewViewSet(ModelViewSet):
     serializer_class = ReviewSerializer
+    pagination_class = ReviewPagination
 
     def get_serializer_context(self):
         return {"product_id": self.kwargs["product_pk"]}
@@ -104,14 +276,69 @@ class ProductImageViewSet(ModelViewSet):
 
 
 class CartViewSet(
-    CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet
+    IdentityMapViewSetMixin,
+    SparseFieldsViewSetMixin,
+    CreateModelMixin,
+    RetrieveModelMixin,
+    DestroyModelMixin,
+    GenericViewSet,
 ):
-    queryset = Cart.objects.prefetch_related("items__product").all()
     serializer_class = CartSerializer
+    sparse_columns = {"items": [], "total_price": []}
+    query_budgets = {
+        "retrieve": {"queries": 5, "db_time": 0.1},
+        "summary": {"queries": 4, "db_time": 0.1},
+    }
+
+    def get_queryset(self):
+        # the one cart of the url, from its shard (store.sharding)
+        try:
+            queryset = Cart.objects.for_cart(Cart._meta.pk.to_python(self.kwargs["pk"]))
+        except DjangoValidationError:
+            raise NotFound()
+        if self.wants("items") or self.wants("total_price"):
+            queryset = queryset.prefetch_related("items__product")
+        columns = self.get_columns(Cart)
+        if columns is not None:
+            queryset = queryset.only(*columns)
+        return queryset
+
+    @action(detail=True)
+    def summary(self, request, pk=None):
+        """
+        - item count and total for header badges, from one aggregate query or
+        the cache (store.carts)
+
+        - conditional: `If-None-Match` with the current ETag returns 304
+        """
+        try:
+            cart_id = Cart._meta.pk.to_python(pk)
+        except DjangoValidationError:
+            raise NotFound()
+        summary = get_cart_summary(cart_id)
+        if summary is None:
+            raise NotFound()
+
+        etag = summary.pop("etag")
+        # weak comparison: the compression middleware marks compressed ETags weak
+        if etag in {
+            tag.removeprefix("W/")
+            for tag in parse_etags(request.headers.get("If-None-Match", ""))
+        }:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(summary)
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        return response
 
 
 class CartItemViewSet(ModelViewSet):
     http_method_names = ["get", "post", "patch", "delete"]
+    query_budgets = {
+        "list": {"queries": 4, "db_time": 0.1},
+        "create": {"queries": 6, "db_time": 0.1},
+    }
 
     # overriding the serializer class to perform serialization based on the request method
     def get_serializer_class(self):
@@ -121,25 +348,30 @@ class CartItemViewSet(ModelViewSet):
             return UpdateCartItemSerializer
         return CartItemSerializer
 
+    def get_cart_id(self):
+        try:
+            return Cart._meta.pk.to_python(self.kwargs["cart_pk"])
+        except DjangoValidationError:
+            raise NotFound()
+
     # overriding the queryset to filter by cart_id
     def get_queryset(self):
-        return CartItem.objects.filter(cart_id=self.kwargs["cart_pk"]).select_related(
-            "product"
-        )
+        # products are not in the cart's database (store.sharding): no join
+        return CartItem.objects.for_cart(self.get_cart_id()).prefetch_related("product")
 
     def get_serializer_context(self):
-        return {"cart_id": self.kwargs["cart_pk"]}
+        return {"cart_id": self.get_cart_id()}
 
 
 # Customer Profile ViewSet
-class CustomerViewSet(ModelViewSet):
+class CustomerViewSet(IdentityMapViewSetMixin, ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     permission_classes = [IsAdminUser]
 
     @action(detail=False, methods=["GET", "PUT"], permission_classes=[IsAuthenticated])
     def me(self, request):
-        customer = Customer.objects.get(user_id=request.user.id)
+        customer = identity.get(Customer, user_id=request.user.id)
         if request.method == "GET":
             serializer = CustomerSerializer(customer)
             return Response(serializer.data)
@@ -147,10 +379,11 @@ class CustomerViewSet(ModelViewSet):
             serializer = CustomerSerializer(customer, data=request.data)
             serializer.is_valid(raise_exception=True)
             serializer.save()
+            identity.forget(customer)
             return Response(serializer.data)
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(SparseFieldsViewSetMixin, ModelViewSet):
     http_method_names = ["get", "post", "patch", "delete", "head", "options"]
     """
     - Admin should be able to see all orders, and detail operations
@@ -164,8 +397,17 @@ class OrderViewSet(ModelViewSet):
             return UpdateOrderSerializer
         return OrderSerializer
 
+    sparse_columns = {"items": []}
+    query_budgets = {
+        "list": {"queries": 8, "db_time": 0.3},
+        "retrieve": {"queries": 6, "db_time": 0.1},
+        # grows with the cart: the sales rollups and recommendations are updated
+        # per product (store.signals)
+        "create": {"queries": 100, "db_time": 1.0},
+    }
+
     def get_serializer_context(self):
-        return {"user_id": self.request.user.id}
+        return {"user_id": self.request.user.id, **self.get_fieldset_context()}
 
     def get_permissions(self):
         if self.request.method in ["PATCH", "DELETE"]:
@@ -174,11 +416,20 @@ class OrderViewSet(ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
-        customer = Customer.objects.get(user_id=user.id)
+        customer = identity.get(Customer, user_id=user.id)
+
+        queryset = Order.objects.all()
+        if not user.is_staff:
+            queryset = queryset.filter(customer_id=customer.id)
 
-        if user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(customer_id=customer.id)
+        if self.wants("items"):
+            queryset = queryset.prefetch_related("items__product")
+        if self.expands("customer"):
+            queryset = queryset.select_related("customer")
+        columns = self.get_columns(Order)
+        if columns is not None:
+            queryset = queryset.only(*columns)
+        return queryset
 
     """Returning the created order object structure instead of cart_id from the CreateOrder serializer"""
 
@@ -188,5 +439,277 @@ class OrderViewSet(ModelViewSet):
         )
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
+        # one query for the items' products, not one per item
+        prefetch_related_objects([order], "items__product")
         serializer = OrderSerializer(order)
         return Response(serializer.data)
+
+
+class BatchViewSet(GenericViewSet):
+    """
+    - runs a list of sub-requests against the store endpoints in-process, so the
+    http round trip and authentication are paid once for the whole batch
+
+    - sub-requests share the authenticated user of the batch request and keep their
+    own permission checks
+
+    - each sub-request is held to the query budget of its own view and goes
+    through admission control in its own endpoint class, as if it was sent on its
+    own (core.budgets, core.middleware.AdmissionControlMiddleware): a throttled
+    sub-request gets a 429 (503 when its class is busy) in its response
+
+    - with `atomic`, the sub-requests run in one transaction per database (the
+    default one and the cart databases, see store.sharding) which are all rolled
+    back (and the remaining sub-requests skipped) as soon as one of them fails.
+    Once every sub-request succeeded they are committed one after the other: a
+    failing commit can still leave the others committed
+    """
+
+    serializer_class = BatchSerializer
+    # the sub-requests have the budgets and statement timeouts of their views
+    query_budgets = {
+        "create": {"queries": None, "db_time": None, "statement_timeout": None}
+    }
+
+    def sub_request(self, request, method, path, body):
+        path, _, query_string = path.partition("?")
+        content = json.dumps(body).encode() if body is not None else b""
+        environ = {
+            **request._request.META,
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path,
+            "QUERY_STRING": query_string,
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(content)),
+            "wsgi.input": BytesIO(content),
+        }
+        sub_request = WSGIRequest(environ)
+        # picked up by DRF instead of re-running the authentication classes
+        sub_request._force_auth_user = request.user
+        sub_request._force_auth_token = request.auth
+        return sub_request
+
+    def sub_budget(self, method, view_func):
+        """the query budget of a sub-request, None when budgets are off"""
+        mode = budgets.config("MODE", "log")
+        if mode == "off":
+            return None
+        sub_budget = budgets.RequestBudget(method, mode)
+        sub_budget.name, sub_budget.budget = budgets.view_budget(view_func, method)
+        return sub_budget
+
+    def call(self, sub_request, item, match):
+        """the response of the view, None when it failed"""
+        sub_budget = self.sub_budget(item["method"], match.func)
+        counting = nullcontext() if sub_budget is None else budgets.counting(sub_budget)
+        try:
+            with counting:
+                response = match.func(sub_request, *match.args, **match.kwargs)
+        except Exception:
+            logger.exception(
+                "Batched request %s %s failed", item["method"], item["path"]
+            )
+            response = None
+        if sub_budget is not None:
+            try:
+                sub_budget.finish()
+            except budgets.QueryBudgetError:
+                return budgets.error_response(sub_request)
+        return response
+
+    def run(self, request, item):
+        try:
+            match = resolve(item["path"].partition("?")[0])
+        except Resolver404:
+            return {
+                "status": status.HTTP_404_NOT_FOUND,
+                "body": {"detail": "Not found."},
+            }
+
+        sub_request = self.sub_request(
+            request, item["method"], item["path"], item.get("body")
+        )
+        with AdmissionControlMiddleware(None).admitted(sub_request) as rejected:
+            response = rejected or self.call(sub_request, item, match)
+        if response is None:
+            return {
+                "status": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                "body": {"detail": "A server error occurred."},
+            }
+
+        if hasattr(response, "data"):
+            body = response.data
+        elif response.get("Content-Type", "").startswith("application/json"):
+            body = json.loads(response.content or b"null")
+        else:
+            body = response.content.decode()
+        return {"status": response.status_code, "body": body}
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data["requests"]
+
+        if not serializer.validated_data["atomic"]:
+            return Response({"responses": [self.run(request, item) for item in items]})
+
+        responses = []
+        aliases = list(dict.fromkeys([DEFAULT_DB_ALIAS, *sharding.databases()]))
+        with ExitStack() as stack:
+            for alias in aliases:
+                stack.enter_context(transaction.atomic(using=alias))
+            for item in items:
+                responses.append(self.run(request, item))
+                if responses[-1]["status"] >= 400:
+                    for alias in aliases:
+                        transaction.set_rollback(True, using=alias)
+                    break
+
+        rolled_back = responses[-1]["status"] >= 400
+        responses += [
+            {
+                "status": status.HTTP_424_FAILED_DEPENDENCY,
+                "body": {"detail": "Not executed, an earlier request failed."},
+            }
+            for _ in items[len(responses) :]
+        ]
+        return Response({"responses": responses, "rolled_back": rolled_back})
+
+
+class SalesAnalyticsViewSet(GenericViewSet):
+    """
+    - admin-only sales analytics, answered from the daily rollup tables
+
+    - `start` / `end` (YYYY-MM-DD, default: the last 30 days) and `payment_status`
+    (comma separated, default: pending and completed orders) filter every report
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get_date(self, name, default):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return default
+        date = parse_date(value)
+        if date is None:
+            raise ValidationError({name: "Enter a date in the YYYY-MM-DD format"})
+        return date
+
+    def filter_rollups(self, queryset):
+        end = self.get_date("end", timezone.localdate())
+        start = self.get_date("start", end - timedelta(days=29))
+        statuses = self.request.query_params.get(
+            "payment_status",
+            f"{Order.PAYMENT_STATUS_PENDING},{Order.PAYMENT_STATUS_COMPLETED}",
+        ).split(",")
+        return queryset.filter(
+            date__gte=start, date__lte=end, payment_status__in=statuses
+        )
+
+    @action(detail=False)
+    def collections(self, request):
+        """revenue per collection per day"""
+        rows = (
+            self.filter_rollups(DailyCollectionSales.objects.all())
+            .values("date", "collection_id", collection_title=F("collection__title"))
+            .annotate(quantity=Sum("quantity"), revenue=Sum("revenue"))
+            .order_by("date", "collection_id")
+        )
+        return Response(list(rows))
+
+    @action(detail=False, url_path="top-products")
+    def top_products(self, request):
+        """best selling products by revenue over the period"""
+        serializer = TopProductsSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        limit = serializer.validated_data["limit"]
+        rows = (
+            self.filter_rollups(DailyProductSales.objects.all())
+            .values("product_id", product_title=F("product__title"))
+            .annotate(
+                orders=Sum("orders"), quantity=Sum("quantity"), revenue=Sum("revenue")
+            )
+            .order_by("-revenue", "product_id")[:limit]
+        )
+        return Response(list(rows))
+
+
+class CatalogSyncViewSet(GenericViewSet):
+    """
+    - delta sync of the catalog: `?since=<token>` returns the collections, products
+    and images changed since the token, and the ids of the deleted ones; without a
+    token, the whole catalog
+
+    - a delta is paged through the change log: follow `next` while `has_more`,
+    and keep the last `next` as the token of the following sync
+
+    - changes younger than `CATALOG_SYNC["SETTLE_SECONDS"]` are held back until a
+    later sync, so that a transaction that commits late cannot slip below a token
+    already handed out
+    """
+
+    def get_int(self, name, default, maximum=None):
+        try:
+            value = int(self.request.query_params.get(name, default))
+        except ValueError:
+            value = -1
+        if value < 0:
+            raise ValidationError({name: "A positive integer is required"})
+        return value if maximum is None else min(value, maximum)
+
+    def list(self, request):
+        config = getattr(settings, "CATALOG_SYNC", {})
+        since = self.get_int("since", 0)
+        limit = self.get_int(
+            "limit", config.get("PAGE_SIZE", 500), config.get("MAX_PAGE_SIZE", 2000)
+        )
+        settled = timezone.now() - timedelta(seconds=config.get("SETTLE_SECONDS", 5))
+
+        changes = list(
+            CatalogChange.objects.filter(id__gt=since, changed_at__lte=settled)
+            .order_by("id")
+            .values_list("id", "kind", "object_id", "deleted")[: limit + 1]
+        )
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        # rows are in log order, so the latest change of an object wins
+        latest = {}
+        for _, kind, object_id, deleted in changes:
+            latest[kind, object_id] = deleted
+        changed = {kind: [] for kind, _ in CatalogChange.KIND_CHOICES}
+        deleted = {kind: [] for kind, _ in CatalogChange.KIND_CHOICES}
+        for (kind, object_id), is_deleted in latest.items():
+            (deleted if is_deleted else changed)[kind].append(object_id)
+
+        context = self.get_serializer_context()
+        product_fields = set(ProductSerializer.Meta.fields) - {"images"}
+        return Response(
+            {
+                "collections": SimpleCollectionSerializer(
+                    Collection.objects.filter(
+                        id__in=changed[CatalogChange.KIND_COLLECTION]
+                    ),
+                    many=True,
+                ).data,
+                "products": ProductSerializer(
+                    Product.objects.filter(id__in=changed[CatalogChange.KIND_PRODUCT]),
+                    many=True,
+                    context={**context, "fields": product_fields},
+                ).data,
+                "images": CatalogImageSerializer(
+                    ProductImage.objects.filter(
+                        id__in=changed[CatalogChange.KIND_IMAGE]
+                    ),
+                    many=True,
+                    context=context,
+                ).data,
+                "deleted": {
+                    "collections": deleted[CatalogChange.KIND_COLLECTION],
+                    "products": deleted[CatalogChange.KIND_PRODUCT],
+                    "images": deleted[CatalogChange.KIND_IMAGE],
+                },
+                "next": str(changes[-1][0] if changes else since),
+                "has_more": has_more,
+            }
+        )